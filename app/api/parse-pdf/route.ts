@@ -6,13 +6,16 @@ import { spawn } from 'child_process'
 
 // Простая функция парсинга PDF (fallback для продакшена)
 async function parsePDFContentSimple(buffer: Buffer, bankName: string = 'Kaspi'): Promise<any[]> {
+  // Без Python банк не определить: при bankName = 'auto' не подставляем его в текст
+  const source = bankName === 'auto' ? 'PDF выписки' : `${bankName} Bank`
+
   // Возвращаем пример данных для демонстрации
   return [
     {
       date: new Date().toISOString().split('T')[0],
       type: "income",
       amount: 100000,
-      comment: `Пример транзакции из ${bankName} Bank (PDF парсинг недоступен на продакшене)`,
+      comment: `Пример транзакции из ${source} (PDF парсинг недоступен на продакшене)`,
       counterparty: "ТОО Пример контрагент",
       documentNumber: "12345",
       debit: "",
@@ -22,7 +25,7 @@ async function parsePDFContentSimple(buffer: Buffer, bankName: string = 'Kaspi')
       date: new Date().toISOString().split('T')[0],
       type: "expense",
       amount: 50000,
-      comment: `Пример расхода из ${bankName} Bank`,
+      comment: `Пример расхода из ${source}`,
       counterparty: "ИП Пример поставщик",
       documentNumber: "12346",
       debit: "50000.00",
@@ -31,7 +34,68 @@ async function parsePDFContentSimple(buffer: Buffer, bankName: string = 'Kaspi')
   ]
 }
 
-// Функция для парсинга PDF через Python скрипт (только для локальной разработки)
+// Преобразует операции Python парсера в формат приложения
+function mapPythonTransactions(pythonData: any[]): any[] {
+  return pythonData.map((item: any) => ({
+    date: item.ДатаОперации || item.date,
+    type: item.Тип === 'Доход' ? 'income' : 'expense',
+    amount: parseFloat(item.Сумма || item.amount || '0'),
+    comment: item.Комментарий || item.comment || '',
+    counterparty: item.Контрагент || item.counterparty || '',
+    // Дополнительные поля
+    documentNumber: item.НомерДокумента || item.documentNumber || '',
+    debit: item.Дебет || item.debit || '',
+    credit: item.Кредит || item.credit || ''
+  }))
+}
+
+// Сколько ждать ответа Python сервера (его собственный таймаут разбора — 120 с)
+const PDF_PARSER_TIMEOUT_MS = Number(process.env.PDF_PARSER_TIMEOUT_MS) || 130000
+
+// Ошибка разбора, которую вернул Python сервер: отдается клиенту как есть,
+// повторный разбор тем же PDF через скрипт ее не исправит
+class PdfParseError extends Error {
+  constructor(message: string, public status: number) {
+    super(message)
+  }
+}
+
+// Функция для парсинга PDF через долгоживущий Python сервер
+// (python3 pdf_parser_improved.py --serve, адрес в PDF_PARSER_URL).
+// Сетевые ошибки, таймаут и ответ не в JSON — обычный Error (сервер недоступен),
+// ответ сервера с ошибкой — PdfParseError
+async function parsePDFContentWorker(buffer: Buffer, bankName: string, workerUrl: string): Promise<any[]> {
+  const url = `${workerUrl.replace(/\/$/, '')}/parse?bank=${encodeURIComponent(bankName)}`
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/pdf' },
+    body: new Uint8Array(buffer),
+    signal: AbortSignal.timeout(PDF_PARSER_TIMEOUT_MS)
+  })
+
+  let data: any
+  try {
+    data = await response.json()
+  } catch (error) {
+    throw new Error(`Python сервер вернул не JSON (HTTP ${response.status})`)
+  }
+
+  if (!response.ok || data.error) {
+    // 4xx (битый или слишком большой PDF, операции не найдены) — ошибка запроса,
+    // 5xx — сбой сервера разбора
+    const status = response.status >= 500 ? 502 : (response.ok ? 422 : response.status)
+    throw new PdfParseError(data.error || `Python сервер вернул HTTP ${response.status}`, status)
+  }
+
+  if (!Array.isArray(data.transactions)) {
+    throw new Error('Python сервер вернул не массив данных')
+  }
+
+  return mapPythonTransactions(data.transactions)
+}
+
+// Функция для парсинга PDF через Python скрипт (только для локальной разработки).
+// bankName = 'auto' поддерживается: pdf_parser.py определит банк по первой странице
 async function parsePDFContentPython(buffer: Buffer, bankName: string = 'Kaspi'): Promise<any[]> {
   return new Promise((resolve, reject) => {
     const tempPath = join(tmpdir(), `pdf-${Date.now()}.pdf`)
@@ -101,19 +165,7 @@ async function parsePDFContentPython(buffer: Buffer, bankName: string = 'Kaspi')
             }
             
             // Преобразуем данные в формат приложения
-            const transactions = pythonData.map((item: any) => ({
-              date: item.ДатаОперации || item.date,
-              type: item.Тип === 'Доход' ? 'income' : 'expense',
-              amount: parseFloat(item.Сумма || item.amount || '0'),
-              comment: item.Комментарий || item.comment || '',
-              counterparty: item.Контрагент || item.counterparty || '',
-              // Дополнительные поля
-              documentNumber: item.НомерДокумента || item.documentNumber || '',
-              debit: item.Дебет || item.debit || '',
-              credit: item.Кредит || item.credit || ''
-            }))
-            
-            resolve(transactions)
+            resolve(mapPythonTransactions(pythonData))
           } catch (parseError) {
             console.error('Ошибка парсинга результата Python скрипта:', parseError)
             reject(new Error(`Ошибка парсинга результата Python скрипта: ${parseError}`))
@@ -143,6 +195,19 @@ async function parsePDFContent(buffer: Buffer, bankName: string = 'Kaspi'): Prom
     return parsePDFContentSimple(buffer, bankName)
   }
   
+  // Если запущен Python сервер, не тратим время на запуск процесса
+  const workerUrl = process.env.PDF_PARSER_URL
+  if (workerUrl) {
+    try {
+      return await parsePDFContentWorker(buffer, bankName, workerUrl)
+    } catch (error) {
+      if (error instanceof PdfParseError) {
+        throw error
+      }
+      console.warn('Python сервер недоступен, запускаем скрипт:', error)
+    }
+  }
+
   // В локальной разработке пытаемся использовать Python
   try {
     return await parsePDFContentPython(buffer, bankName)
@@ -181,6 +246,9 @@ export async function POST(request: NextRequest) {
     }
   } catch (error) {
     console.error('Ошибка парсинга PDF:', error)
+    if (error instanceof PdfParseError) {
+      return NextResponse.json({ error: error.message }, { status: error.status })
+    }
     return NextResponse.json(
       { error: 'Ошибка при обработке PDF файла' }, 
       { status: 500 }
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки горячих путей парсинга: выписки 1C, PDF и отдельные парсеры банков
+
+Пример:
+    python3 benchmark_parsers.py --sizes 1000,10000,100000 --pages 10,50
+    python3 benchmark_parsers.py --baseline benchmark_results.json  # сравнение с прошлым прогоном
+    python3 benchmark_parsers.py --skip-1c --corpus statements/       # бэкенды PDF на настоящих выписках
+"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import hashlib
+import resource
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional
+
+# Каталог со сгенерированными данными (переиспользуется между прогонами)
+DEFAULT_DATA_DIR = ".bench_data"
+DEFAULT_RESULTS_PATH = "benchmark_results.json"
+DEFAULT_SIZES = [1000, 10000, 100000]
+FULL_SIZES = DEFAULT_SIZES + [1000000]
+DEFAULT_PAGES = [10, 50]
+PDF_BANKS = ["Kaspi", "Forte", "Halyk", "Other"]
+# Счет в шапке PDF: код банка в ИИК совпадает с банком выписки
+PDF_ACCOUNTS = {"Kaspi": "KZ87722C000022014099", "Forte": "KZ9496511F0008314291",
+                "Halyk": "KZ12601A871234567890", "Other": "KZ11111000000000001"}
+# Заголовки и x-координаты колонок табличной PDF-выписки
+PDF_TABLE_COLUMNS = [("Дата", 40), ("№ док", 100), ("Контрагент / назначение", 150), ("Расход", 400), ("Приход", 480)]
+
+# Допустимое замедление относительно baseline (доля)
+DEFAULT_TOLERANCE = 0.2
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_statement.txt")
+
+OUR_ACCOUNTS = ["KZ87722C000022014099", "KZ88722S000040014444", "KZ9496511F0008314291"]
+FOREIGN_ACCOUNTS = ["KZ11111000000000001", "KZ22222000000000002", "KZ33333000000000003"]
+PURPOSES = [
+    "Оплата по договору поставки",
+    "Перевод собственных средств на карту Kaspi Gold *1003",
+    "Заработная плата за месяц",
+    "Поступление наличных в кассу",
+    "Оплата за топливо",
+]
+
+def load_document_templates(path: str = TEMPLATE_PATH) -> List[List[str]]:
+    """Документы из test_statement.txt как списки строк «Ключ=Значение»"""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.rstrip("\r\n") for line in f]
+
+    templates, current = [], None
+    for line in lines:
+        if line.startswith("СекцияДокумент="):
+            current = [line]
+        elif current is not None:
+            current.append(line)
+            if line == "КонецДокумента":
+                templates.append(current)
+                current = None
+    return templates
+
+def render_document(template: List[str], number: int, rng: random.Random) -> str:
+    """Подставляет в шаблон документа номер, дату, счета и сумму"""
+    day, month = rng.randint(1, 28), rng.randint(1, 12)
+    date = f"{day:02d}.{month:02d}.2025"
+    amount = f"{rng.randint(100, 5000000)}.{rng.randint(0, 99):02d}"
+    payer = rng.choice(OUR_ACCOUNTS + FOREIGN_ACCOUNTS)
+    receiver = rng.choice(OUR_ACCOUNTS + FOREIGN_ACCOUNTS)
+    amount_key = "СуммаРасход" if payer in OUR_ACCOUNTS else "СуммаПриход"
+
+    replacements = {
+        "НомерДокумента": str(number),
+        "ДатаДокумента": date,
+        "ДатаОперации": date,
+        "ПлательщикИИК": payer,
+        "ПолучательИИК": receiver,
+        "НазначениеПлатежа": rng.choice(PURPOSES),
+    }
+
+    lines, has_amount = [], False
+    for line in template:
+        key, sep, _ = line.partition("=")
+        if sep and key in replacements:
+            line = f"{key}={replacements[key]}"
+        elif sep and key in ("СуммаРасход", "СуммаПриход", "Сумма"):
+            if has_amount:
+                continue
+            line, has_amount = f"{amount_key}={amount}", True
+        lines.append(line)
+    return "\r\n".join(lines) + "\r\n"
+
+def generate_1c_statement(path: str, documents: int, seed: int = 42) -> str:
+    """Пишет синтетическую выписку 1CClientBankExchange в cp1251"""
+    rng = random.Random(seed)
+    templates = load_document_templates()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="cp1251", errors="replace", newline="") as f:
+        f.write("1CClientBankExchange\r\nВерсияФормата=1.02\r\nКодировка=Windows\r\n")
+        for number in range(documents):
+            f.write(render_document(templates[number % len(templates)], 100000 + number, rng))
+        f.write("КонецФайла\r\n")
+    os.replace(tmp_path, path)
+    return path
+
+def pdf_operation_lines(bank_name: str, number: int, rng: random.Random) -> List[str]:
+    """Строки одной операции в раскладке конкретного банка"""
+    date = f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.2025"
+    amount = f"{rng.randint(1, 999)},{rng.randint(0, 999):03d}.{rng.randint(0, 99):02d}"
+    counterparty = rng.choice(["ТОО Ромашка", "ИП Иванов Сергей", "АО Казахтелеком"])
+    if bank_name == "Forte":
+        direction = rng.choice(["Списание", "Зачисление"])
+        return [f"{date} Операция {direction} {counterparty} док {number}", f"Сумма {amount} KZT"]
+    if bank_name == "Halyk":
+        direction = rng.choice(["Оплата", "Поступление"])
+        return [f"{700000 + number} {date} {direction} {counterparty} {amount}", "по счету на оплату"]
+    direction = rng.choice(["Оплата", "Поступление"])
+    return [f"{date} {direction} {counterparty} док {number} {amount}", "за услуги связи"]
+
+def find_pdf_font() -> Optional[str]:
+    """TTF-шрифт с кириллицей для генерации PDF (BENCH_PDF_FONT или DejaVuSans)"""
+    font = os.environ.get("BENCH_PDF_FONT")
+    if font and os.path.exists(font):
+        return font
+    candidates = glob.glob("/usr/share/fonts/**/DejaVuSans.ttf", recursive=True)
+    return candidates[0] if candidates else None
+
+def generate_pdf_statement(path: str, bank_name: str, pages: int, seed: int = 42) -> str:
+    """Пишет многостраничную синтетическую PDF-выписку банка (нужен reportlab)"""
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    rng = random.Random(seed)
+    pdf = canvas.Canvas(path)
+    font_path = find_pdf_font()
+    font_name = "Helvetica"
+    if font_path:
+        pdfmetrics.registerFont(TTFont("BenchFont", font_path))
+        font_name = "BenchFont"
+
+    number = 1000
+    for _ in range(pages):
+        pdf.setFont(font_name, 9)
+        y = 800
+        pdf.drawString(40, y, f"{bank_name} Bank Выписка по счету {PDF_ACCOUNTS[bank_name]}")
+        y -= 24
+        while y > 60:
+            for line in pdf_operation_lines(bank_name, number, rng):
+                pdf.drawString(40, y, line)
+                y -= 12
+            number += 1
+            y -= 4
+        pdf.showPage()
+    pdf.save()
+    return path
+
+def generate_pdf_table_statement(path: str, bank_name: str, pages: int, seed: int = 42) -> str:
+    """Пишет PDF-выписку с таблицей (заголовок и колонки Расход/Приход) для разбора по колонкам"""
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    rng = random.Random(seed)
+    pdf = canvas.Canvas(path)
+    font_path = find_pdf_font()
+    font_name = "Helvetica"
+    if font_path:
+        pdfmetrics.registerFont(TTFont("BenchFont", font_path))
+        font_name = "BenchFont"
+
+    number = 1000
+    for _ in range(pages):
+        pdf.setFont(font_name, 9)
+        y = 800
+        pdf.drawString(40, y, f"{bank_name} Bank Выписка по счету {PDF_ACCOUNTS[bank_name]}")
+        y -= 24
+        for title, x in PDF_TABLE_COLUMNS:
+            pdf.drawString(x, y, title)
+        y -= 16
+        while y > 60:
+            date = f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.2025"
+            amount = f"{rng.randint(1, 999)} {rng.randint(0, 999):03d},{rng.randint(0, 99):02d}"
+            pdf.drawString(40, y, date)
+            pdf.drawString(100, y, str(number))
+            pdf.drawString(150, y, rng.choice(["ТОО Ромашка", "ИП Иванов Сергей", "АО Казахтелеком"]))
+            # Суммы выровнены по правому краю колонки
+            pdf.drawRightString(460 if rng.random() < 0.5 else 540, y, amount)
+            y -= 11
+            pdf.drawString(150, y, f"Оплата по счету {number + 120000} от 01.02.2025")
+            y -= 14
+            number += 1
+        pdf.showPage()
+    pdf.save()
+    return path
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS текущего процесса в МБ"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В macOS ru_maxrss в байтах, в Linux — в килобайтах
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_case(case: Dict) -> Dict:
+    """Выполняет один замер (вызывается в отдельном процессе)"""
+    kind = case["kind"]
+    if kind == "1c":
+        from parser_improved import parse_1c_files_improved
+        run = lambda: parse_1c_files_improved([case["path"]])
+    else:
+        import pdf_parser_improved
+        with open(case["path"], "rb") as f:
+            file_bytes = f.read()
+        if kind == "pdf_backend":
+            # Только извлечение текста выбранным бэкендом
+            from pdf_backends import iter_page_texts
+            run = lambda: list(iter_page_texts(file_bytes, case["backend"]))
+        elif kind == "pdf":
+            run = lambda: pdf_parser_improved.parse_pdf_improved(file_bytes, case["bank"],
+                                                                 layout=case.get("layout", "text"))
+        else:
+            # Только разбор текста, без извлечения страниц
+            text = pdf_parser_improved.extract_pdf_text(file_bytes)
+            parser = pdf_parser_improved.get_parser(case["bank"])
+            run = lambda: parser.parse(text)
+
+    rss_before = peak_rss_mb()
+    best, records = None, 0
+    for _ in range(case["repeat"]):
+        started = time.perf_counter()
+        records = len(run())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    extra = {}
+    if kind == "pdf_backend":
+        # Отпечаток операций для сравнения бэкендов между собой
+        text = pdf_parser_improved.extract_pdf_text(file_bytes, backend=case["backend"])
+        operations = pdf_parser_improved.get_parser(case["bank"]).parse(text)
+        extra["operations"] = len(operations)
+        extra["digest"] = hashlib.sha256(json.dumps(operations, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    return {
+        **extra,
+        "seconds": round(best, 4),
+        "records": records,
+        "rate": round(case["units"] / best, 1) if best else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+    }
+
+def measure(case: Dict) -> Dict:
+    """Запускает замер в свежем процессе, чтобы пиковый RSS не смешивался между замерами"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return {**case, **executor.submit(run_case, case).result()}
+
+def build_cases(args) -> List[Dict]:
+    """Список замеров с подготовленными входными файлами"""
+    os.makedirs(args.data_dir, exist_ok=True)
+    cases = []
+
+    if not args.skip_1c:
+        for size in args.sizes:
+            path = os.path.join(args.data_dir, f"statement_{size}.txt")
+            if not os.path.exists(path):
+                print(f"🛠️ Генерация выписки 1C на {size} документов...")
+                generate_1c_statement(path, size)
+            cases.append({"name": f"parse_1c_files_improved[{size}]", "kind": "1c", "path": path,
+                          "units": size, "unit": "docs/s", "repeat": args.repeat})
+
+    # PDF для сравнения бэкендов извлечения текста: (путь, банк, страниц)
+    backend_files = corpus_files(args.corpus) if args.corpus else []
+
+    if not args.skip_pdf:
+        try:
+            import reportlab  # noqa: F401
+        except ImportError:
+            print("⚠️ reportlab не установлен, PDF-бенчмарки пропущены (pip install reportlab)")
+            return cases + pdf_backend_cases(backend_files, args.repeat)
+
+        for bank_name in PDF_BANKS:
+            for pages in args.pages:
+                path = os.path.join(args.data_dir, f"{bank_name.lower()}_{pages}.pdf")
+                if not os.path.exists(path):
+                    print(f"🛠️ Генерация PDF {bank_name} на {pages} страниц...")
+                    generate_pdf_statement(path, bank_name, pages)
+                cases.append({"name": f"parse_pdf_improved[{bank_name},{pages}]", "kind": "pdf", "path": path,
+                              "bank": bank_name, "units": pages, "unit": "pages/s", "repeat": args.repeat})
+                cases.append({"name": f"BankParser.parse[{bank_name},{pages}]", "kind": "bank_parser", "path": path,
+                              "bank": bank_name, "units": pages, "unit": "pages/s", "repeat": args.repeat})
+                backend_files.append((path, bank_name, pages))
+
+        # Табличная выписка: текстовый режим против разбора по колонкам
+        for pages in args.pages:
+            path = os.path.join(args.data_dir, f"table_{pages}.pdf")
+            if not os.path.exists(path):
+                print(f"🛠️ Генерация табличного PDF на {pages} страниц...")
+                generate_pdf_table_statement(path, "Kaspi", pages)
+            for layout in ("text", "table"):
+                cases.append({"name": f"parse_pdf_improved[{layout},table,{pages}]", "kind": "pdf", "path": path,
+                              "bank": "Kaspi", "layout": layout, "units": pages, "unit": "pages/s",
+                              "repeat": args.repeat})
+            backend_files.append((path, "Kaspi", pages))
+
+    if not args.skip_backends:
+        cases += pdf_backend_cases(backend_files, args.repeat)
+    return cases
+
+def corpus_files(directory: str) -> List[tuple]:
+    """PDF-выписки из каталога: банк определяется по первой странице"""
+    from pdf_backends import get_backend
+    from pdf_parser_improved import resolve_bank
+
+    files = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.pdf"))):
+        with get_backend().open(open(path, "rb").read()) as document:
+            first_page = document.page_text(0) if document.page_count else ""
+            files.append((path, resolve_bank(first_page)[0], document.page_count))
+    return files
+
+def pdf_backend_cases(files: List[tuple], repeat: int) -> List[Dict]:
+    """Замеры извлечения текста каждым установленным бэкендом"""
+    from pdf_backends import available_backends
+
+    cases = []
+    for path, bank_name, pages in files:
+        for backend in available_backends():
+            cases.append({"name": f"extract_text[{backend},{os.path.basename(path)}]", "kind": "pdf_backend",
+                          "path": path, "bank": bank_name, "backend": backend, "units": pages,
+                          "unit": "pages/s", "repeat": repeat})
+    return cases
+
+def compare_backends(results: List[Dict]) -> List[str]:
+    """Сравнивает бэкенды с pdfplumber: скорость и совпадение операций.
+    Возвращает файлы, где операции разошлись"""
+    by_path: Dict[str, Dict[str, Dict]] = {}
+    for row in results:
+        if row["kind"] == "pdf_backend":
+            by_path.setdefault(row["path"], {})[row["backend"]] = row
+
+    mismatches = []
+    for path, rows in by_path.items():
+        reference = rows.get("pdfplumber") or next(iter(rows.values()))
+        for backend, row in rows.items():
+            row["matches_reference"] = row["digest"] == reference["digest"]
+            speedup = row["rate"] / reference["rate"] if reference["rate"] else 0.0
+            marker = "✅" if row["matches_reference"] else "⚠️"
+            print(f"{marker} {os.path.basename(path):<20} {backend:<11} {row['rate']:>10} pages/s "
+                  f"(x{speedup:.1f}), операций: {row['operations']}")
+            if not row["matches_reference"]:
+                mismatches.append(f"{os.path.basename(path)}[{backend}]")
+    return mismatches
+
+def compare_with_baseline(results: List[Dict], baseline_path: str, tolerance: float) -> List[str]:
+    """Возвращает описания замеров, ставших медленнее baseline больше чем на tolerance"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {row["name"]: row for row in json.load(f)["results"]}
+
+    regressions = []
+    for row in results:
+        previous = baseline.get(row["name"])
+        if not previous or not previous.get("rate"):
+            continue
+        change = row["rate"] / previous["rate"] - 1
+        marker = "🔻" if change < -tolerance else "  "
+        print(f"{marker} {row['name']:<40} {previous['rate']:>12} → {row['rate']:>12} {row['unit']} ({change:+.0%})")
+        if change < -tolerance:
+            regressions.append(f"{row['name']}: {change:+.0%}")
+    return regressions
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Бенчмарки парсинга выписок 1C и PDF")
+    arg_parser.add_argument("--sizes", type=parse_int_list, default=DEFAULT_SIZES,
+                            help="Размеры выписок 1C в документах через запятую")
+    arg_parser.add_argument("--full", action="store_true", help="Добавить выписку на 1 000 000 документов")
+    arg_parser.add_argument("--pages", type=parse_int_list, default=DEFAULT_PAGES,
+                            help="Число страниц синтетических PDF через запятую")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Повторов на замер (берется лучший)")
+    arg_parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    arg_parser.add_argument("--output", default=DEFAULT_RESULTS_PATH)
+    arg_parser.add_argument("--baseline", help="Прошлый результат для поиска регрессий")
+    arg_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                            help="Допустимое замедление относительно baseline (0.2 = 20%%)")
+    arg_parser.add_argument("--skip-1c", action="store_true")
+    arg_parser.add_argument("--skip-pdf", action="store_true")
+    arg_parser.add_argument("--skip-backends", action="store_true", help="Не сравнивать бэкенды извлечения текста PDF")
+    arg_parser.add_argument("--corpus", help="Каталог с настоящими PDF-выписками для сравнения бэкендов")
+    args = arg_parser.parse_args()
+    if args.full:
+        args.sizes = sorted(set(args.sizes) | set(FULL_SIZES))
+
+    print("🚀 БЕНЧМАРКИ ПАРСИНГА")
+    print("=" * 50)
+
+    results = []
+    for case in build_cases(args):
+        row = measure(case)
+        results.append(row)
+        print(f"⏱️ {row['name']:<40} {row['seconds']:>8.3f} с {row['rate']:>12} {row['unit']}"
+              f"  записей: {row['records']:<7} RSS: {row['peak_rss_mb']} МБ (+{row['rss_growth_mb']})")
+
+    mismatches = []
+    if any(row["kind"] == "pdf_backend" for row in results):
+        print("\n📄 Бэкенды извлечения текста PDF относительно pdfplumber:")
+        mismatches = compare_backends(results)
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": [{key: value for key, value in row.items() if key != "path"} for row in results],
+    }
+
+    regressions = []
+    if args.baseline:
+        print("\n📊 Сравнение с baseline:")
+        regressions = compare_with_baseline(report["results"], args.baseline, args.tolerance)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Результаты сохранены в {args.output}")
+
+    if mismatches:
+        print(f"⚠️ Операции отличаются от pdfplumber: {', '.join(mismatches)}")
+    if regressions:
+        print(f"❌ Регрессии производительности: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
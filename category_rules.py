@@ -0,0 +1,301 @@
+"""
+Автокатегоризация операций по правилам category_rules, скомпилированным в один матчер
+"""
+import re
+import time
+import bisect
+import hashlib
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Iterable, Tuple
+
+from transaction_record import Transaction, parse_amount_tiyn
+
+# Как часто перечитывать правила из базы (секунд)
+CATEGORY_RULES_TTL = 300
+
+TEXT_RULE_TYPES = ("counterparty", "purpose")
+
+# Условия правил по сумме: "1000-5000", ">1000", ">=1000", "<500", "<=500", "1000"
+AMOUNT_RANGE_RE = re.compile(r"^\s*([\d\s.,]+?)\s*(?:-|–|\.\.)\s*([\d\s.,]+)\s*$")
+AMOUNT_COMPARE_RE = re.compile(r"^\s*(>=|<=|>|<|=)?\s*([\d\s.,]+)\s*$")
+
+@dataclass(frozen=True)
+class CategoryRule:
+    """Активное правило категоризации
+
+    category_type — тип категории (income, expense, transfer): правило
+    применяется только к операциям этого типа. Пустой тип — к любым.
+    """
+    category: str
+    rule_type: str
+    rule_value: str
+    priority: int = 0
+    rule_id: int = 0
+    category_type: str = ""
+
+def parse_amount_interval(rule_value: str) -> Optional[Tuple[int, int]]:
+    """Переводит условие по сумме в полуинтервал [от, до) в тиынах"""
+    match = AMOUNT_RANGE_RE.match(rule_value)
+    if match:
+        low, high = parse_amount_tiyn(match.group(1)), parse_amount_tiyn(match.group(2))
+        return (min(low, high), max(low, high) + 1)
+
+    match = AMOUNT_COMPARE_RE.match(rule_value)
+    if not match:
+        return None
+    operator, amount = match.group(1) or "=", parse_amount_tiyn(match.group(2))
+    if operator == ">":
+        return (amount + 1, float("inf"))
+    if operator == ">=":
+        return (amount, float("inf"))
+    if operator == "<":
+        return (0, amount)
+    if operator == "<=":
+        return (0, amount + 1)
+    return (amount, amount + 1)
+
+class TextAutomaton:
+    """Автомат Ахо — Корасик по строкам-шаблонам, заданным в порядке приоритета
+
+    В каждом узле заранее записан номер лучшего шаблона, который оканчивается
+    в нем или в его суффиксе, поэтому поиск — один проход по тексту,
+    O(длина текста) при любом числе шаблонов.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.size = len(patterns)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.best: List[int] = [self.size]
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append({})
+                    self.best.append(self.size)
+                node = child
+            self.best[node] = min(self.best[node], index)
+
+        # Суффиксные ссылки обходом в ширину: суффикс узла обработан раньше самого узла
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            self.best[node] = min(self.best[node], self.best[self.fail[node]])
+            for char, child in self.goto[node].items():
+                suffix = self.fail[node]
+                while suffix and char not in self.goto[suffix]:
+                    suffix = self.fail[suffix]
+                self.fail[child] = self.goto[suffix].get(char, 0)
+                queue.append(child)
+
+    def search(self, text: str) -> Optional[int]:
+        """Номер лучшего шаблона, входящего в текст, или None"""
+        goto, fail, best = self.goto, self.fail, self.best
+        node, found = 0, self.size
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if best[node] < found:
+                found = best[node]
+                if found == 0:
+                    break
+        return found if found < self.size else None
+
+class RuleSet:
+    """Правила, применимые к одному типу операций
+
+    Текстовые правила каждого вида собраны в один автомат Ахо — Корасик по
+    значениям, приведенным casefold, в порядке приоритета: запись проверяется
+    за один проход по тексту, а не поиском каждого правила.
+    Правила по сумме разложены на отрезки с заранее выбранным победителем,
+    поиск — bisect.
+    """
+
+    def __init__(self, rules: List[CategoryRule]):
+        self.rules = rules
+        self.text_rules: Dict[str, Tuple[TextAutomaton, List[CategoryRule]]] = {}
+        for rule_type in TEXT_RULE_TYPES:
+            typed = [rule for rule in rules if rule.rule_type == rule_type and rule.rule_value.strip()]
+            if typed:
+                automaton = TextAutomaton([rule.rule_value.strip().casefold() for rule in typed])
+                self.text_rules[rule_type] = (automaton, typed)
+
+        self._compile_amount_rules([rule for rule in rules if rule.rule_type == "amount"])
+
+    def _compile_amount_rules(self, rules: List[CategoryRule]) -> None:
+        intervals = []
+        for rule in rules:
+            interval = parse_amount_interval(rule.rule_value)
+            if interval is None:
+                print(f"⚠️ Не удалось разобрать условие по сумме в правиле {rule.rule_id}: {rule.rule_value!r}")
+                continue
+            intervals.append((interval, rule))
+
+        # Границы всех интервалов делят ось сумм на отрезки с одним победителем
+        self.amount_bounds = sorted({bound for (low, high), _ in intervals for bound in (low, high)})
+        self.amount_winners: List[Optional[CategoryRule]] = []
+        for start in self.amount_bounds:
+            winner = None
+            for (low, high), rule in intervals:  # правила уже отсортированы по приоритету
+                if low <= start < high:
+                    winner = rule
+                    break
+            self.amount_winners.append(winner)
+
+    def match_text(self, rule_type: str, text: str) -> Optional[CategoryRule]:
+        """Лучшее текстовое правило для строки"""
+        compiled = self.text_rules.get(rule_type)
+        if not compiled or not text:
+            return None
+        automaton, typed = compiled
+        index = automaton.search(text.casefold())
+        return typed[index] if index is not None else None
+
+    def match_amount(self, amount_tiyn: int) -> Optional[CategoryRule]:
+        """Лучшее правило по сумме (в тиынах)"""
+        position = bisect.bisect_right(self.amount_bounds, amount_tiyn) - 1
+        if position < 0:
+            return None
+        return self.amount_winners[position]
+
+class CategoryMatcher:
+    """Скомпилированный набор правил
+
+    Для каждого типа операции собирается свой RuleSet из правил этого типа
+    и правил без типа, чтобы правило категории расходов не переименовало
+    доход или перевод.
+    При совпадении нескольких правил побеждает больший priority,
+    при равенстве — правило с меньшим id.
+    """
+
+    def __init__(self, rules: Iterable[CategoryRule]):
+        self.rules = sorted(rules, key=lambda rule: (-rule.priority, rule.rule_id))
+        self._rule_sets: Dict[str, RuleSet] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def rule_set(self, transaction_type: str = "") -> RuleSet:
+        """Правила для типа операции (пустой тип — только правила без типа)"""
+        rule_set = self._rule_sets.get(transaction_type)
+        if rule_set is None:
+            with self._lock:
+                rule_set = self._rule_sets.get(transaction_type)
+                if rule_set is None:
+                    rule_set = RuleSet([rule for rule in self.rules
+                                        if rule.category_type in ("", transaction_type)])
+                    self._rule_sets[transaction_type] = rule_set
+        return rule_set
+
+    @staticmethod
+    def _better(current: Optional[CategoryRule], candidate: Optional[CategoryRule]) -> Optional[CategoryRule]:
+        if candidate is None:
+            return current
+        if current is None or (-candidate.priority, candidate.rule_id) < (-current.priority, current.rule_id):
+            return candidate
+        return current
+
+    def match(self, counterparty: str, purpose: str, amount_tiyn: int, transaction_type: str = "") -> Optional[str]:
+        """Категория для операции или None, если ни одно правило не подошло"""
+        rules = self.rule_set(transaction_type)
+        best = rules.match_text("counterparty", counterparty)
+        best = self._better(best, rules.match_text("purpose", purpose))
+        if amount_tiyn and rules.amount_bounds:
+            best = self._better(best, rules.match_amount(amount_tiyn))
+        return best.category if best else None
+
+    def categorize(self, transactions: Iterable[Transaction]) -> int:
+        """Проставляет category по правилам, возвращает число категоризированных операций"""
+        if not self.rules:
+            return 0
+        matched = 0
+        for transaction in transactions:
+            amount_tiyn = transaction.expense_tiyn or transaction.income_tiyn or transaction.total_tiyn
+            category = self.match(transaction.counterparty, transaction.payment_purpose, amount_tiyn,
+                                  transaction.transaction_type)
+            if category:
+                transaction.category = category
+                matched += 1
+        return matched
+
+def load_category_rules(supabase) -> List[CategoryRule]:
+    """Загружает активные правила, названия и типы их категорий"""
+    rows = (
+        supabase.table("category_rules")
+        .select("id,category_id,rule_type,rule_value,priority")
+        .eq("is_active", True)
+        .execute()
+    ).data or []
+
+    category_ids = sorted({row["category_id"] for row in rows if row.get("category_id") is not None})
+    categories = {}
+    if category_ids:
+        result = supabase.table("transaction_categories").select("id,name,type").in_("id", category_ids).execute()
+        categories = {row["id"]: row for row in result.data or []}
+
+    return [
+        CategoryRule(
+            category=categories[row["category_id"]]["name"],
+            rule_type=row["rule_type"],
+            rule_value=row["rule_value"],
+            priority=row.get("priority") or 0,
+            rule_id=row["id"],
+            category_type=categories[row["category_id"]].get("type") or "",
+        )
+        for row in rows
+        if row.get("category_id") in categories
+    ]
+
+def rules_fingerprint(rules: List[CategoryRule]) -> str:
+    """Отпечаток набора правил, чтобы не перекомпилировать неизменившиеся правила"""
+    digest = hashlib.sha256()
+    for rule in sorted(rules, key=lambda rule: rule.rule_id):
+        digest.update(repr(rule).encode("utf-8"))
+    return digest.hexdigest()
+
+# 🔧 Кэш скомпилированного матчера: (матчер, отпечаток, момент истечения)
+_matcher_cache: Dict[str, tuple] = {}
+_matcher_lock = threading.Lock()
+
+def get_category_matcher(supabase=None, force_reload: bool = False) -> CategoryMatcher:
+    """Возвращает матчер правил, перечитывая их из базы не чаще раза в CATEGORY_RULES_TTL
+
+    Матчер перекомпилируется, только если правила действительно изменились.
+    Если правила не загрузились, используется прежний матчер (или пустой).
+    """
+    with _matcher_lock:
+        cached = _matcher_cache.get("matcher")
+        if cached and not force_reload and cached[2] > time.monotonic():
+            return cached[0]
+
+        try:
+            if supabase is None:
+                from supabase_config import get_supabase_client
+                supabase = get_supabase_client()
+            rules = load_category_rules(supabase)
+        except Exception as e:
+            print(f"⚠️ Не удалось загрузить правила категоризации: {e}")
+            matcher = cached[0] if cached else CategoryMatcher([])
+            fingerprint = cached[1] if cached else ""
+            _matcher_cache["matcher"] = (matcher, fingerprint, time.monotonic() + CATEGORY_RULES_TTL)
+            return matcher
+
+        fingerprint = rules_fingerprint(rules)
+        if cached and cached[1] == fingerprint:
+            matcher = cached[0]
+        else:
+            matcher = CategoryMatcher(rules)
+            print(f"🏷️ Загружено {len(matcher)} правил категоризации")
+        _matcher_cache["matcher"] = (matcher, fingerprint, time.monotonic() + CATEGORY_RULES_TTL)
+        return matcher
+
+def reload_category_matcher(supabase=None) -> CategoryMatcher:
+    """Принудительно перечитывает правила (например, после их изменения в интерфейсе)"""
+    return get_category_matcher(supabase, force_reload=True)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Выгрузка разобранных выписок в Arrow/Parquet с типизированными колонками дат и сумм
+
+Требует pyarrow (опциональная зависимость): pip install pyarrow
+"""
+import os
+import sys
+import argparse
+from decimal import Decimal
+from typing import Iterable, Iterator, List, Dict, Optional
+
+from transaction_record import Transaction, parse_record_date, parse_amount_tiyn
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.ipc as ipc
+except ImportError:  # pyarrow нужен только для этой выгрузки
+    pa = None
+
+# Размер батча по умолчанию (строк)
+DEFAULT_BATCH_SIZE = 10000
+
+TRANSACTION_STRING_COLUMNS = [
+    "transaction_type",
+    "document_number",
+    "document_type",
+    "payer_name",
+    "receiver_name",
+    "payer_bin_iin",
+    "receiver_bin_iin",
+    "payer_account",
+    "receiver_account",
+    "from_account",
+    "to_account",
+    "account",
+    "counterparty",
+    "category",
+    "payment_purpose",
+    "payment_code",
+]
+
+# Поля операции PDF-парсера -> строковые колонки
+PDF_STRING_COLUMNS = {
+    "НомерДокумента": "document_number",
+    "Тип": "operation_type",
+    "Контрагент": "counterparty",
+    "Комментарий": "comment",
+    "Банк": "bank",
+}
+
+def require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("Для выгрузки в Arrow/Parquet установите pyarrow: pip install pyarrow")
+
+def amount_type():
+    return pa.decimal128(15, 2)
+
+def transaction_schema():
+    """Схема Arrow для Transaction из парсера 1C"""
+    require_pyarrow()
+    return pa.schema(
+        [
+            ("operation_date", pa.date32()),
+            ("document_date", pa.date32()),
+            ("amount_expense", amount_type()),
+            ("amount_income", amount_type()),
+            ("amount", amount_type()),
+        ]
+        + [(name, pa.string()) for name in TRANSACTION_STRING_COLUMNS]
+    )
+
+def pdf_operation_schema():
+    """Схема Arrow для операций PDF-парсеров"""
+    require_pyarrow()
+    return pa.schema(
+        [
+            ("operation_date", pa.date32()),
+            ("operation_date_raw", pa.string()),
+            ("debit", amount_type()),
+            ("credit", amount_type()),
+            ("amount", amount_type()),
+        ]
+        + [(name, pa.string()) for name in PDF_STRING_COLUMNS.values()]
+    )
+
+def tiyn_to_decimal(tiyn: int) -> Decimal:
+    return Decimal(tiyn).scaleb(-2)
+
+def optional_amount(value) -> Optional[Decimal]:
+    """Сумма из строки PDF-парсера или None, если суммы нет"""
+    if not value:
+        return None
+    return tiyn_to_decimal(parse_amount_tiyn(value))
+
+def parse_pdf_date(value: str):
+    """Дата операции PDF (ДД.ММ.ГГ, ДД/ММ/ГГГГ, ГГГГ-ММ-ДД и т.п.) или None"""
+    if not value:
+        return None
+    parsed = parse_record_date(value)
+    if parsed:
+        return parsed
+    from parser_improved import parse_date
+    return parse_record_date(parse_date(value) or "")
+
+def transactions_to_batch(transactions: List[Transaction]):
+    """Превращает список Transaction в RecordBatch"""
+    columns = {
+        "operation_date": [t.operation_date for t in transactions],
+        "document_date": [t.document_date for t in transactions],
+        "amount_expense": [tiyn_to_decimal(t.expense_tiyn) for t in transactions],
+        "amount_income": [tiyn_to_decimal(t.income_tiyn) for t in transactions],
+        "amount": [tiyn_to_decimal(t.total_tiyn) for t in transactions],
+    }
+    for name in TRANSACTION_STRING_COLUMNS:
+        columns[name] = [getattr(t, name) for t in transactions]
+    return pa.RecordBatch.from_pydict(columns, schema=transaction_schema())
+
+def pdf_operations_to_batch(operations: List[Dict[str, str]]):
+    """Превращает операции PDF-парсера в RecordBatch"""
+    columns = {
+        "operation_date": [parse_pdf_date(op.get("ДатаОперации", "")) for op in operations],
+        "operation_date_raw": [op.get("ДатаОперации", "") for op in operations],
+        "debit": [optional_amount(op.get("Дебет")) for op in operations],
+        "credit": [optional_amount(op.get("Кредит")) for op in operations],
+        "amount": [optional_amount(op.get("Сумма")) for op in operations],
+    }
+    for key, name in PDF_STRING_COLUMNS.items():
+        columns[name] = [op.get(key, "") for op in operations]
+    return pa.RecordBatch.from_pydict(columns, schema=pdf_operation_schema())
+
+def iter_batches(rows: Iterable, to_batch, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator:
+    """Собирает поток строк в RecordBatch по batch_size строк"""
+    require_pyarrow()
+    buffer = []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= batch_size:
+            yield to_batch(buffer)
+            buffer = []
+    if buffer:
+        yield to_batch(buffer)
+
+def write_batches(batches: Iterable, schema, path: str) -> int:
+    """Пишет батчи в .parquet или в Arrow IPC (.arrow/.feather), возвращает число строк"""
+    require_pyarrow()
+    rows = 0
+    if path.endswith(".parquet"):
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = ipc.new_file(path, schema)
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        writer.close()
+    return rows
+
+def write_transactions(transactions: Iterable[Transaction], path: str, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Потоково пишет операции 1C в Parquet/Arrow"""
+    return write_batches(iter_batches(transactions, transactions_to_batch, batch_size), transaction_schema(), path)
+
+def write_pdf_operations(operations: Iterable[Dict[str, str]], path: str, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Потоково пишет операции PDF в Parquet/Arrow"""
+    return write_batches(iter_batches(operations, pdf_operations_to_batch, batch_size), pdf_operation_schema(), path)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Выгрузка выписок в Parquet/Arrow")
+    arg_parser.add_argument("output", help="Файл результата: .parquet, .arrow или .feather")
+    arg_parser.add_argument("files", nargs="+", help="Файлы выписок 1C (.txt) или PDF (с --pdf-bank)")
+    arg_parser.add_argument("--pdf-bank", help="Банк для разбора PDF (Kaspi/Forte/Halyk/Other)")
+    arg_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = arg_parser.parse_args()
+
+    try:
+        require_pyarrow()
+    except ImportError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.pdf_bank:
+        from pdf_parser_improved import iter_pdf_operations
+
+        def operations():
+            for path in args.files:
+                with open(path, "rb") as f:
+                    yield from iter_pdf_operations(f.read(), args.pdf_bank)
+
+        rows = write_pdf_operations(operations(), args.output, args.batch_size)
+    else:
+        from parser_improved import iter_1c_transactions
+
+        rows = write_transactions(iter_1c_transactions(args.files), args.output, args.batch_size)
+
+    print(f"✅ Записано {rows} операций в {os.path.abspath(args.output)}")
+
+if __name__ == "__main__":
+    main()
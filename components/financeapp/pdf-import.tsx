@@ -17,7 +17,7 @@ export function PDFImport() {
   const [open, setOpen] = useState(false)
   const [file, setFile] = useState<File | null>(null)
   const [selectedAccountId, setSelectedAccountId] = useState("")
-  const [selectedBank, setSelectedBank] = useState("Kaspi")
+  const [selectedBank, setSelectedBank] = useState("auto")
   const [status, setStatus] = useState<"idle" | "processing" | "success" | "error">("idle")
   const [message, setMessage] = useState("")
 
@@ -193,6 +193,7 @@ export function PDFImport() {
                 <SelectValue placeholder="Выберите банк" />
               </SelectTrigger>
               <SelectContent>
+                <SelectItem value="auto">Определить автоматически</SelectItem>
                 <SelectItem value="Kaspi">Kaspi Bank</SelectItem>
                 <SelectItem value="Forte">Forte Bank</SelectItem>
                 <SelectItem value="Onlinebank">Onlinebank</SelectItem>
@@ -256,3 +256,278 @@ SELECT c.id, 'CASH', 'Cash Desk', 'cash', TRUE
 FROM companies c
 WHERE c.name = 'ALCHIN'
 ON CONFLICT (company_id, account_number) DO NOTHING;
+
+-- 15. Сводки по дням для дашборда: поддерживаются триггерами при каждой записи в transactions
+-- Одна строка на компанию, день, тип операции и значение измерения:
+-- total (dimension_value = ''), category или counterparty
+CREATE TABLE IF NOT EXISTS transaction_rollups (
+    company_id UUID NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+    dimension VARCHAR(20) NOT NULL CHECK (dimension IN ('total', 'category', 'counterparty')),
+    dimension_value VARCHAR(500) NOT NULL DEFAULT '',
+    day DATE NOT NULL,
+    transaction_type VARCHAR(20) NOT NULL,
+    amount_income DECIMAL(15,2) NOT NULL DEFAULT 0,
+    amount_expense DECIMAL(15,2) NOT NULL DEFAULT 0,
+    transaction_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (company_id, dimension, dimension_value, day, transaction_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_transaction_rollups_period
+    ON transaction_rollups (company_id, dimension, day);
+
+ALTER TABLE transaction_rollups ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow all operations for anonymous users" ON transaction_rollups;
+CREATE POLICY "Allow all operations for anonymous users" ON transaction_rollups
+    FOR ALL USING (true);
+
+COMMENT ON TABLE transaction_rollups IS 'Суммы и количество операций по дням (total, category, counterparty)';
+
+-- Прибавляет дельты пачки: [{company_id, day, transaction_type, category, counterparty,
+-- amount_income, amount_expense, transaction_count}], отрицательные значения вычитают
+CREATE OR REPLACE FUNCTION apply_transaction_rollup_deltas(deltas JSONB)
+RETURNS VOID AS $$
+BEGIN
+    IF deltas IS NULL OR jsonb_array_length(deltas) = 0 THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO transaction_rollups AS r (
+        company_id, dimension, dimension_value, day, transaction_type,
+        amount_income, amount_expense, transaction_count
+    )
+    SELECT
+        d.company_id, dim.dimension, dim.dimension_value, d.day, d.transaction_type,
+        SUM(d.amount_income), SUM(d.amount_expense), SUM(d.transaction_count)
+    FROM jsonb_to_recordset(deltas) AS d(
+        company_id UUID, day DATE, transaction_type TEXT, category TEXT, counterparty TEXT,
+        amount_income DECIMAL(15,2), amount_expense DECIMAL(15,2), transaction_count BIGINT
+    )
+    CROSS JOIN LATERAL (VALUES
+        ('total', ''),
+        ('category', COALESCE(d.category, '')),
+        ('counterparty', LEFT(COALESCE(d.counterparty, ''), 500))
+    ) AS dim(dimension, dimension_value)
+    WHERE d.company_id IS NOT NULL
+    GROUP BY d.company_id, dim.dimension, dim.dimension_value, d.day, d.transaction_type
+    -- Параллельные чанки upsert задевают одни и те же строки сводок: блокировки
+    -- берутся в порядке ключа, иначе чанки взаимно блокируются (deadlock)
+    ORDER BY d.company_id, dim.dimension, dim.dimension_value, d.day, d.transaction_type
+    ON CONFLICT (company_id, dimension, dimension_value, day, transaction_type) DO UPDATE SET
+        amount_income = r.amount_income + EXCLUDED.amount_income,
+        amount_expense = r.amount_expense + EXCLUDED.amount_expense,
+        transaction_count = r.transaction_count + EXCLUDED.transaction_count,
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+-- Дельты считаются один раз на оператор (пачку upsert), а не на строку: переходные
+-- таблицы new_rows/old_rows уже сгруппированы. При повторной синхронизации
+-- ON CONFLICT DO UPDATE не меняет значимые поля, и сводки не трогаются
+CREATE OR REPLACE FUNCTION transactions_rollup_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM apply_transaction_rollup_deltas((
+        SELECT jsonb_agg(to_jsonb(d)) FROM (
+            SELECT company_id, operation_date AS day, transaction_type, category, counterparty,
+                   SUM(amount_income) AS amount_income, SUM(amount_expense) AS amount_expense,
+                   COUNT(*) AS transaction_count
+            FROM new_rows
+            GROUP BY company_id, operation_date, transaction_type, category, counterparty
+        ) d
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transactions_rollup_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM apply_transaction_rollup_deltas((
+        SELECT jsonb_agg(to_jsonb(d)) FROM (
+            SELECT company_id, day, transaction_type, category, counterparty,
+                   SUM(amount_income) AS amount_income, SUM(amount_expense) AS amount_expense,
+                   SUM(transaction_count) AS transaction_count
+            FROM (
+                SELECT n.company_id, n.operation_date AS day, n.transaction_type, n.category, n.counterparty,
+                       n.amount_income, n.amount_expense, 1 AS transaction_count
+                FROM new_rows n JOIN old_rows o ON o.id = n.id
+                WHERE (o.company_id, o.operation_date, o.transaction_type, o.category, o.counterparty,
+                       o.amount_income, o.amount_expense)
+                      IS DISTINCT FROM
+                      (n.company_id, n.operation_date, n.transaction_type, n.category, n.counterparty,
+                       n.amount_income, n.amount_expense)
+                UNION ALL
+                SELECT o.company_id, o.operation_date, o.transaction_type, o.category, o.counterparty,
+                       -o.amount_income, -o.amount_expense, -1
+                FROM old_rows o JOIN new_rows n ON n.id = o.id
+                WHERE (o.company_id, o.operation_date, o.transaction_type, o.category, o.counterparty,
+                       o.amount_income, o.amount_expense)
+                      IS DISTINCT FROM
+                      (n.company_id, n.operation_date, n.transaction_type, n.category, n.counterparty,
+                       n.amount_income, n.amount_expense)
+            ) changes
+            GROUP BY company_id, day, transaction_type, category, counterparty
+        ) d
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transactions_rollup_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM apply_transaction_rollup_deltas((
+        SELECT jsonb_agg(to_jsonb(d)) FROM (
+            SELECT company_id, operation_date AS day, transaction_type, category, counterparty,
+                   -SUM(amount_income) AS amount_income, -SUM(amount_expense) AS amount_expense,
+                   -COUNT(*) AS transaction_count
+            FROM old_rows
+            GROUP BY company_id, operation_date, transaction_type, category, counterparty
+        ) d
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transactions_rollup_insert ON transactions;
+CREATE TRIGGER transactions_rollup_insert AFTER INSERT ON transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION transactions_rollup_insert();
+
+DROP TRIGGER IF EXISTS transactions_rollup_update ON transactions;
+CREATE TRIGGER transactions_rollup_update AFTER UPDATE ON transactions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION transactions_rollup_update();
+
+DROP TRIGGER IF EXISTS transactions_rollup_delete ON transactions;
+CREATE TRIGGER transactions_rollup_delete AFTER DELETE ON transactions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION transactions_rollup_delete();
+
+-- Пересчет сводок с нуля (первичное заполнение и проверка расхождений)
+CREATE OR REPLACE FUNCTION rebuild_transaction_rollups(company_uuid UUID DEFAULT NULL)
+RETURNS BIGINT AS $$
+DECLARE
+    rows_written BIGINT;
+BEGIN
+    DELETE FROM transaction_rollups r WHERE company_uuid IS NULL OR r.company_id = company_uuid;
+
+    INSERT INTO transaction_rollups (
+        company_id, dimension, dimension_value, day, transaction_type,
+        amount_income, amount_expense, transaction_count
+    )
+    SELECT
+        t.company_id, dim.dimension, dim.dimension_value, t.operation_date, t.transaction_type,
+        SUM(t.amount_income), SUM(t.amount_expense), COUNT(*)
+    FROM transactions t
+    CROSS JOIN LATERAL (VALUES
+        ('total', ''),
+        ('category', COALESCE(t.category, '')),
+        ('counterparty', LEFT(COALESCE(t.counterparty, ''), 500))
+    ) AS dim(dimension, dimension_value)
+    WHERE t.company_id IS NOT NULL AND (company_uuid IS NULL OR t.company_id = company_uuid)
+    GROUP BY t.company_id, dim.dimension, dim.dimension_value, t.operation_date, t.transaction_type;
+
+    GET DIAGNOSTICS rows_written = ROW_COUNT;
+    RETURN rows_written;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_transaction_rollups();
+
+-- Статистика за период из сводок: время ответа зависит от числа дней, а не операций
+CREATE OR REPLACE FUNCTION get_transaction_stats(
+    company_uuid UUID DEFAULT NULL,
+    start_date DATE DEFAULT NULL,
+    end_date DATE DEFAULT NULL
+)
+RETURNS TABLE (
+    total_income DECIMAL(15,2),
+    total_expense DECIMAL(15,2),
+    net_amount DECIMAL(15,2),
+    transaction_count BIGINT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        COALESCE(SUM(CASE WHEN r.transaction_type = 'income' THEN r.amount_income ELSE 0 END), 0)::DECIMAL(15,2),
+        COALESCE(SUM(CASE WHEN r.transaction_type = 'expense' THEN r.amount_expense ELSE 0 END), 0)::DECIMAL(15,2),
+        (COALESCE(SUM(CASE WHEN r.transaction_type = 'income' THEN r.amount_income ELSE 0 END), 0) -
+         COALESCE(SUM(CASE WHEN r.transaction_type = 'expense' THEN r.amount_expense ELSE 0 END), 0))::DECIMAL(15,2),
+        COALESCE(SUM(r.transaction_count), 0)::BIGINT
+    FROM transaction_rollups r
+    WHERE r.dimension = 'total'
+        AND (company_uuid IS NULL OR r.company_id = company_uuid)
+        AND (start_date IS NULL OR r.day >= start_date)
+        AND (end_date IS NULL OR r.day <= end_date);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Разбивка за период по категориям или контрагентам (самые крупные обороты первыми)
+CREATE OR REPLACE FUNCTION get_transaction_breakdown(
+    company_uuid UUID,
+    breakdown_dimension TEXT DEFAULT 'category',
+    start_date DATE DEFAULT NULL,
+    end_date DATE DEFAULT NULL,
+    max_rows INTEGER DEFAULT 20
+)
+RETURNS TABLE (
+    dimension_value VARCHAR(500),
+    total_income DECIMAL(15,2),
+    total_expense DECIMAL(15,2),
+    transaction_count BIGINT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        r.dimension_value,
+        COALESCE(SUM(CASE WHEN r.transaction_type = 'income' THEN r.amount_income ELSE 0 END), 0)::DECIMAL(15,2),
+        COALESCE(SUM(CASE WHEN r.transaction_type = 'expense' THEN r.amount_expense ELSE 0 END), 0)::DECIMAL(15,2),
+        SUM(r.transaction_count)::BIGINT
+    FROM transaction_rollups r
+    WHERE r.company_id = company_uuid
+        AND r.dimension = breakdown_dimension
+        AND (start_date IS NULL OR r.day >= start_date)
+        AND (end_date IS NULL OR r.day <= end_date)
+    GROUP BY r.dimension_value
+    HAVING SUM(r.transaction_count) > 0
+    ORDER BY SUM(r.amount_income + r.amount_expense) DESC
+    LIMIT max_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Обороты по дням за период (для графиков дашборда)
+CREATE OR REPLACE FUNCTION get_transaction_daily_totals(
+    company_uuid UUID,
+    start_date DATE DEFAULT NULL,
+    end_date DATE DEFAULT NULL
+)
+RETURNS TABLE (
+    day DATE,
+    total_income DECIMAL(15,2),
+    total_expense DECIMAL(15,2),
+    transaction_count BIGINT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        r.day,
+        COALESCE(SUM(CASE WHEN r.transaction_type = 'income' THEN r.amount_income ELSE 0 END), 0)::DECIMAL(15,2),
+        COALESCE(SUM(CASE WHEN r.transaction_type = 'expense' THEN r.amount_expense ELSE 0 END), 0)::DECIMAL(15,2),
+        SUM(r.transaction_count)::BIGINT
+    FROM transaction_rollups r
+    WHERE r.company_id = company_uuid
+        AND r.dimension = 'total'
+        AND (start_date IS NULL OR r.day >= start_date)
+        AND (end_date IS NULL OR r.day <= end_date)
+    GROUP BY r.day
+    HAVING SUM(r.transaction_count) > 0
+    ORDER BY r.day;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 16. Индекс для постраничного чтения истории по ключу (operation_date, id)
+CREATE INDEX IF NOT EXISTS idx_transactions_company_date_id
+    ON transactions (company_id, operation_date, id);
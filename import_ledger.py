@@ -0,0 +1,136 @@
+"""
+Локальный журнал импорта: какие файлы уже синхронизированы с Supabase
+"""
+import os
+import json
+import hashlib
+from typing import List, Dict, Iterable, Optional, Set
+
+# Файл журнала по умолчанию (рядом с выписками)
+DEFAULT_LEDGER_PATH = ".import_ledger.json"
+# Сколько hex-символов transaction_hash хранится в журнале (64 бита)
+HASH_PREFIX_LENGTH = 16
+
+def file_content_hash(file_path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 содержимого файла, читается блоками"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_fingerprint(file_path: str) -> Optional[Dict]:
+    """Размер, mtime и SHA-256 файла; None, если файл недоступен
+
+    stat снимается до хеширования: если файл перепишут во время разбора,
+    SHA-256 не совпадет со следующей версией и файл импортируется заново.
+    """
+    try:
+        stat = os.stat(file_path)
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_content_hash(file_path),
+        }
+    except OSError:
+        return None
+
+def short_hash(transaction_hash: str) -> str:
+    """Префикс transaction_hash, который хранится в журнале"""
+    return transaction_hash[:HASH_PREFIX_LENGTH]
+
+class ImportLedger:
+    """Журнал импорта, ключ файла — путь, размер/mtime и хеш содержимого
+
+    Для каждого файла хранятся отпечаток версии, которая была разобрана, и
+    префиксы transaction_hash ее строк (HASH_PREFIX_LENGTH символов). Из
+    измененного файла отправляются только строки, которых не было в прежней
+    версии, а журнал растет с числом строк в отслеживаемых файлах, а не
+    со всей историей синхронизаций.
+    """
+
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH):
+        self.path = path
+        self.data: Dict[str, Dict] = {"companies": {}}
+        self._hash_sets: Dict[tuple, Set[str]] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Читает журнал с диска (отсутствующий или битый файл — пустой журнал)"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data.get("companies"), dict):
+                self.data = data
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать журнал импорта {self.path}: {e}")
+            return
+        # Прежний формат хранил все отправленные transaction_hash компании одним списком
+        for company in self.data["companies"].values():
+            company.pop("hashes", None)
+
+    def save(self) -> None:
+        """Атомарно записывает журнал на диск"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _company(self, company_id: str) -> Dict:
+        return self.data["companies"].setdefault(str(company_id), {"files": {}})
+
+    def is_unchanged(self, company_id: str, file_path: str) -> bool:
+        """Проверяет, что файл уже импортирован и с тех пор не менялся
+
+        Удаленный или недоступный файл считается измененным: его пропустит разбор.
+        """
+        entry = self._company(company_id)["files"].get(os.path.abspath(file_path))
+        if not entry:
+            return False
+
+        try:
+            stat = os.stat(file_path)
+            if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+                return True
+
+            # Размер/mtime изменились — сверяем содержимое (например, файл скопировали заново)
+            if entry.get("size") != stat.st_size or entry.get("sha256") != file_content_hash(file_path):
+                return False
+        except OSError:
+            return False
+
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def changed_files(self, company_id: str, file_paths: List[str]) -> List[str]:
+        """Возвращает файлы, которые нужно разобрать заново"""
+        return [path for path in file_paths if not self.is_unchanged(company_id, path)]
+
+    def synced_hashes(self, company_id: str, file_path: str) -> Set[str]:
+        """Префиксы transaction_hash, уже отправленные из прежней версии файла"""
+        key = (str(company_id), os.path.abspath(file_path))
+        if key not in self._hash_sets:
+            entry = self._company(company_id)["files"].get(key[1]) or {}
+            self._hash_sets[key] = set(entry.get("hashes", ()))
+        return self._hash_sets[key]
+
+    def mark_synced(self, company_id: str, fingerprints: Dict[str, Optional[Dict]],
+                    file_hashes: Optional[Dict[str, Iterable[str]]] = None) -> None:
+        """Фиксирует успешно синхронизированные файлы
+
+        fingerprints — отпечатки, снятые до разбора (file_fingerprint): с диска
+        они не перечитываются, чтобы файл, переписанный во время синхронизации,
+        не попал в журнал непрочитанной версией. Файлы без отпечатка пропускаются.
+        file_hashes — transaction_hash (или их префиксы) строк каждого файла.
+        """
+        files = self._company(company_id)["files"]
+        file_hashes = file_hashes or {}
+        for file_path, fingerprint in fingerprints.items():
+            if fingerprint is None:
+                continue
+            hashes = sorted({short_hash(h) for h in file_hashes.get(file_path, ())})
+            path = os.path.abspath(file_path)
+            files[path] = {**fingerprint, "hashes": hashes}
+            self._hash_sets.pop((str(company_id), path), None)
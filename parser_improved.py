@@ -1,11 +1,23 @@
 import os
 import re
+import codecs
 import chardet
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Iterable
 from datetime import datetime
 from supabase_config import get_supabase_client, test_connection
-from decimal import Decimal
+from supabase_writer import bulk_upsert, report_bulk_result, DEFAULT_CHUNK_SIZE
+from import_ledger import ImportLedger, DEFAULT_LEDGER_PATH, file_fingerprint, short_hash
+from transaction_record import Transaction, as_transaction, parse_record_date
+from category_rules import get_category_matcher
+from pipeline_metrics import metrics, write_metrics
+from transaction_rollups import get_period_stats
+from transaction_reader import iter_transaction_pages, RECENT_COLUMNS
 import hashlib
+import time
+import argparse
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 
 # 🔧 Наша компания
 COMPANY_NAME = "ALCHIN"
@@ -49,26 +61,84 @@ FIELDS = [
     "КодНазначенияПлатежа",  # Код назначения
 ]
 
+# Сколько байт из начала файла смотрим при определении кодировки
+ENCODING_PROBE_BYTES = 64 * 1024
+
+# Метки порядка байт
+ENCODING_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# Значения заголовка Кодировка= формата 1CClientBankExchange
+HEADER_ENCODINGS = {"windows": "cp1251", "dos": "cp866", "utf-8": "utf-8", "utf8": "utf-8"}
+HEADER_KEY = "Кодировка="
+HEADER_VALUE_RE = re.compile(rb"\s*([A-Za-z0-9-]+)")
+
+# 🔧 Кэш кодировок: путь -> (размер, mtime_ns, кодировка)
+_encoding_cache: Dict[str, tuple] = {}
+
+def encoding_from_header(raw: bytes) -> Optional[str]:
+    """Кодировка по заголовку Кодировка= (ключ ищем в байтах каждой возможной кодировки)"""
+    for key_encoding in ("utf-8", "cp1251", "cp866"):
+        position = raw.find(HEADER_KEY.encode(key_encoding))
+        if position < 0:
+            continue
+        # Если сам ключ записан в UTF-8, файл в UTF-8, что бы ни было указано в значении
+        if key_encoding == "utf-8":
+            return "utf-8"
+        match = HEADER_VALUE_RE.match(raw, position + len(HEADER_KEY.encode(key_encoding)))
+        value = match.group(1).decode("ascii").lower() if match else ""
+        return HEADER_ENCODINGS.get(value, key_encoding)
+    return None
+
+def is_valid_utf8_prefix(raw: bytes) -> bool:
+    """Проверяет, что префикс декодируется как UTF-8 (обрезанный в конце символ допустим)"""
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(raw, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+def detect_encoding_from_prefix(raw: bytes) -> str:
+    """Определяет кодировку по префиксу файла: BOM, заголовок 1C, затем детектор"""
+    for bom, encoding in ENCODING_BOMS:
+        if raw.startswith(bom):
+            return encoding
+
+    encoding = encoding_from_header(raw)
+    if encoding:
+        return encoding
+
+    if is_valid_utf8_prefix(raw):
+        return "utf-8"
+
+    detector = chardet.UniversalDetector()
+    for start in range(0, len(raw), 4096):
+        detector.feed(raw[start:start + 4096])
+        if detector.done:
+            break
+    result = detector.close()
+    if result["encoding"] and result["confidence"] > 0.7:
+        return result["encoding"]
+    # Выгрузки 1C без UTF-8 почти всегда в Windows-1251
+    return "cp1251"
+
 def detect_encoding(filepath: str) -> str:
-    """Определяем кодировку файла с улучшенной логикой"""
+    """Определяем кодировку файла по ограниченному префиксу, результат кэшируется по пути и mtime"""
     try:
+        stat = os.stat(filepath)
+        cache_key = os.path.abspath(filepath)
+        cached = _encoding_cache.get(cache_key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
         with open(filepath, "rb") as f:
-            raw = f.read(4096)  # Увеличиваем размер для лучшего определения
-        result = chardet.detect(raw)
-        
-        # Проверяем уверенность определения
-        if result["confidence"] > 0.7:
-            return result["encoding"] or "utf-8"
-        else:
-            # Если уверенность низкая, пробуем стандартные кодировки
-            for encoding in ["utf-8", "cp1251", "windows-1251", "iso-8859-1"]:
-                try:
-                    with open(filepath, "r", encoding=encoding) as f:
-                        f.read(1024)
-                    return encoding
-                except:
-                    continue
-            return "utf-8"
+            raw = f.read(ENCODING_PROBE_BYTES)
+        encoding = detect_encoding_from_prefix(raw)
+        _encoding_cache[cache_key] = (stat.st_size, stat.st_mtime_ns, encoding)
+        return encoding
     except Exception as e:
         print(f"Ошибка определения кодировки: {e}")
         return "utf-8"
@@ -118,6 +188,83 @@ def extract_field_value(text: str, field_name: str) -> Optional[str]:
     
     return None
 
+# Индекс полей без учета регистра для однопроходного чтения документов
+FIELD_LOOKUP = {field.lower(): field for field in FIELDS}
+
+# Границы документа: СекцияДокумент= в формате 1CClientBankExchange,
+# Документ= и Операция= в упрощенных выгрузках
+DOCUMENT_STARTS = frozenset(("секциядокумент", "документ", "операция"))
+DOCUMENT_END = "конецдокумента"
+
+VALUE_CLEANUP_RE = re.compile(r'[^\w\sА-Яа-я.,-]')
+
+# Строки без "=": "Поле: значение" или "Поле значение"
+ALT_FIELD_RE = re.compile(r"^\s*(\w+)(\s*:\s*|\s+)(\S.*?)\s*$")
+
+def iter_1c_documents(file_path: str, encoding: Optional[str] = None) -> Iterator[Dict[str, str]]:
+    """Построчно читает файл 1C и выдает по одному словарю полей на документ
+
+    Файл проходится один раз, в памяти хранится только текущий документ.
+    """
+    encoding = encoding or detect_encoding(file_path)
+    with open(file_path, "r", encoding=encoding, errors="ignore") as f:
+        yield from iter_1c_lines(f)
+
+def iter_1c_lines(lines) -> Iterator[Dict[str, str]]:
+    """Конечный автомат по строкам: СекцияДокумент= (Документ=, Операция=) ... КонецДокумента
+
+    Поля читаются из строк "Поле=значение", "Поле: значение" и "Поле значение";
+    если поле встретилось в документе несколько раз, форма с "=" важнее
+    формы с ":", а та — формы через пробел. Строки до первой границы
+    считаются документом (выгрузка из одной операции без секций).
+    """
+    document = {}
+    # Поля документа, прочитанные не из "=": 1 — через ":", 2 — через пробел
+    ranks = {}
+
+    for line in lines:
+        key, sep, value = line.partition("=")
+        key = key.strip().lower()
+        rank = 0
+
+        if sep:
+            if key in DOCUMENT_STARTS:
+                # Новая секция закрывает предыдущую, даже если КонецДокумента потерян
+                if document:
+                    yield document
+                document, ranks = {}, {}
+                continue
+        elif key == DOCUMENT_END:
+            if document:
+                yield document
+            document = None
+            continue
+        else:
+            match = ALT_FIELD_RE.match(line)
+            if not match:
+                continue
+            key, value = match.group(1).lower(), match.group(3)
+            rank = 1 if ":" in match.group(2) else 2
+
+        if document is None:
+            continue
+
+        field = FIELD_LOOKUP.get(key)
+        if field is None or (field in document and ranks.get(field, 0) <= rank):
+            continue
+
+        value = VALUE_CLEANUP_RE.sub("", value.strip())
+        if value:
+            document[field] = value
+            if rank:
+                ranks[field] = rank
+            else:
+                ranks.pop(field, None)
+
+    # Последний документ без КонецДокумента
+    if document:
+        yield document
+
 def parse_date(date_str: str) -> Optional[str]:
     """Парсит дату в различных форматах"""
     if not date_str:
@@ -154,256 +301,362 @@ def parse_date(date_str: str) -> Optional[str]:
     
     return date_str  # Возвращаем исходную строку если не удалось распарсить
 
-def determine_transaction_type(record: Dict[str, str]) -> Dict[str, str]:
-    """Определяет тип транзакции с улучшенной логикой"""
-    payer_iik = record.get("ПлательщикИИК", "").strip()
-    receiver_iik = record.get("ПолучательИИК", "").strip()
-    doc_type = (record.get("ВидДокумента", "") or "").lower()
-    payment_purpose = (record.get("НазначениеПлатежа", "") or "").lower()
-    
-    # Нормализуем ИИК (убираем пробелы, приводим к верхнему регистру)
-    payer_iik = payer_iik.replace(" ", "").upper()
-    receiver_iik = receiver_iik.replace(" ", "").upper()
-    
-    # Нормализуем наши счета
-    our_accounts_normalized = [acc.replace(" ", "").upper() for acc in OUR_ACCOUNTS]
-    
-    payer_is_ours = payer_iik in our_accounts_normalized
-    receiver_is_ours = receiver_iik in our_accounts_normalized
-    
-    result = {
-        "ТипТранзакции": "",
-        "СчетОткуда": "",
-        "СчетКуда": "",
-        "Счет": "",
-        "Контрагент": "",
-        "Категория": "",
-    }
+def normalize_account(iik: str) -> str:
+    """Нормализует ИИК: без пробелов, в верхнем регистре"""
+    return (iik or "").strip().replace(" ", "").upper()
+
+# Индекс наших счетов (дубликаты из OUR_ACCOUNTS схлопываются) и общий шаблон кассовых слов
+OUR_ACCOUNTS_INDEX = frozenset(normalize_account(acc) for acc in OUR_ACCOUNTS)
+CASH_KEYWORDS_RE = re.compile("|".join(re.escape(kw) for kw in CASH_KEYWORDS), re.IGNORECASE)
+
+# Колонки результата классификации
+CLASSIFICATION_FIELDS = ["ТипТранзакции", "СчетОткуда", "СчетКуда", "Счет", "Контрагент", "Категория"]
+EMPTY_CLASSIFICATION = ("", "", "", "", "", "")
+
+def classify_transaction(
+    payer_iik: str,
+    receiver_iik: str,
+    doc_type: str,
+    payment_purpose: str,
+    has_expense: bool,
+    has_income: bool,
+    payer_name: str,
+    receiver_name: str,
+) -> tuple:
+    """Классифицирует одну операцию, возвращает значения в порядке CLASSIFICATION_FIELDS"""
+    payer_iik = normalize_account(payer_iik)
+    receiver_iik = normalize_account(receiver_iik)
+    payer_is_ours = payer_iik in OUR_ACCOUNTS_INDEX
+    receiver_is_ours = receiver_iik in OUR_ACCOUNTS_INDEX
     
     # 1) Переводы между своими банковскими счетами
     if payer_is_ours and receiver_is_ours:
-        # Перевод между своими счетами
-        result["ТипТранзакции"] = "transfer"
-        result["СчетОткуда"] = payer_iik
-        result["СчетКуда"] = receiver_iik
-        result["Контрагент"] = "Перевод между своими счетами"
-        result["Категория"] = "Перевод"
+        return ("transfer", payer_iik, receiver_iik, "", "Перевод между своими счетами", "Перевод")
     # 2) Банковский расход
-    elif payer_is_ours:
-        # Расход
-        result["ТипТранзакции"] = "expense"
-        result["Счет"] = payer_iik
-        result["Контрагент"] = record.get("ПолучательНаименование", "")
-        result["Категория"] = "Расход"
+    if payer_is_ours:
+        return ("expense", "", "", payer_iik, receiver_name, "Расход")
     # 3) Банковский доход
-    elif receiver_is_ours:
-        # Доход
-        result["ТипТранзакции"] = "income"
-        result["Счет"] = receiver_iik
-        result["Контрагент"] = record.get("ПлательщикНаименование", "")
-        result["Категория"] = "Доход"
+    if receiver_is_ours:
+        return ("income", "", "", receiver_iik, payer_name, "Доход")
+    
+    # 4) НАЛИЧНАЯ КАССА: если не нашли наши банковские ИИК, но по тексту видно, что операция кассовая
+    if not (CASH_KEYWORDS_RE.search(doc_type or "") or CASH_KEYWORDS_RE.search(payment_purpose or "")):
+        return EMPTY_CLASSIFICATION
+    
+    # Определяем направление по суммам
+    if has_expense and not has_income:
+        return ("expense", "", "", CASH_ACCOUNT, receiver_name or "Наличные расход", "Расход")
+    if has_income and not has_expense:
+        return ("income", "", "", CASH_ACCOUNT, payer_name or "Наличные приход", "Доход")
+    # Если обе суммы или ни одной — оставляем неопределенной, пусть отфильтруется валидатором
+    return EMPTY_CLASSIFICATION
+
+def classify_transactions(
+    payer_iiks: List[str],
+    receiver_iiks: List[str],
+    doc_types: List[str],
+    payment_purposes: List[str],
+    has_expenses: List[bool],
+    has_incomes: List[bool],
+    payer_names: List[str],
+    receiver_names: List[str],
+) -> Dict[str, List[str]]:
+    """Классифицирует пачку операций по колонкам
+
+    Принимает колонки одинаковой длины и возвращает колонки
+    ТипТранзакции/СчетОткуда/СчетКуда/Счет/Контрагент/Категория.
+    """
+    rows = map(
+        classify_transaction,
+        payer_iiks, receiver_iiks, doc_types, payment_purposes,
+        has_expenses, has_incomes, payer_names, receiver_names,
+    )
+    columns = list(zip(*rows)) or [() for _ in CLASSIFICATION_FIELDS]
+    return {field: list(column) for field, column in zip(CLASSIFICATION_FIELDS, columns)}
+
+def classify_records(records: List[Dict[str, str]]) -> Dict[str, List[str]]:
+    """Классифицирует список записей парсера одним проходом по колонкам"""
+    return classify_transactions(
+        [r.get("ПлательщикИИК", "") for r in records],
+        [r.get("ПолучательИИК", "") for r in records],
+        [r.get("ВидДокумента", "") for r in records],
+        [r.get("НазначениеПлатежа", "") for r in records],
+        [bool(r.get("СуммаРасход")) for r in records],
+        [bool(r.get("СуммаПриход")) for r in records],
+        [r.get("ПлательщикНаименование", "") for r in records],
+        [r.get("ПолучательНаименование", "") for r in records],
+    )
+
+def determine_transaction_type(record: Dict[str, str]) -> Dict[str, str]:
+    """Определяет тип транзакции с улучшенной логикой"""
+    values = classify_transaction(
+        record.get("ПлательщикИИК", ""),
+        record.get("ПолучательИИК", ""),
+        record.get("ВидДокумента", ""),
+        record.get("НазначениеПлатежа", ""),
+        bool(record.get("СуммаРасход")),
+        bool(record.get("СуммаПриход")),
+        record.get("ПлательщикНаименование", ""),
+        record.get("ПолучательНаименование", ""),
+    )
+    return dict(zip(CLASSIFICATION_FIELDS, values))
+
+# 🔧 Кэш company_id: имя компании -> (id, момент истечения)
+COMPANY_CACHE_TTL = 3600  # секунд
+_company_cache: Dict[str, tuple] = {}
+
+def get_company_id(company_name: str = COMPANY_NAME, supabase=None) -> Optional[str]:
+    """Возвращает id компании по имени, обращаясь к базе не чаще раза в COMPANY_CACHE_TTL"""
+    cached = _company_cache.get(company_name)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
+    supabase = supabase or get_supabase_client()
+    company_result = supabase.table("companies").select("id").eq("name", company_name).execute()
+    if not company_result.data:
+        return None
+    
+    company_id = company_result.data[0]["id"]
+    _company_cache[company_name] = (company_id, time.monotonic() + COMPANY_CACHE_TTL)
+    return company_id
+
+def preload_companies(company_names: List[str], supabase=None) -> Dict[str, str]:
+    """Загружает id нескольких компаний одним запросом (для мультитенантных запусков)"""
+    supabase = supabase or get_supabase_client()
+    result = supabase.table("companies").select("id,name").in_("name", list(company_names)).execute()
+    
+    expires_at = time.monotonic() + COMPANY_CACHE_TTL
+    found = {}
+    for row in result.data or []:
+        # При дублях имени берем первую запись, как и get_company_id
+        if row["name"] not in found:
+            found[row["name"]] = row["id"]
+            _company_cache[row["name"]] = (row["id"], expires_at)
+    return found
+
+def clear_company_cache() -> None:
+    """Сбрасывает кэш company_id"""
+    _company_cache.clear()
+
+def is_cash_record(record) -> bool:
+    """Проверяет, является ли операция кассовой"""
+    transaction = as_transaction(record)
+    return bool(
+        CASH_KEYWORDS_RE.search(transaction.document_type)
+        or CASH_KEYWORDS_RE.search(transaction.payment_purpose)
+        or CASH_KEYWORDS_RE.search(transaction.counterparty)
+    )
+
+def build_db_transaction(transaction, company_id: str) -> Optional[Dict]:
+    """Готовит строку таблицы transactions из Transaction (или словаря парсера)"""
+    transaction = as_transaction(transaction)
+    
+    if not transaction.operation_date:
+        print(f"⚠️ Не удалось распарсить дату операции документа {transaction.document_number}")
+        return None
+    
+    # Суммы уже в тиынах
+    expense_tiyn = transaction.expense_tiyn
+    income_tiyn = transaction.income_tiyn
+    
+    # Если есть общая сумма, но нет конкретных расходов/доходов
+    if transaction.total_tiyn and expense_tiyn == 0 and income_tiyn == 0:
+        if transaction.transaction_type == "expense":
+            expense_tiyn = transaction.total_tiyn
+        elif transaction.transaction_type == "income":
+            income_tiyn = transaction.total_tiyn
+    
+    db_transaction = {
+        "company_id": company_id,
+        "transaction_type": transaction.transaction_type,
+        "operation_date": transaction.operation_date.isoformat(),
+        "document_date": transaction.document_date.isoformat() if transaction.document_date else None,
+        "document_number": transaction.document_number,
+        "document_type": transaction.document_type,
+        "amount_expense": expense_tiyn / 100,
+        "amount_income": income_tiyn / 100,
+        # Если операция кассовая, фиксируем счет как CASH
+        "payer_account": (CASH_ACCOUNT if (transaction.transaction_type == "expense" and transaction.account == CASH_ACCOUNT) else transaction.payer_account),
+        "receiver_account": (CASH_ACCOUNT if (transaction.transaction_type == "income" and transaction.account == CASH_ACCOUNT) else transaction.receiver_account),
+        "from_account": transaction.from_account,
+        "to_account": transaction.to_account,
+        "payer_name": transaction.payer_name,
+        "receiver_name": transaction.receiver_name,
+        "payer_bin_iin": transaction.payer_bin_iin,
+        "receiver_bin_iin": transaction.receiver_bin_iin,
+        "payment_purpose": transaction.payment_purpose,
+        "payment_code": transaction.payment_code,
+        "counterparty": transaction.counterparty,
+        "category": transaction.category,
+    }
+
+    # Стабильный хеш транзакции для идемпотентной синхронизации
+    hash_source_parts = [
+        str(company_id),
+        str(db_transaction.get("transaction_type", "")).strip().lower(),
+        str(db_transaction.get("operation_date", "")),
+        str(db_transaction.get("document_date", "")),
+        str(db_transaction.get("document_number", "")).strip(),
+        str(db_transaction.get("amount_expense", 0.0)),
+        str(db_transaction.get("amount_income", 0.0)),
+        str(db_transaction.get("payer_account", "")).replace(" ", "").upper(),
+        str(db_transaction.get("receiver_account", "")).replace(" ", "").upper(),
+        str(db_transaction.get("from_account", "")).replace(" ", "").upper(),
+        str(db_transaction.get("to_account", "")).replace(" ", "").upper(),
+        str(db_transaction.get("counterparty", "")).strip().lower(),
+    ]
+    hash_source = "|".join(hash_source_parts)
+    db_transaction["transaction_hash"] = hashlib.sha256(hash_source.encode("utf-8")).hexdigest()
+    
+    return db_transaction
+
+def build_cash_db_transaction(transaction, company_id: str) -> Optional[Dict]:
+    """Готовит строку кассовой операции для таблицы transactions"""
+    transaction = as_transaction(transaction)
+    
+    if not transaction.operation_date:
+        print(f"⚠️ Не удалось распарсить дату операции документа {transaction.document_number}")
+        return None
+    
+    expense_tiyn = transaction.expense_tiyn
+    income_tiyn = transaction.income_tiyn
+    
+    # Определяем тип кассовой операции
+    if expense_tiyn > 0 and income_tiyn == 0:
+        transaction_type = "expense"
+        counterparty = transaction.receiver_name or "Кассовый расход"
+    elif income_tiyn > 0 and expense_tiyn == 0:
+        transaction_type = "income"
+        counterparty = transaction.payer_name or "Кассовый приход"
     else:
-        # 4) НАЛИЧНАЯ КАССА: если не нашли наши банковские ИИК, но по тексту видно, что операция кассовая
-        is_cash_related = any(kw in doc_type for kw in CASH_KEYWORDS) or any(kw in payment_purpose for kw in CASH_KEYWORDS)
-
-        if is_cash_related:
-            # Определяем направление по суммам
-            expense_exists = bool(record.get("СуммаРасход"))
-            income_exists = bool(record.get("СуммаПриход"))
-
-            if expense_exists and not income_exists:
-                result["ТипТранзакции"] = "expense"
-                result["Счет"] = CASH_ACCOUNT
-                result["Контрагент"] = record.get("ПолучательНаименование", "") or "Наличные расход"
-                result["Категория"] = "Расход"
-            elif income_exists and not expense_exists:
-                result["ТипТранзакции"] = "income"
-                result["Счет"] = CASH_ACCOUNT
-                result["Контрагент"] = record.get("ПлательщикНаименование", "") or "Наличные приход"
-                result["Категория"] = "Доход"
-            else:
-                # Если обе суммы или ни одной — оставляем неопределенной, пусть отфильтруется валидатором
-                pass
+        return None  # Пропускаем неопределенные операции
     
-    return result
+    db_transaction = {
+        "company_id": company_id,
+        "transaction_type": transaction_type,
+        "operation_date": transaction.operation_date.isoformat(),
+        "document_date": None,
+        "document_number": transaction.document_number,
+        "document_type": transaction.document_type,
+        "amount_expense": expense_tiyn / 100,
+        "amount_income": income_tiyn / 100,
+        "payer_account": CASH_ACCOUNT if transaction_type == "expense" else "",
+        "receiver_account": CASH_ACCOUNT if transaction_type == "income" else "",
+        "from_account": "",
+        "to_account": "",
+        "payer_name": transaction.payer_name,
+        "receiver_name": transaction.receiver_name,
+        "payer_bin_iin": "",
+        "receiver_bin_iin": "",
+        "payment_purpose": transaction.payment_purpose,
+        "payment_code": transaction.payment_code,
+        "counterparty": counterparty,
+        "category": "Касса",
+    }
+    
+    # Стабильный хеш для кассовых операций
+    hash_source_parts = [
+        str(company_id),
+        "cash",
+        str(db_transaction.get("operation_date", "")),
+        str(db_transaction.get("document_number", "")).strip(),
+        str(db_transaction.get("amount_expense", 0.0)),
+        str(db_transaction.get("amount_income", 0.0)),
+        str(db_transaction.get("counterparty", "")).strip().lower(),
+    ]
+    hash_source = "|".join(hash_source_parts)
+    db_transaction["transaction_hash"] = hashlib.sha256(hash_source.encode("utf-8")).hexdigest()
+    
+    return db_transaction
+
+def upsert_db_transactions(db_transactions: List[Dict], supabase, chunk_size: int = DEFAULT_CHUNK_SIZE, label: str = "транзакций") -> bool:
+    """Идемпотентно записывает подготовленные строки по (company_id, transaction_hash)"""
+    # Важно: должен существовать unique index на (company_id, transaction_hash)
+    with metrics.stage("upsert"):
+        result = bulk_upsert(
+            "transactions",
+            db_transactions,
+            on_conflict="company_id,transaction_hash",
+            chunk_size=chunk_size,
+            client=supabase,
+        )
+    metrics.count("written", result.written)
+    metrics.count("failed", len(db_transactions) - result.written)
+    report_bulk_result(result, label=label)
+    
+    if result.ok:
+        print(f"✅ Успешно синхронизировано {result.written} {label} с базой данных")
+        return True
+    else:
+        print(f"❌ Ошибка при сохранении {label}: не записано {len(db_transactions) - result.written} из {len(db_transactions)}")
+        return False
+
+def apply_category_rules(transactions: List[Transaction], supabase=None) -> None:
+    """Проставляет категории по активным правилам category_rules"""
+    with metrics.stage("categorize"):
+        matched = get_category_matcher(supabase).categorize(transactions)
+    if matched:
+        print(f"🏷️ Категоризировано по правилам: {matched} из {len(transactions)}")
 
-def save_transactions_to_database(transactions: List[Dict[str, str]]) -> bool:
-    """Сохраняет транзакции в базу данных Supabase"""
+def save_transactions_to_database(transactions: List, chunk_size: int = DEFAULT_CHUNK_SIZE) -> bool:
+    """Сохраняет транзакции (Transaction или словари парсера) в базу данных Supabase"""
     try:
         supabase = get_supabase_client()
         
         # Получаем ID нашей компании
-        company_result = supabase.table("companies").select("id").eq("name", COMPANY_NAME).execute()
-        if not company_result.data:
+        company_id = get_company_id(COMPANY_NAME, supabase)
+        if not company_id:
             print(f"❌ Компания {COMPANY_NAME} не найдена в базе данных")
             return False
         
-        company_id = company_result.data[0]["id"]
+        transactions = [as_transaction(transaction) for transaction in transactions]
+        apply_category_rules(transactions, supabase)
         
         # Подготавливаем данные для вставки/синхронизации
         db_transactions = []
-        for transaction in transactions:
-            # Конвертируем дату
-            operation_date = None
-            if transaction.get("ДатаОперации"):
-                try:
-                    operation_date = datetime.strptime(transaction["ДатаОперации"], "%d.%m.%Y").date()
-                except:
-                    try:
-                        operation_date = datetime.strptime(transaction["ДатаОперации"], "%Y-%m-%d").date()
-                    except:
-                        print(f"⚠️ Не удалось распарсить дату: {transaction['ДатаОперации']}")
-                        continue
-            
-            document_date = None
-            if transaction.get("ДатаДокумента"):
-                try:
-                    document_date = datetime.strptime(transaction["ДатаДокумента"], "%d.%m.%Y").date()
-                except:
-                    try:
-                        document_date = datetime.strptime(transaction["ДатаДокумента"], "%Y-%m-%d").date()
-                    except:
-                        pass
-            
-            # Конвертируем суммы
-            amount_expense = Decimal(0)
-            amount_income = Decimal(0)
-            
-            if transaction.get("СуммаРасход"):
-                try:
-                    amount_expense = Decimal(str(transaction["СуммаРасход"]).replace(",", "."))
-                except:
-                    pass
-            
-            if transaction.get("СуммаПриход"):
-                try:
-                    amount_income = Decimal(str(transaction["СуммаПриход"]).replace(",", "."))
-                except:
-                    pass
-            
-            # Если есть общая сумма, но нет конкретных расходов/доходов
-            if transaction.get("Сумма") and amount_expense == 0 and amount_income == 0:
-                try:
-                    amount = Decimal(str(transaction["Сумма"]).replace(",", "."))
-                    if transaction.get("ТипТранзакции") == "expense":
-                        amount_expense = amount
-                    elif transaction.get("ТипТранзакции") == "income":
-                        amount_income = amount
-                except:
-                    pass
-            
-            db_transaction = {
-                "company_id": company_id,
-                "transaction_type": transaction.get("ТипТранзакции", ""),
-                "operation_date": operation_date.isoformat() if operation_date else None,
-                "document_date": document_date.isoformat() if document_date else None,
-                "document_number": transaction.get("НомерДокумента", ""),
-                "document_type": transaction.get("ВидДокумента", ""),
-                "amount_expense": float(amount_expense),
-                "amount_income": float(amount_income),
-                # Если операция кассовая, фиксируем счет как CASH
-                "payer_account": (CASH_ACCOUNT if (transaction.get("ТипТранзакции") == "expense" and transaction.get("Счет") == CASH_ACCOUNT) else transaction.get("ПлательщикИИК", "")),
-                "receiver_account": (CASH_ACCOUNT if (transaction.get("ТипТранзакции") == "income" and transaction.get("Счет") == CASH_ACCOUNT) else transaction.get("ПолучательИИК", "")),
-                "from_account": transaction.get("СчетОткуда", ""),
-                "to_account": transaction.get("СчетКуда", ""),
-                "payer_name": transaction.get("ПлательщикНаименование", ""),
-                "receiver_name": transaction.get("ПолучательНаименование", ""),
-                "payer_bin_iin": transaction.get("ПлательщикБИН_ИИН", ""),
-                "receiver_bin_iin": transaction.get("ПолучательБИН_ИИН", ""),
-                "payment_purpose": transaction.get("НазначениеПлатежа", ""),
-                "payment_code": transaction.get("КодНазначенияПлатежа", ""),
-                "counterparty": transaction.get("Контрагент", ""),
-                "category": transaction.get("Категория", ""),
-            }
-
-            # Стабильный хеш транзакции для идемпотентной синхронизации
-            hash_source_parts = [
-                str(company_id),
-                str(db_transaction.get("transaction_type", "")).strip().lower(),
-                str(db_transaction.get("operation_date", "")),
-                str(db_transaction.get("document_date", "")),
-                str(db_transaction.get("document_number", "")).strip(),
-                str(db_transaction.get("amount_expense", 0.0)),
-                str(db_transaction.get("amount_income", 0.0)),
-                str(db_transaction.get("payer_account", "")).replace(" ", "").upper(),
-                str(db_transaction.get("receiver_account", "")).replace(" ", "").upper(),
-                str(db_transaction.get("from_account", "")).replace(" ", "").upper(),
-                str(db_transaction.get("to_account", "")).replace(" ", "").upper(),
-                str(db_transaction.get("counterparty", "")).strip().lower(),
-            ]
-            hash_source = "|".join(hash_source_parts)
-            transaction_hash = hashlib.sha256(hash_source.encode("utf-8")).hexdigest()
-            db_transaction["transaction_hash"] = transaction_hash
-            
-            db_transactions.append(db_transaction)
+        with metrics.stage("build_rows"):
+            for transaction in transactions:
+                db_transaction = build_db_transaction(transaction, company_id)
+                if db_transaction:
+                    db_transactions.append(db_transaction)
         
         if not db_transactions:
             print("❌ Нет валидных транзакций для сохранения")
             return False
         
-        # Идемпотентная синхронизация по (company_id, transaction_hash)
-        # Важно: должен существовать unique index на (company_id, transaction_hash)
-        result = (
-            supabase
-            .table("transactions")
-            .upsert(db_transactions, on_conflict="company_id,transaction_hash")
-            .select("*")
-            .execute()
-        )
-        
-        if getattr(result, "data", None) is not None:
-            saved = len(result.data)
-            print(f"✅ Успешно синхронизировано {saved} транзакций с базой данных")
-            return True
-        else:
-            print(f"❌ Ошибка при сохранении транзакций: {getattr(result, 'error', 'unknown error')}")
-            return False
+        return upsert_db_transactions(db_transactions, supabase, chunk_size)
 
     except Exception as e:
         print(f"❌ Ошибка при сохранении в базу данных: {e}")
         return False
 
-def sync_transactions(file_paths: List[str]) -> bool:
+def sync_transactions(file_paths: List[str], workers: int = 1) -> bool:
     """Высокоуровневая синхронизация: парсит файлы и делает upsert в БД"""
-    records = parse_1c_files_improved(file_paths)
+    records = parse_1c_transactions(file_paths, workers=workers)
     if not records:
         print("ℹ️ Нет валидных операций для синхронизации")
         return False
     return save_transactions_to_database(records)
 
-def sync_cash_transactions(file_paths: List[str]) -> bool:
+def sync_cash_transactions(file_paths: List[str], workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE) -> bool:
     """Специальная синхронизация кассовых операций"""
     try:
         supabase = get_supabase_client()
         
         # Получаем ID нашей компании
-        company_result = supabase.table("companies").select("id").eq("name", COMPANY_NAME).execute()
-        if not company_result.data:
+        company_id = get_company_id(COMPANY_NAME, supabase)
+        if not company_id:
             print(f"❌ Компания {COMPANY_NAME} не найдена в базе данных")
             return False
         
-        company_id = company_result.data[0]["id"]
-        
         # Парсим файлы
-        records = parse_1c_files_improved(file_paths)
+        records = parse_1c_transactions(file_paths, workers=workers)
         if not records:
             print("ℹ️ Нет файлов для обработки")
             return False
         
         # Фильтруем только кассовые операции
-        cash_records = []
-        for record in records:
-            doc_type = (record.get("ВидДокумента", "") or "").lower()
-            payment_purpose = (record.get("НазначениеПлатежа", "") or "").lower()
-            counterparty = (record.get("Контрагент", "") or "").lower()
-            
-            # Проверяем, является ли операция кассовой
-            is_cash = any(kw in doc_type for kw in CASH_KEYWORDS) or \
-                     any(kw in payment_purpose for kw in CASH_KEYWORDS) or \
-                     any(kw in counterparty for kw in CASH_KEYWORDS)
-            
-            if is_cash:
-                cash_records.append(record)
+        cash_records = [record for record in records if is_cash_record(record)]
         
         if not cash_records:
             print("ℹ️ Кассовые операции не найдены")
@@ -413,111 +666,190 @@ def sync_cash_transactions(file_paths: List[str]) -> bool:
         
         # Подготавливаем данные для вставки
         db_transactions = []
-        for transaction in cash_records:
-            # Конвертируем дату
-            operation_date = None
-            if transaction.get("ДатаОперации"):
-                try:
-                    operation_date = datetime.strptime(transaction["ДатаОперации"], "%d.%m.%Y").date()
-                except:
-                    try:
-                        operation_date = datetime.strptime(transaction["ДатаОперации"], "%Y-%m-%d").date()
-                    except:
-                        print(f"⚠️ Не удалось распарсить дату: {transaction['ДатаОперации']}")
-                        continue
-            
-            # Конвертируем суммы
-            amount_expense = Decimal(0)
-            amount_income = Decimal(0)
-            
-            if transaction.get("СуммаРасход"):
-                try:
-                    amount_expense = Decimal(str(transaction["СуммаРасход"]).replace(",", "."))
-                except:
-                    pass
-            
-            if transaction.get("СуммаПриход"):
-                try:
-                    amount_income = Decimal(str(transaction["СуммаПриход"]).replace(",", "."))
-                except:
-                    pass
-            
-            # Определяем тип кассовой операции
-            if amount_expense > 0 and amount_income == 0:
-                transaction_type = "expense"
-                counterparty = transaction.get("ПолучательНаименование", "") or "Кассовый расход"
-            elif amount_income > 0 and amount_expense == 0:
-                transaction_type = "income"
-                counterparty = transaction.get("ПлательщикНаименование", "") or "Кассовый приход"
-            else:
-                continue  # Пропускаем неопределенные операции
-            
-            db_transaction = {
-                "company_id": company_id,
-                "transaction_type": transaction_type,
-                "operation_date": operation_date.isoformat() if operation_date else None,
-                "document_date": None,
-                "document_number": transaction.get("НомерДокумента", ""),
-                "document_type": transaction.get("ВидДокумента", ""),
-                "amount_expense": float(amount_expense),
-                "amount_income": float(amount_income),
-                "payer_account": CASH_ACCOUNT if transaction_type == "expense" else "",
-                "receiver_account": CASH_ACCOUNT if transaction_type == "income" else "",
-                "from_account": "",
-                "to_account": "",
-                "payer_name": transaction.get("ПлательщикНаименование", ""),
-                "receiver_name": transaction.get("ПолучательНаименование", ""),
-                "payer_bin_iin": "",
-                "receiver_bin_iin": "",
-                "payment_purpose": transaction.get("НазначениеПлатежа", ""),
-                "payment_code": transaction.get("КодНазначенияПлатежа", ""),
-                "counterparty": counterparty,
-                "category": "Касса",
-            }
-            
-            # Стабильный хеш для кассовых операций
-            hash_source_parts = [
-                str(company_id),
-                "cash",
-                str(db_transaction.get("operation_date", "")),
-                str(db_transaction.get("document_number", "")).strip(),
-                str(db_transaction.get("amount_expense", 0.0)),
-                str(db_transaction.get("amount_income", 0.0)),
-                str(db_transaction.get("counterparty", "")).strip().lower(),
-            ]
-            hash_source = "|".join(hash_source_parts)
-            transaction_hash = hashlib.sha256(hash_source.encode("utf-8")).hexdigest()
-            db_transaction["transaction_hash"] = transaction_hash
-            
-            db_transactions.append(db_transaction)
+        with metrics.stage("build_rows"):
+            for transaction in cash_records:
+                db_transaction = build_cash_db_transaction(transaction, company_id)
+                if db_transaction:
+                    db_transactions.append(db_transaction)
         
         if not db_transactions:
             print("❌ Нет валидных кассовых транзакций для сохранения")
             return False
         
         # Идемпотентная синхронизация кассовых операций
-        result = (
-            supabase
-            .table("transactions")
-            .upsert(db_transactions, on_conflict="company_id,transaction_hash")
-            .select("*")
-            .execute()
-        )
-        
-        if getattr(result, "data", None) is not None:
-            saved = len(result.data)
-            print(f"✅ Успешно синхронизировано {saved} кассовых операций с базой данных")
-            return True
-        else:
-            print(f"❌ Ошибка при сохранении кассовых операций: {getattr(result, 'error', 'unknown error')}")
-            return False
+        return upsert_db_transactions(db_transactions, supabase, chunk_size, label="кассовых операций")
             
     except Exception as e:
         print(f"❌ Ошибка при синхронизации кассовых операций: {e}")
         return False
+
+def build_db_rows(records: Iterable[Transaction], company_id: str, seen_hashes: Optional[set] = None) -> tuple:
+    """Строит банковские и кассовые строки, пропуская уже встреченные transaction_hash
+
+    Возвращает (строки, число кассовых операций). seen_hashes можно передавать
+    между вызовами, чтобы не повторять строки при разборе пачками.
+    """
+    db_transactions = []
+    seen_hashes = set() if seen_hashes is None else seen_hashes
+    cash_count = 0
+    duplicate_rows = 0
+    
+    with metrics.stage("build_rows"):
+        for record in records:
+            rows = [build_db_transaction(record, company_id)]
+            if is_cash_record(record):
+                cash_row = build_cash_db_transaction(record, company_id)
+                if cash_row:
+                    cash_count += 1
+                    rows.append(cash_row)
+            
+            for row in rows:
+                # Один upsert не может дважды затронуть одну и ту же строку
+                if not row:
+                    continue
+                if row["transaction_hash"] in seen_hashes:
+                    duplicate_rows += 1
+                    continue
+                seen_hashes.add(row["transaction_hash"])
+                db_transactions.append(row)
+    
+    metrics.skip("duplicate_row", duplicate_rows)
+    return db_transactions, cash_count
+
+def build_all_db_transactions(records: List[Transaction], company_id: str) -> List[Dict]:
+    """Раскладывает записи по банковскому и кассовому пути в памяти
+
+    Каждая запись дает банковскую строку, кассовые операции дополнительно
+    дают строку с category = "Касса" (как при раздельной синхронизации).
+    """
+    db_transactions, cash_count = build_db_rows(records, company_id)
+    
+    if cash_count:
+        print(f"💰 Найдено {cash_count} кассовых операций")
+    
+    return db_transactions
+
+def build_file_db_rows(file_path: str, records: Iterable[Transaction], company_id: str,
+                       file_hashes: Dict[str, set], seen_hashes: set,
+                       ledger: Optional[ImportLedger] = None) -> tuple:
+    """Строит строки операций одного файла и отбирает еще не импортированные
+
+    Префиксы transaction_hash всех строк файла копятся в file_hashes[file_path]
+    для журнала. Строки, отправленные с прежней версией файла (по журналу)
+    или уже в этом запуске (seen_hashes), пропускаются.
+    Возвращает (строки к отправке, число кассовых операций).
+    """
+    rows, cash_count = build_db_rows(records, company_id)
+    hashes = file_hashes.setdefault(file_path, set())
+    synced = ledger.synced_hashes(company_id, file_path) if ledger is not None else set()
+    new_rows = []
+    already_synced = duplicate_rows = 0
+    for row in rows:
+        transaction_hash = row["transaction_hash"]
+        prefix = short_hash(transaction_hash)
+        hashes.add(prefix)
+        if prefix in synced:
+            already_synced += 1
+        elif transaction_hash in seen_hashes:
+            duplicate_rows += 1
+        else:
+            seen_hashes.add(transaction_hash)
+            new_rows.append(row)
+    metrics.skip("already_synced", already_synced)
+    metrics.skip("duplicate_row", duplicate_rows)
+    return new_rows, cash_count
+
+def select_changed_files(ledger: ImportLedger, company_id: str, file_paths: List[str]) -> Dict[str, Dict]:
+    """Оставляет файлы, изменившиеся с прошлого импорта, с отпечатками до разбора
+
+    Возвращает {путь: отпечаток} в порядке file_paths; эти же отпечатки
+    передаются в ledger.mark_synced после успешной записи.
+    """
+    with metrics.stage("ledger"):
+        changed = ledger.changed_files(company_id, file_paths)
+        fingerprints = {path: file_fingerprint(path) for path in changed}
+    skipped = len(file_paths) - len(changed)
+    metrics.skip("unchanged_file", skipped)
+    if skipped:
+        print(f"⏭️ Пропущено {skipped} уже импортированных файлов")
+    # Файл мог исчезнуть после получения списка: пропускаем его, как и разбор
+    missing = [path for path, fingerprint in fingerprints.items() if fingerprint is None]
+    if missing:
+        metrics.skip("missing_file", len(missing))
+        print(f"⚠️ Файлы не найдены и пропущены: {', '.join(missing)}")
+    return {path: fingerprint for path, fingerprint in fingerprints.items() if fingerprint is not None}
+
+def sync_all_transactions(file_paths: List[str], workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                          ledger: Optional[ImportLedger] = None) -> bool:
+    """Синхронизирует банковские и кассовые операции за один разбор файлов и одну запись
+
+    С журналом импорта (ledger) неизменившиеся файлы пропускаются целиком,
+    а из измененных отправляются только строки, которых не было в прежней
+    версии файла.
+    """
+    try:
+        supabase = get_supabase_client()
+        
+        # Получаем ID нашей компании
+        company_id = get_company_id(COMPANY_NAME, supabase)
+        if not company_id:
+            print(f"❌ Компания {COMPANY_NAME} не найдена в базе данных")
+            return False
+        
+        if ledger is None:
+            records = parse_1c_transactions(file_paths, workers=workers)
+            print(f"✅ Найдено {len(records)} операций")
+            if not records:
+                print("ℹ️ Нет валидных операций для синхронизации")
+                return False
+            
+            apply_category_rules(records, supabase)
+            db_transactions = build_all_db_transactions(records, company_id)
+            
+            if not db_transactions:
+                print("❌ Нет валидных транзакций для сохранения")
+                return False
             
+            return upsert_db_transactions(db_transactions, supabase, chunk_size)
+        
+        fingerprints = select_changed_files(ledger, company_id, file_paths)
+        if not fingerprints:
+            print("ℹ️ Новых данных для синхронизации нет")
+            ledger.save()
+            return True
+        
+        files = [(file_path, list(transactions)) for file_path, transactions
+                 in iter_1c_transactions_by_file(list(fingerprints), workers=workers)]
+        records = [record for _, transactions in files for record in transactions]
+        print(f"✅ Найдено {len(records)} операций")
+        if not records:
+            print("ℹ️ Нет валидных операций для синхронизации")
+            return False
+        
+        apply_category_rules(records, supabase)
+        db_transactions, file_hashes, seen_hashes, cash_count = [], {}, set(), 0
+        for file_path, transactions in files:
+            rows, file_cash = build_file_db_rows(file_path, transactions, company_id, file_hashes, seen_hashes, ledger)
+            db_transactions.extend(rows)
+            cash_count += file_cash
+        if cash_count:
+            print(f"💰 Найдено {cash_count} кассовых операций")
+        
+        success = True
+        if db_transactions:
+            success = upsert_db_transactions(db_transactions, supabase, chunk_size)
+        else:
+            print("ℹ️ Новых строк нет: все операции уже импортированы")
+        
+        # В журнал попадают только полностью записанные файлы
+        if success:
+            ledger.mark_synced(company_id, fingerprints, file_hashes)
+            ledger.save()
+        
+        return success
+    
     except Exception as e:
-        print(f"❌ Ошибка при сохранении в базу данных: {e}")
+        print(f"❌ Ошибка при синхронизации транзакций: {e}")
         return False
 
 def get_transaction_statistics(start_date: str = None, end_date: str = None) -> Dict:
@@ -526,48 +858,30 @@ def get_transaction_statistics(start_date: str = None, end_date: str = None) ->
         supabase = get_supabase_client()
         
         # Получаем ID нашей компании
-        company_result = supabase.table("companies").select("id").eq("name", COMPANY_NAME).execute()
-        if not company_result.data:
+        company_id = get_company_id(COMPANY_NAME, supabase)
+        if not company_id:
             return {"error": f"Компания {COMPANY_NAME} не найдена"}
         
-        company_id = company_result.data[0]["id"]
-        
-        # Вызываем функцию статистики
-        result = supabase.rpc("get_transaction_stats", {
-            "company_uuid": company_id,
-            "start_date": start_date,
-            "end_date": end_date
-        }).execute()
-        
-        if result.data:
-            return result.data[0]
-        else:
-            return {"error": "Не удалось получить статистику"}
+        # Статистика читается из сводок по дням, а не сканированием transactions
+        return get_period_stats(company_id, start_date, end_date, supabase)
             
     except Exception as e:
         return {"error": f"Ошибка при получении статистики: {e}"}
 
-def get_recent_transactions(limit: int = 10) -> List[Dict]:
+def get_recent_transactions(limit: int = 10, columns: Iterable[str] = RECENT_COLUMNS) -> List[Dict]:
     """Получает последние транзакции из базы данных"""
     try:
         supabase = get_supabase_client()
         
         # Получаем ID нашей компании
-        company_result = supabase.table("companies").select("id").eq("name", COMPANY_NAME).execute()
-        if not company_result.data:
+        company_id = get_company_id(COMPANY_NAME, supabase)
+        if not company_id:
             return []
         
-        company_id = company_result.data[0]["id"]
-        
-        # Получаем последние транзакции
-        result = supabase.table("transactions")\
-            .select("*")\
-            .eq("company_id", company_id)\
-            .order("operation_date", desc=True)\
-            .limit(limit)\
-            .execute()
-        
-        return result.data if result.data else []
+        # Последние транзакции: одна страница нужных колонок в обратном порядке ключа
+        pages = iter_transaction_pages(company_id, columns=columns, descending=True,
+                                       page_size=limit, prefetch=False, supabase=supabase)
+        return next(pages, [])
         
     except Exception as e:
         print(f"❌ Ошибка при получении транзакций: {e}")
@@ -594,102 +908,230 @@ def validate_record(record: Dict[str, str]) -> bool:
     
     return True
 
-def parse_1c_files_improved(file_paths: List[str]) -> List[Dict[str, str]]:
-    """Улучшенная функция парсинга файлов 1C"""
-    all_records = []
+def prepare_record(record: Dict[str, str]) -> bool:
+    """Нормализует сырые поля документа на месте (False, если документ без даты операции)"""
+    # Пропускаем записи без даты операции
+    if "ДатаОперации" not in record:
+        return False
     
-    for file_path in file_paths:
-        if not os.path.exists(file_path):
-            print(f"Файл не найден: {file_path}")
-            continue
-        
-        try:
-            encoding = detect_encoding(file_path)
-            with open(file_path, "r", encoding=encoding, errors="ignore") as f:
-                text = f.read()
-        except Exception as e:
-            print(f"Ошибка чтения файла {file_path}: {e}")
-            continue
-        
-        # Унификация ключей - улучшенная логика
-        text = re.sub(r"([А-ЯA-Z_]+)=", lambda m: m.group(1).capitalize() + "=", text)
-        
-        # Разделяем на документы - улучшенная логика
-        doc_patterns = [
-            r"СекцияДокумент=.*?\n",
-            r"Документ=.*?\n",
-            r"Операция=.*?\n",
-        ]
-        
-        docs = [text]  # Начинаем с полного текста
-        for pattern in doc_patterns:
-            new_docs = []
-            for doc in docs:
-                parts = re.split(pattern, doc, flags=re.IGNORECASE)
-                new_docs.extend(parts)
-            docs = new_docs
-        
-        for doc in docs:
-            if not doc.strip():
-                continue
-            
-            record = {}
-            
-            # Извлекаем поля с улучшенной логикой
-            for field in FIELDS:
-                value = extract_field_value(doc, field)
-                if value:
-                    record[field] = value
-            
-            # Пропускаем записи без даты операции
-            if "ДатаОперации" not in record:
+    # Нормализуем дату
+    record["ДатаОперации"] = parse_date(record["ДатаОперации"]) or record["ДатаОперации"]
+    
+    # Убираем лишнюю строку "Сумма" при наличии СуммаРасход/СуммаПриход
+    if "Сумма" in record and ("СуммаРасход" in record or "СуммаПриход" in record):
+        record.pop("Сумма", None)
+    return True
+
+def finalize_record(record: Dict[str, str], transaction_info: Dict[str, str]) -> Optional[Dict[str, str]]:
+    """Собирает финальную запись из нормализованного документа и его классификации"""
+    # Пропускаем операции, не связанные с нашими счетами
+    if not transaction_info["ТипТранзакции"]:
+        return None
+    
+    # Валидируем запись
+    if not validate_record(record):
+        return None
+    
+    # Формируем финальную запись
+    return {
+        **{f: record.get(f, "") for f in FIELDS},
+        **transaction_info,
+    }
+
+def build_record(record: Dict[str, str]) -> Optional[Dict[str, str]]:
+    """Нормализует сырые поля документа и дополняет их типом транзакции"""
+    if not prepare_record(record):
+        return None
+    return finalize_record(record, determine_transaction_type(record))
+
+def record_to_transaction(final_record: Optional[Dict[str, str]]) -> Optional[Transaction]:
+    """Переводит финальную запись в Transaction (None, если записи нет или дата не разбирается)"""
+    if not final_record:
+        return None
+    
+    transaction = Transaction.from_record(final_record)
+    # Без разбираемой даты операция все равно не попадет в базу
+    if not transaction.operation_date:
+        return None
+    return transaction
+
+def build_transaction(document: Dict[str, str]) -> Optional[Transaction]:
+    """Строит Transaction из сырых полей документа (None, если документ не подходит)"""
+    return record_to_transaction(build_record(document))
+
+def build_transactions(documents: List[Dict[str, str]]) -> List[Transaction]:
+    """Строит Transaction для пачки документов с одной классификацией по колонкам"""
+    with metrics.stage("prepare"):
+        records = [document for document in documents if prepare_record(document)]
+    metrics.skip("no_operation_date", len(documents) - len(records))
+    
+    with metrics.stage("classify"):
+        classified = classify_records(records)
+    
+    transactions = []
+    not_ours = invalid = unparsed_date = 0
+    with metrics.stage("validate"):
+        transaction_types = classified["ТипТранзакции"]
+        for index, record in enumerate(records):
+            if not transaction_types[index]:
+                not_ours += 1
                 continue
-            
-            # Нормализуем дату
-            record["ДатаОперации"] = parse_date(record["ДатаОперации"]) or record["ДатаОперации"]
-            
-            # Убираем лишнюю строку "Сумма" при наличии СуммаРасход/СуммаПриход
-            if "Сумма" in record and ("СуммаРасход" in record or "СуммаПриход" in record):
-                record.pop("Сумма", None)
-            
-            # Определяем тип транзакции
-            transaction_info = determine_transaction_type(record)
-            
-            # Пропускаем операции, не связанные с нашими счетами
-            if not transaction_info["ТипТранзакции"]:
+            transaction_info = {field: classified[field][index] for field in CLASSIFICATION_FIELDS}
+            final_record = finalize_record(record, transaction_info)
+            if not final_record:
+                invalid += 1
                 continue
-            
-            # Валидируем запись
-            if not validate_record(record):
+            transaction = record_to_transaction(final_record)
+            if not transaction:
+                unparsed_date += 1
                 continue
-            
-            # Формируем финальную запись
-            final_record = {
-                **{f: record.get(f, "") for f in FIELDS},
-                **transaction_info,
-            }
-            
-            all_records.append(final_record)
+            transactions.append(transaction)
+    
+    metrics.skip("not_our_account", not_ours)
+    metrics.skip("invalid", invalid)
+    metrics.skip("unparsed_date", unparsed_date)
+    return transactions
+
+# Размер пачки документов для классификации
+CLASSIFY_BATCH_SIZE = 5000
+
+def iter_file_transactions(file_path: str, batch_size: int = CLASSIFY_BATCH_SIZE) -> Iterator[Transaction]:
+    """Потоково строит Transaction из файла 1C, классифицируя документы пачками"""
+    batch = []
+    for document in metrics.timed_iter("read", iter_1c_documents(file_path)):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            metrics.count("documents_seen", len(batch))
+            yield from build_transactions(batch)
+            batch = []
+    if batch:
+        metrics.count("documents_seen", len(batch))
+        yield from build_transactions(batch)
+
+def iter_file_transactions_safe(file_path: str) -> Iterator[Transaction]:
+    """iter_file_transactions, который сообщает об ошибке чтения файла вместо исключения"""
+    if not os.path.exists(file_path):
+        print(f"Файл не найден: {file_path}")
+        return
+    
+    try:
+        yield from iter_file_transactions(file_path)
+    except Exception as e:
+        print(f"Ошибка чтения файла {file_path}: {e}")
+
+def parse_1c_file(file_path: str) -> List[Transaction]:
+    """Парсит один файл 1C (без удаления дублей между файлами)"""
+    return list(iter_file_transactions_safe(file_path))
+
+def parse_1c_file_with_metrics(file_path: str) -> tuple:
+    """parse_1c_file для пула процессов: вместе с операциями возвращает метрики процесса"""
+    metrics.reset()
+    transactions = parse_1c_file(file_path)
+    return transactions, metrics.to_dict()
+
+def deduplicate_transactions(transactions: List[Transaction]) -> List[Transaction]:
+    """Убирает дубли операций, сохраняя порядок первого появления"""
+    unique_transactions = []
+    seen = set()
+    
+    with metrics.stage("dedup"):
+        for transaction in transactions:
+            key = transaction.dedup_key()
+            if key not in seen:
+                seen.add(key)
+                unique_transactions.append(transaction)
     
-    # Убираем дубли - улучшенная логика
-    unique_records = []
+    metrics.skip("duplicate", len(transactions) - len(unique_transactions))
+    return unique_transactions
+
+def iter_parsed_files(file_paths: List[str], workers: int = 1) -> Iterator[Iterable[Transaction]]:
+    """Выдает операции каждого файла по порядку file_paths
+
+    При workers > 1 файлы разбираются в пуле процессов, иначе потоково в текущем.
+    В пул отправлено не больше workers файлов сверх того, что сейчас читает
+    вызывающий код: следующий файл ставится в работу, только когда забирают
+    очередной результат, поэтому медленный потребитель тормозит и разбор.
+    """
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield iter_file_transactions_safe(file_path)
+        return
+    
+    pool_size = min(workers, len(file_paths))
+    remaining = iter(file_paths)
+    with ProcessPoolExecutor(max_workers=pool_size) as executor:
+        window = deque(executor.submit(parse_1c_file_with_metrics, file_path)
+                       for file_path in islice(remaining, pool_size))
+        while window:
+            transactions, worker_metrics = window.popleft().result()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                window.append(executor.submit(parse_1c_file_with_metrics, next_path))
+            metrics.merge(worker_metrics)
+            yield transactions
+
+def iter_1c_transactions_by_file(file_paths: List[str], workers: int = 1) -> Iterator[tuple]:
+    """Выдает (путь файла, операции файла) по порядку, пропуская дубли между файлами
+
+    Операции файла — ленивый поток; его нужно дочитать до перехода к следующему файлу.
+    """
     seen = set()
+    perf_counter = time.perf_counter
     
-    for rec in all_records:
-        # Создаем более точный ключ для определения дублей
-        key = (
-            rec.get("ДатаОперации", ""),
-            rec.get("СуммаРасход", "") or rec.get("СуммаПриход", ""),
-            rec.get("ТипТранзакции", ""),
-            rec.get("Контрагент", ""),
-            rec.get("НомерДокумента", ""),
-        )
-        
-        if key not in seen:
-            seen.add(key)
-            unique_records.append(rec)
+    def unique(transactions: Iterable[Transaction]) -> Iterator[Transaction]:
+        dedup_seconds, duplicates = 0.0, 0
+        try:
+            for transaction in transactions:
+                started = perf_counter()
+                key = transaction.dedup_key()
+                is_new = key not in seen
+                if is_new:
+                    seen.add(key)
+                dedup_seconds += perf_counter() - started
+                if is_new:
+                    yield transaction
+                else:
+                    duplicates += 1
+        finally:
+            metrics.add_time("dedup", dedup_seconds)
+            metrics.skip("duplicate", duplicates)
     
-    return unique_records
+    for file_path, transactions in zip(file_paths, iter_parsed_files(file_paths, workers)):
+        yield file_path, unique(transactions)
+
+def iter_1c_transactions(file_paths: List[str], workers: int = 1) -> Iterator[Transaction]:
+    """Потоково выдает операции из файлов 1C, пропуская дубли между файлами"""
+    for _, transactions in iter_1c_transactions_by_file(file_paths, workers):
+        yield from transactions
+
+def parse_1c_transactions(file_paths: List[str], workers: int = 1) -> List[Transaction]:
+    """Парсит файлы 1C в список Transaction
+
+    При workers > 1 файлы разбираются в пуле процессов. Результаты
+    склеиваются в порядке file_paths, поэтому не зависят от числа воркеров.
+    """
+    return list(iter_1c_transactions(file_paths, workers=workers))
+
+def parse_1c_files_improved(file_paths: List[str], workers: int = 1) -> List[Dict[str, str]]:
+    """Улучшенная функция парсинга файлов 1C (записи в виде словарей)"""
+    return [transaction.to_record() for transaction in parse_1c_transactions(file_paths, workers=workers)]
+
+def add_workers_argument(parser: argparse.ArgumentParser) -> None:
+    """Добавляет флаг --workers для CLI-скриптов синхронизации"""
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Количество процессов для параллельного парсинга файлов (по умолчанию 1)",
+    )
+
+def add_metrics_argument(parser: argparse.ArgumentParser) -> None:
+    """Добавляет флаг --metrics для выгрузки замеров этапов"""
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="Сохранить замеры этапов и счетчики: *.prom — формат Prometheus, иначе JSON",
+    )
 
 # Обратная совместимость
 def parse_1c_files(file_paths: List[str]) -> List[Dict[str, str]]:
@@ -698,6 +1140,17 @@ def parse_1c_files(file_paths: List[str]) -> List[Dict[str, str]]:
 
 # ✅ Пример использования
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Парсинг и синхронизация выписок 1C")
+    add_workers_argument(arg_parser)
+    arg_parser.add_argument("--ledger", default=DEFAULT_LEDGER_PATH,
+                            help=f"Журнал импорта для пропуска уже синхронизированных файлов (по умолчанию {DEFAULT_LEDGER_PATH})")
+    arg_parser.add_argument("--full", action="store_true",
+                            help="Игнорировать журнал импорта и синхронизировать все файлы заново")
+    add_metrics_argument(arg_parser)
+    arg_parser.add_argument("--pipeline", action="store_true",
+                            help="Писать в базу параллельно с разбором (асинхронный клиент Supabase)")
+    args = arg_parser.parse_args()
+    
     # Проверяем подключение к Supabase
     print("🔌 Проверка подключения к Supabase...")
     if not test_connection():
@@ -705,7 +1158,7 @@ if __name__ == "__main__":
         exit(1)
     
     folder = "."
-    files = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".txt")]
+    files = [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(".txt")]
 
     if not files:
         print("❌ Не найдено файлов .txt для обработки")
@@ -713,39 +1166,34 @@ if __name__ == "__main__":
 
     print(f"📁 Найдено {len(files)} файлов для обработки")
     
-    # Парсим файлы
-    records = parse_1c_files_improved(files)
-    print(f"✅ Найдено {len(records)} операций")
-
-    if records:
-        # Синхронизируем кассовые операции
-        print("💰 Синхронизация кассовых операций...")
-        cash_success = sync_cash_transactions(files)
-        
-        # Синхронизируем все остальные транзакции
-        print("💾 Синхронизация всех транзакций...")
-        all_success = save_transactions_to_database(records)
+    # Парсим файлы один раз и синхронизируем кассовые и банковские операции вместе
+    print("💾 Синхронизация всех транзакций...")
+    ledger = None if args.full else ImportLedger(args.ledger)
+    if args.pipeline:
+        from sync_pipeline import sync_all_transactions_pipelined
+        synced = sync_all_transactions_pipelined(files, workers=args.workers, ledger=ledger)
+    else:
+        synced = sync_all_transactions(files, workers=args.workers, ledger=ledger)
+    metrics.report()
+    write_metrics(args.metrics)
+    if synced:
+        print("✅ Синхронизация завершена!")
         
-        if cash_success or all_success:
-            print("✅ Синхронизация завершена!")
-            
-            # Получаем статистику
-            print("\n📊 Статистика транзакций:")
-            stats = get_transaction_statistics()
-            if "error" not in stats:
-                print(f"💰 Общий доход: {stats['total_income']:.2f}")
-                print(f"💸 Общий расход: {stats['total_expense']:.2f}")
-                print(f"📈 Чистая прибыль: {stats['net_amount']:.2f}")
-                print(f"📋 Количество транзакций: {stats['transaction_count']}")
-            else:
-                print(f"❌ Ошибка получения статистики: {stats['error']}")
-            
-            # Показываем последние транзакции
-            print("\n🔄 Последние 5 транзакций:")
-            recent = get_recent_transactions(5)
-            for i, t in enumerate(recent, 1):
-                print(f"{i}. {t['operation_date']} - {t['transaction_type']} - {t['amount_total']} - {t['counterparty']}")
+        # Получаем статистику
+        print("\n📊 Статистика транзакций:")
+        stats = get_transaction_statistics()
+        if "error" not in stats:
+            print(f"💰 Общий доход: {stats['total_income']:.2f}")
+            print(f"💸 Общий расход: {stats['total_expense']:.2f}")
+            print(f"📈 Чистая прибыль: {stats['net_amount']:.2f}")
+            print(f"📋 Количество транзакций: {stats['transaction_count']}")
         else:
-            print("❌ Ошибка при синхронизации транзакций")
+            print(f"❌ Ошибка получения статистики: {stats['error']}")
+        
+        # Показываем последние транзакции
+        print("\n🔄 Последние 5 транзакций:")
+        recent = get_recent_transactions(5)
+        for i, t in enumerate(recent, 1):
+            print(f"{i}. {t['operation_date']} - {t['transaction_type']} - {t['amount_total']} - {t['counterparty']}")
     else:
-        print("❌ Не найдено валидных операций для сохранения")
+        print("❌ Ошибка при синхронизации транзакций")
@@ -0,0 +1,193 @@
+"""
+Бэкенды извлечения текста PDF (pypdfium2, pdfminer, pdfplumber) с общим интерфейсом и выбором по установленным библиотекам
+"""
+import io
+import os
+import importlib.util
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Iterator, Type
+
+# Порядок выбора по умолчанию. pdfplumber первый: его раскладка по координатам
+# проверена на настоящих выписках банков. pypdfium2 в десятки раз быстрее, но
+# совпадение операций проверено только на синтетических PDF, поэтому он
+# включается явно (параметр backend или PDF_BACKEND=pypdfium2)
+DEFAULT_BACKEND_ORDER = ("pdfplumber", "pypdfium2", "pdfminer")
+# Переменная окружения для выбора бэкенда
+BACKEND_ENV = "PDF_BACKEND"
+# Бэкенд по банку вместо порядка по умолчанию.
+# pypdfium2 отдает текст в порядке потока содержимого PDF: если банк рисует
+# таблицу по колонкам, строки операции разойдутся. Сюда стоит вносить
+# pypdfium2 только для банков, чьи настоящие выписки сверены через
+# benchmark_parsers.py --corpus
+BANK_BACKENDS: Dict[str, str] = {}
+
+# Допуск по вертикали (pt) при сборке строк из фрагментов pdfminer
+LINE_TOLERANCE = 2.0
+
+class PdfDocument(ABC):
+    """Открытый PDF: число страниц и текст страницы по номеру"""
+
+    page_count: int = 0
+
+    @abstractmethod
+    def page_text(self, index: int) -> str:
+        """Текст страницы, строки разделены \\n"""
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+class PdfTextBackend(ABC):
+    """Бэкенд извлечения текста: module — импортируемый модуль библиотеки"""
+
+    name: str = ""
+    module: str = ""
+
+    @classmethod
+    def available(cls) -> bool:
+        return importlib.util.find_spec(cls.module) is not None
+
+    @abstractmethod
+    def open(self, file_bytes: bytes) -> PdfDocument:
+        """Открывает PDF (ошибки библиотеки пробрасываются)"""
+
+class PdfplumberDocument(PdfDocument):
+    def __init__(self, file_bytes: bytes):
+        import pdfplumber
+
+        self.pdf = pdfplumber.open(io.BytesIO(file_bytes))
+        self.page_count = len(self.pdf.pages)
+
+    def page_text(self, index: int) -> str:
+        page = self.pdf.pages[index]
+        text = page.extract_text() or ""
+        # Освобождаем разобранные объекты страницы
+        page.flush_cache()
+        return text
+
+    def close(self) -> None:
+        self.pdf.close()
+
+class PdfplumberBackend(PdfTextBackend):
+    """pdfplumber: раскладка по координатам каждого символа, самый медленный"""
+
+    name = "pdfplumber"
+    module = "pdfplumber"
+
+    def open(self, file_bytes: bytes) -> PdfDocument:
+        return PdfplumberDocument(file_bytes)
+
+class PdfiumDocument(PdfDocument):
+    def __init__(self, file_bytes: bytes):
+        import pypdfium2
+
+        self.pdf = pypdfium2.PdfDocument(file_bytes)
+        self.page_count = len(self.pdf)
+
+    def page_text(self, index: int) -> str:
+        page = self.pdf[index]
+        textpage = page.get_textpage()
+        try:
+            text = textpage.get_text_bounded()
+        finally:
+            textpage.close()
+            page.close()
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+    def close(self) -> None:
+        self.pdf.close()
+
+class PdfiumBackend(PdfTextBackend):
+    """pypdfium2: текстовый слой PDFium в порядке потока содержимого, на порядок быстрее"""
+
+    name = "pypdfium2"
+    module = "pypdfium2"
+
+    def open(self, file_bytes: bytes) -> PdfDocument:
+        return PdfiumDocument(file_bytes)
+
+class PdfminerDocument(PdfDocument):
+    def __init__(self, file_bytes: bytes):
+        from pdfminer.pdfparser import PDFParser
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+        from pdfminer.converter import PDFPageAggregator
+        from pdfminer.layout import LAParams
+
+        self.stream = io.BytesIO(file_bytes)
+        document = PDFDocument(PDFParser(self.stream))
+        self.pages = list(PDFPage.create_pages(document))
+        self.page_count = len(self.pages)
+        # Только группировка символов в строки, без поиска блоков текста
+        self.device = PDFPageAggregator(PDFResourceManager(), laparams=LAParams(boxes_flow=None))
+        self.interpreter = PDFPageInterpreter(self.device.rsrcmgr, self.device)
+
+    def page_text(self, index: int) -> str:
+        from pdfminer.layout import LTTextLine, LTTextBox
+
+        self.interpreter.process_page(self.pages[index])
+        fragments = []
+        for item in self.device.get_result():
+            lines = item if isinstance(item, LTTextBox) else [item]
+            for line in lines:
+                if isinstance(line, LTTextLine):
+                    text = line.get_text().strip()
+                    if text:
+                        fragments.append((-line.y1, line.x0, text))
+
+        # pdfminer режет строку таблицы на блоки по колонкам: собираем ее обратно по y
+        rows: List[List] = []
+        for top, x0, text in sorted(fragments):
+            if rows and top - rows[-1][0] <= LINE_TOLERANCE:
+                rows[-1][1].append((x0, text))
+            else:
+                rows.append([top, [(x0, text)]])
+        return "\n".join(" ".join(text for _, text in sorted(parts)) for _, parts in rows)
+
+    def close(self) -> None:
+        self.stream.close()
+
+class PdfminerBackend(PdfTextBackend):
+    """pdfminer.six напрямую: те же строки, что у pdfplumber, без словарей на каждый символ"""
+
+    name = "pdfminer"
+    module = "pdfminer"
+
+    def open(self, file_bytes: bytes) -> PdfDocument:
+        return PdfminerDocument(file_bytes)
+
+BACKENDS: Dict[str, Type[PdfTextBackend]] = {
+    backend.name: backend for backend in (PdfiumBackend, PdfplumberBackend, PdfminerBackend)
+}
+
+def available_backends() -> List[str]:
+    """Имена установленных бэкендов в порядке выбора по умолчанию"""
+    return [name for name in DEFAULT_BACKEND_ORDER if BACKENDS[name].available()]
+
+def select_backend(name: Optional[str] = None, bank_name: Optional[str] = None) -> str:
+    """Имя бэкенда: явное, из PDF_BACKEND, банка или первое установленное
+
+    Неизвестное или неустановленное имя заменяется выбором по умолчанию.
+    """
+    for candidate in (name, os.environ.get(BACKEND_ENV), BANK_BACKENDS.get(bank_name or "")):
+        if candidate and candidate in BACKENDS and BACKENDS[candidate].available():
+            return candidate
+    available = available_backends()
+    if not available:
+        raise RuntimeError("Не установлена ни одна библиотека для чтения PDF (pdfplumber, pypdfium2, pdfminer.six)")
+    return available[0]
+
+def get_backend(name: Optional[str] = None, bank_name: Optional[str] = None) -> PdfTextBackend:
+    return BACKENDS[select_backend(name, bank_name)]()
+
+def iter_page_texts(file_bytes: bytes, backend: Optional[str] = None) -> Iterator[str]:
+    """Текст страниц PDF по порядку выбранным бэкендом"""
+    with get_backend(backend).open(file_bytes) as document:
+        for index in range(document.page_count):
+            yield document.page_text(index)
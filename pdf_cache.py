@@ -0,0 +1,157 @@
+"""
+Дисковый кэш извлеченного текста PDF и результатов парсинга, адресуемый по SHA-256 содержимого
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+from typing import List, Dict, Optional
+
+# Каталог и лимит кэша по умолчанию
+DEFAULT_CACHE_DIR = ".pdf_cache"
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+PAGES_FILE = "pages.json"
+TEMPLATES_DIR = "templates"
+
+class PdfCache:
+    """Двухуровневый кэш: текст страниц по хешу PDF и операции по хешу + банк + версия парсера
+
+    Кроме того, хранит шаблоны колонок таблиц банков (см. pdf_tables.py).
+
+    Смена банка перезапускает только дешевый разбор текста, а не извлечение.
+    Размер ограничен max_bytes, при переполнении удаляются давно не читанные файлы.
+    Размер кэша сканируется с диска один раз, дальше учитывается в памяти
+    при каждой записи; полный обход каталога — только при переполнении.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(file_bytes: bytes) -> str:
+        """Ключ кэша — SHA-256 байтов PDF"""
+        return hashlib.sha256(file_bytes).hexdigest()
+
+    def _path(self, key: str, name: str) -> str:
+        return os.path.join(self.directory, key[:2], key, name)
+
+    @staticmethod
+    def _pages_name(backend: Optional[str]) -> str:
+        # Текст разных бэкендов может отличаться пробелами, поэтому хранится раздельно
+        return f"pages-{backend}.json" if backend else PAGES_FILE
+
+    @staticmethod
+    def _operations_name(bank_name: str, parser_version: str, backend: Optional[str] = None) -> str:
+        safe_bank = re.sub(r"[^\w-]", "_", bank_name or "Other")
+        suffix = f"-{backend}" if backend else ""
+        return f"operations-{safe_bank}{suffix}-v{parser_version}.json"
+
+    def _read(self, path: str):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Отмечаем использование для LRU
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, path: str, data) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        new_size = os.path.getsize(tmp_path)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan()[1]
+            else:
+                self._total_bytes += new_size - old_size
+            overflow = self._total_bytes > self.max_bytes
+        if overflow:
+            self.evict()
+
+    def get_pages(self, key: str, backend: Optional[str] = None) -> Optional[List[str]]:
+        """Текст страниц PDF, извлеченный бэкендом backend, или None"""
+        return self._read(self._path(key, self._pages_name(backend)))
+
+    def put_pages(self, key: str, pages: List[str], backend: Optional[str] = None) -> None:
+        self._write(self._path(key, self._pages_name(backend)), pages)
+
+    def get_operations(self, key: str, bank_name: str, parser_version: str,
+                       backend: Optional[str] = None) -> Optional[List[Dict[str, str]]]:
+        """Разобранные операции для банка, версии парсера и бэкенда или None"""
+        return self._read(self._path(key, self._operations_name(bank_name, parser_version, backend)))
+
+    def put_operations(self, key: str, bank_name: str, parser_version: str, operations: List[Dict[str, str]],
+                       backend: Optional[str] = None) -> None:
+        self._write(self._path(key, self._operations_name(bank_name, parser_version, backend)), operations)
+
+    def _template_path(self, bank_name: str, fingerprint: str, parser_version: str) -> str:
+        safe_bank = re.sub(r"[^\w-]", "_", bank_name or "Other")
+        return os.path.join(self.directory, TEMPLATES_DIR, f"{safe_bank}-{fingerprint}-v{parser_version}.json")
+
+    def get_template(self, bank_name: str, fingerprint: str, parser_version: str) -> Optional[Dict]:
+        """Шаблон колонок таблицы банка для отпечатка раскладки или None"""
+        return self._read(self._template_path(bank_name, fingerprint, parser_version))
+
+    def put_template(self, bank_name: str, fingerprint: str, parser_version: str, template: Dict) -> None:
+        self._write(self._template_path(bank_name, fingerprint, parser_version), template)
+
+    def _scan(self) -> tuple:
+        """Файлы кэша [(mtime, размер, путь)] и их общий размер"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self) -> None:
+        """Удаляет самые давно использованные файлы, пока кэш больше max_bytes
+
+        Размер пересчитывается по диску: так учитываются и записи других процессов.
+        """
+        with self._lock:
+            entries, total = self._scan()
+            self._total_bytes = total
+        if total <= self.max_bytes:
+            return
+
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            # Убираем опустевший каталог ключа
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+            if total <= self.max_bytes:
+                break
+
+        with self._lock:
+            self._total_bytes = total
@@ -1,7 +1,7 @@
-import io
 import re
 import json
-import pdfplumber
+
+from pdf_backends import iter_page_texts
 
 def parse_text_content(text: str, bank_name: str):
     """Парсит текстовое содержимое и возвращает список операций."""
@@ -160,13 +160,16 @@ def parse_text_content(text: str, bank_name: str):
     return results
 
 def parse_pdf(file_bytes: bytes, bank_name: str):
-    """Парсит PDF-файл из памяти (байты) и возвращает список операций."""
+    """Парсит PDF-файл из памяти (байты) и возвращает список операций.
+
+    bank_name="auto" — банк определяется по первой странице.
+    """
     try:
-        text = ""
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text() or ""
-                text += page_text + "\n"
+        pages = iter_page_texts(file_bytes)
+        if bank_name == "auto":
+            from pdf_parser_improved import resolve_bank_from_pages
+            bank_name, _, pages = resolve_bank_from_pages(pages)
+        text = "".join(page_text + "\n" for page_text in pages)
     except Exception as e:
         print(json.dumps({"error": f"Ошибка при открытии PDF: {str(e)}"}, ensure_ascii=False))
         return []
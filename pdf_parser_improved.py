@@ -1,33 +1,154 @@
-import io
 import re
+import itertools
 import json
-import pdfplumber
-from typing import List, Dict, Optional
-from abc import ABC, abstractmethod
+from typing import List, Dict, Optional, Pattern, Iterable, Iterator
+from abc import ABC
+
+from pdf_cache import PdfCache, DEFAULT_CACHE_DIR
+from pdf_backends import BACKENDS, get_backend, select_backend
+
+# Версия логики разбора: меняйте при изменении парсеров, чтобы кэш операций сбросился
+PARSER_VERSION = "2"
+
+DATE_PATTERN = r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}"
+ISO_DATE_PATTERN = r"\d{4}[./-]\d{1,2}[./-]\d{1,2}"
+
+# Реестр скомпилированных паттернов. Парсеры банков расширяют его через
+# атрибут класса patterns = {**PATTERNS, ...}
+PATTERNS: Dict[str, Pattern] = {
+    # Начало новой операции (проверяется через match в начале строки)
+    "operation_start": re.compile(DATE_PATTERN),
+    # Дата: сначала ДД.ММ.ГГГГ по всему тексту, затем ГГГГ-ММ-ДД (порядок важен:
+    # в "2025-10-10" первый паттерн находит "25-10-10")
+    "date": re.compile(DATE_PATTERN),
+    "date_iso": re.compile(ISO_DATE_PATTERN),
+    # ИИН, номера документов и даты, которые не являются суммами.
+    # Вырезаются последовательно: от порядка зависит, какие суммы останутся
+    "amount_exclude_iin": re.compile(r"\d{12}"),
+    "amount_exclude_doc": re.compile(r"\d{4,6}"),
+    "amount_exclude_date": re.compile(DATE_PATTERN),
+    # Суммы в формате с копейками
+    "amount": re.compile(r"\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})?"),
+    # Номер документа: "док 123", "документ 123", "№ 123", "#123"
+    "doc_number": re.compile(r"(?:док|документ|№|#)\s*(\d+)", re.IGNORECASE),
+    "whitespace": re.compile(r"\s+"),
+    "spaces": re.compile(r"[ \t]{2,}"),
+    "counterparty_cleanup": re.compile(r'[^\w\sА-Яа-я«»""\'-]'),
+}
+
+# Паттерны контрагентов проверяются по порядку приоритета
+COUNTERPARTY_PATTERNS: List[Pattern] = [
+    # Юридические лица
+    re.compile(r"(?:ИП|ТОО|ООО|АО|АООТ|ТДО|КХ|ПК|КП|СПК|ЧП|ФЛ)\s+[A-Za-zА-Яа-я0-9 .\"'«»-]{3,50}"),
+    # Физические лица (ФИО)
+    re.compile(r"[А-Яа-я]{2,}\s+[А-Яа-я]{2,}(?:\s+[А-Яа-я]{2,})?"),
+    # Названия компаний без формы
+    re.compile(r"[A-Za-zА-Яа-я]{3,}\s+[A-Za-zА-Яа-я]{3,}(?:\s+[A-Za-zА-Яа-я]{3,})*"),
+]
+
+DEBIT_WORDS = ("дебет", "расход", "списание", "оплата", "платеж")
+CREDIT_WORDS = ("кредит", "доход", "поступление", "зачисление")
 
 class BankParser(ABC):
     """Базовый класс для парсинга банковских выписок"""
     
-    @abstractmethod
+    patterns: Dict[str, Pattern] = PATTERNS
+    counterparty_patterns: List[Pattern] = COUNTERPARTY_PATTERNS
+    bank_label: str = "Unknown"
+    
     def parse(self, text: str) -> List[Dict[str, str]]:
         """Парсит текст выписки и возвращает список операций"""
-        pass
+        return list(self.parse_lines(text.splitlines()))
+    
+    def parse_lines(self, lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+        """Потоково разбирает строки выписки (например, по мере извлечения страниц)"""
+        for operation in self.group_operations(lines):
+            record = self.parse_operation(operation)
+            if record:
+                yield record
+    
+    def prepare_line(self, line: str) -> str:
+        """Нормализует строку перед группировкой"""
+        return line.strip()
+    
+    def group_operations(self, lines: Iterable[str]) -> Iterator[List[str]]:
+        """Группирует строки в операции: новая операция начинается с is_operation_start"""
+        current_operation = []
+        
+        for line in lines:
+            line = self.prepare_line(line)
+            if not line:
+                continue
+            if self.is_operation_start(line):
+                if current_operation:
+                    yield current_operation
+                current_operation = [line]
+            else:
+                current_operation.append(line)
+        
+        if current_operation:
+            yield current_operation
+    
+    def determine_type(self, full_text: str, debit: str, credit: str) -> tuple[str, str]:
+        """Определяет тип операции и сумму по дебету и кредиту"""
+        if debit and not credit:
+            return "Расход", debit
+        elif credit and not debit:
+            return "Доход", credit
+        elif debit and credit:
+            debit_val = float(debit) if debit else 0
+            credit_val = float(credit) if credit else 0
+            if debit_val > credit_val:
+                return "Расход", debit
+            else:
+                return "Доход", credit
+        return "", ""
+    
+    def parse_operation(self, operation: List[str]) -> Optional[Dict[str, str]]:
+        """Разбирает строки одной операции в запись"""
+        full_text = " ".join(operation)
+        
+        date = self.extract_date(full_text)
+        if not date:
+            return None
+        
+        doc_number = self.extract_document_number(full_text)
+        debit, credit = self.extract_amounts(full_text)
+        counterparty = self.extract_counterparty(full_text)
+        
+        operation_type, amount = self.determine_type(full_text, debit, credit)
+        if not operation_type:
+            return None  # Пропускаем операции без сумм
+        
+        # Формируем комментарий
+        comment = self.build_comment(full_text, [date, doc_number, counterparty, debit, credit])
+        
+        return {
+            "ДатаОперации": date,
+            "НомерДокумента": doc_number,
+            "Дебет": debit,
+            "Кредит": credit,
+            "Тип": operation_type,
+            "Контрагент": counterparty,
+            "Сумма": amount,
+            "Комментарий": comment,
+            "Банк": self.bank_label
+        }
     
     def clean_text(self, text: str) -> str:
         """Очищает текст от лишних символов"""
         text = text.replace("\xa0", " ")
-        text = re.sub(r"[ \t]{2,}", " ", text)
+        text = self.patterns["spaces"].sub(" ", text)
         return text.strip()
     
+    def is_operation_start(self, line: str) -> bool:
+        """Проверяет, начинается ли со строки новая операция"""
+        return self.patterns["operation_start"].match(line) is not None
+    
     def extract_date(self, text: str) -> str:
         """Извлекает дату из текста"""
-        date_patterns = [
-            r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}",
-            r"\d{4}[./-]\d{1,2}[./-]\d{1,2}",
-        ]
-        
-        for pattern in date_patterns:
-            match = re.search(pattern, text)
+        for key in ("date", "date_iso"):
+            match = self.patterns[key].search(text)
             if match:
                 return match.group(0)
         return ""
@@ -35,19 +156,12 @@ class BankParser(ABC):
     def extract_amounts(self, text: str) -> tuple[str, str]:
         """Извлекает суммы дебета и кредита"""
         # Исключаем номера документов, даты, ИИН из поиска сумм
-        exclude_patterns = [
-            r"\d{12}",  # ИИН
-            r"\d{4,6}",  # Номера документов
-            r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}",  # Даты
-        ]
-        
-        text_for_amounts = text
-        for pattern in exclude_patterns:
-            text_for_amounts = re.sub(pattern, "", text_for_amounts)
+        text_for_amounts = self.patterns["amount_exclude_iin"].sub("", text)
+        text_for_amounts = self.patterns["amount_exclude_doc"].sub("", text_for_amounts)
+        text_for_amounts = self.patterns["amount_exclude_date"].sub("", text_for_amounts)
         
         # Ищем суммы в формате с копейками
-        amount_pattern = r"\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})?"
-        amounts = re.findall(amount_pattern, text_for_amounts)
+        amounts = self.patterns["amount"].findall(text_for_amounts)
         
         # Фильтруем суммы по разумным пределам
         valid_amounts = []
@@ -68,9 +182,10 @@ class BankParser(ABC):
         elif len(valid_amounts) == 1:
             amount = valid_amounts[0].replace(" ", "").replace(",", ".")
             # Определяем по контексту
-            if any(word in text.lower() for word in ["дебет", "расход", "списание", "оплата", "платеж"]):
+            lower_text = text.lower()
+            if any(word in lower_text for word in DEBIT_WORDS):
                 return amount, ""
-            elif any(word in text.lower() for word in ["кредит", "доход", "поступление", "зачисление"]):
+            elif any(word in lower_text for word in CREDIT_WORDS):
                 return "", amount
             else:
                 return amount, ""  # По умолчанию считаем расходом
@@ -79,22 +194,12 @@ class BankParser(ABC):
     
     def extract_counterparty(self, text: str) -> str:
         """Извлекает название контрагента"""
-        # Улучшенные паттерны для поиска контрагентов
-        counterparty_patterns = [
-            # Юридические лица
-            r"(?:ИП|ТОО|ООО|АО|АООТ|ТДО|КХ|ПК|КП|СПК|ЧП|ФЛ)\s+[A-Za-zА-Яа-я0-9 .\"'«»-]{3,50}",
-            # Физические лица (ФИО)
-            r"[А-Яа-я]{2,}\s+[А-Яа-я]{2,}(?:\s+[А-Яа-я]{2,})?",
-            # Названия компаний без формы
-            r"[A-Za-zА-Яа-я]{3,}\s+[A-Za-zА-Яа-я]{3,}(?:\s+[A-Za-zА-Яа-я]{3,})*",
-        ]
-        
-        for pattern in counterparty_patterns:
-            matches = re.findall(pattern, text)
-            for match in matches:
+        cleanup = self.patterns["counterparty_cleanup"]
+        for pattern in self.counterparty_patterns:
+            for match in pattern.findall(text):
                 counterparty = match.strip()
                 # Очищаем от лишних символов
-                counterparty = re.sub(r'[^\w\sА-Яа-я«»""\'-]', '', counterparty)
+                counterparty = cleanup.sub('', counterparty)
                 if len(counterparty) > 3 and len(counterparty) < 100:
                     return counterparty
         
@@ -102,338 +207,62 @@ class BankParser(ABC):
     
     def extract_document_number(self, text: str) -> str:
         """Извлекает номер документа"""
-        doc_patterns = [
-            r"(?:док|документ|№|#)\s*(\d+)",
-            r"№\s*(\d+)",
-            r"док\s*(\d+)",
-        ]
-        
-        for pattern in doc_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                return match.group(1)
-        
-        return ""
+        match = self.patterns["doc_number"].search(text)
+        return match.group(1) if match else ""
+    
+    def build_comment(self, full_text: str, fields: List[str]) -> str:
+        """Формирует комментарий: текст операции без уже извлеченных полей"""
+        comment = full_text
+        for field in fields:
+            if field:
+                comment = comment.replace(field, "").strip()
+        return self.patterns["whitespace"].sub(' ', comment).strip()
 
 class KaspiParser(BankParser):
     """Парсер для Kaspi Bank"""
     
-    def parse(self, text: str) -> List[Dict[str, str]]:
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
-        if not lines:
-            return []
-        
-        operations = []
-        current_operation = []
-        
-        for line in lines:
-            # Kaspi Bank часто использует дату как разделитель операций
-            if re.match(r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}", line):
-                if current_operation:
-                    operations.append(current_operation)
-                current_operation = [line]
-            else:
-                current_operation.append(line)
-        
-        if current_operation:
-            operations.append(current_operation)
-        
-        results = []
-        for op in operations:
-            full_text = " ".join(op)
-            
-            date = self.extract_date(full_text)
-            if not date:
-                continue
-            
-            doc_number = self.extract_document_number(full_text)
-            debit, credit = self.extract_amounts(full_text)
-            counterparty = self.extract_counterparty(full_text)
-            
-            # Определяем тип операции
-            operation_type = ""
-            amount = ""
-            
-            if debit and not credit:
-                operation_type = "Расход"
-                amount = debit
-            elif credit and not debit:
-                operation_type = "Доход"
-                amount = credit
-            elif debit and credit:
-                debit_val = float(debit) if debit else 0
-                credit_val = float(credit) if credit else 0
-                if debit_val > credit_val:
-                    operation_type = "Расход"
-                    amount = debit
-                else:
-                    operation_type = "Доход"
-                    amount = credit
-            else:
-                continue  # Пропускаем операции без сумм
-            
-            # Формируем комментарий
-            comment = full_text
-            for field in [date, doc_number, counterparty, debit, credit]:
-                if field:
-                    comment = comment.replace(field, "").strip()
-            comment = re.sub(r'\s+', ' ', comment).strip()
-            
-            results.append({
-                "ДатаОперации": date,
-                "НомерДокумента": doc_number,
-                "Дебет": debit,
-                "Кредит": credit,
-                "Тип": operation_type,
-                "Контрагент": counterparty,
-                "Сумма": amount,
-                "Комментарий": comment,
-                "Банк": "Kaspi"
-            })
-        
-        return results
+    # Kaspi Bank часто использует дату как разделитель операций
+    bank_label = "Kaspi"
 
 class ForteParser(BankParser):
     """Парсер для Forte Bank"""
     
-    def parse(self, text: str) -> List[Dict[str, str]]:
-        # Forte Bank часто использует табличный формат
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
-        if not lines:
-            return []
-        
-        operations = []
-        current_operation = []
-        
-        for line in lines:
-            # Forte Bank использует более сложные разделители
-            if re.match(r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}", line) or "операция" in line.lower():
-                if current_operation:
-                    operations.append(current_operation)
-                current_operation = [line]
-            else:
-                current_operation.append(line)
-        
-        if current_operation:
-            operations.append(current_operation)
-        
-        results = []
-        for op in operations:
-            full_text = " ".join(op)
-            
-            date = self.extract_date(full_text)
-            if not date:
-                continue
-            
-            doc_number = self.extract_document_number(full_text)
-            debit, credit = self.extract_amounts(full_text)
-            counterparty = self.extract_counterparty(full_text)
-            
-            # Forte Bank часто указывает направление операции явно
-            operation_type = ""
-            amount = ""
-            
-            if "дебет" in full_text.lower() or "списание" in full_text.lower():
-                operation_type = "Расход"
-                amount = debit or credit
-            elif "кредит" in full_text.lower() or "зачисление" in full_text.lower():
-                operation_type = "Доход"
-                amount = credit or debit
-            elif debit and not credit:
-                operation_type = "Расход"
-                amount = debit
-            elif credit and not debit:
-                operation_type = "Доход"
-                amount = credit
-            elif debit and credit:
-                debit_val = float(debit) if debit else 0
-                credit_val = float(credit) if credit else 0
-                if debit_val > credit_val:
-                    operation_type = "Расход"
-                    amount = debit
-                else:
-                    operation_type = "Доход"
-                    amount = credit
-            else:
-                continue
-            
-            # Формируем комментарий
-            comment = full_text
-            for field in [date, doc_number, counterparty, debit, credit]:
-                if field:
-                    comment = comment.replace(field, "").strip()
-            comment = re.sub(r'\s+', ' ', comment).strip()
-            
-            results.append({
-                "ДатаОперации": date,
-                "НомерДокумента": doc_number,
-                "Дебет": debit,
-                "Кредит": credit,
-                "Тип": operation_type,
-                "Контрагент": counterparty,
-                "Сумма": amount,
-                "Комментарий": comment,
-                "Банк": "Forte"
-            })
-        
-        return results
+    bank_label = "Forte"
+    
+    # Forte Bank использует более сложные разделители: дата или слово "операция"
+    patterns = {
+        **PATTERNS,
+        "operation_start": re.compile(rf"{DATE_PATTERN}|.*операция", re.IGNORECASE),
+    }
+    
+    def determine_type(self, full_text: str, debit: str, credit: str) -> tuple[str, str]:
+        # Forte Bank часто указывает направление операции явно
+        lower_text = full_text.lower()
+        if "дебет" in lower_text or "списание" in lower_text:
+            return "Расход", debit or credit
+        elif "кредит" in lower_text or "зачисление" in lower_text:
+            return "Доход", credit or debit
+        return super().determine_type(full_text, debit, credit)
 
 class HalykParser(BankParser):
     """Парсер для Halyk Bank"""
     
-    def parse(self, text: str) -> List[Dict[str, str]]:
-        # Halyk Bank часто использует табличный формат с фиксированными колонками
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
-        if not lines:
-            return []
-        
-        operations = []
-        current_operation = []
-        
-        for line in lines:
-            # Halyk Bank использует дату или номер операции как разделитель
-            if (re.match(r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}", line) or 
-                re.match(r"\d{6,}", line)):  # Номер операции
-                if current_operation:
-                    operations.append(current_operation)
-                current_operation = [line]
-            else:
-                current_operation.append(line)
-        
-        if current_operation:
-            operations.append(current_operation)
-        
-        results = []
-        for op in operations:
-            full_text = " ".join(op)
-            
-            date = self.extract_date(full_text)
-            if not date:
-                continue
-            
-            doc_number = self.extract_document_number(full_text)
-            debit, credit = self.extract_amounts(full_text)
-            counterparty = self.extract_counterparty(full_text)
-            
-            # Halyk Bank часто указывает операции в табличном формате
-            operation_type = ""
-            amount = ""
-            
-            if debit and not credit:
-                operation_type = "Расход"
-                amount = debit
-            elif credit and not debit:
-                operation_type = "Доход"
-                amount = credit
-            elif debit and credit:
-                debit_val = float(debit) if debit else 0
-                credit_val = float(credit) if credit else 0
-                if debit_val > credit_val:
-                    operation_type = "Расход"
-                    amount = debit
-                else:
-                    operation_type = "Доход"
-                    amount = credit
-            else:
-                continue
-            
-            # Формируем комментарий
-            comment = full_text
-            for field in [date, doc_number, counterparty, debit, credit]:
-                if field:
-                    comment = comment.replace(field, "").strip()
-            comment = re.sub(r'\s+', ' ', comment).strip()
-            
-            results.append({
-                "ДатаОперации": date,
-                "НомерДокумента": doc_number,
-                "Дебет": debit,
-                "Кредит": credit,
-                "Тип": operation_type,
-                "Контрагент": counterparty,
-                "Сумма": amount,
-                "Комментарий": comment,
-                "Банк": "Halyk"
-            })
-        
-        return results
+    bank_label = "Halyk"
+    
+    # Halyk Bank использует дату или номер операции как разделитель
+    patterns = {
+        **PATTERNS,
+        "operation_start": re.compile(rf"{DATE_PATTERN}|\d{{6,}}"),
+    }
 
 class UniversalParser(BankParser):
     """Универсальный парсер для неизвестных банков"""
     
-    def parse(self, text: str) -> List[Dict[str, str]]:
-        # Используем базовую логику из оригинального парсера
-        text = self.clean_text(text)
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
-        
-        if not lines:
-            return []
-        
-        operations = []
-        current_operation = []
-        
-        for line in lines:
-            if re.match(r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}", line):
-                if current_operation:
-                    operations.append(current_operation)
-                current_operation = []
-            current_operation.append(line)
-        
-        if current_operation:
-            operations.append(current_operation)
-        
-        results = []
-        for op in operations:
-            full_text = " ".join(op)
-            
-            date = self.extract_date(full_text)
-            if not date:
-                continue
-            
-            doc_number = self.extract_document_number(full_text)
-            debit, credit = self.extract_amounts(full_text)
-            counterparty = self.extract_counterparty(full_text)
-            
-            operation_type = ""
-            amount = ""
-            
-            if debit and not credit:
-                operation_type = "Расход"
-                amount = debit
-            elif credit and not debit:
-                operation_type = "Доход"
-                amount = credit
-            elif debit and credit:
-                debit_val = float(debit) if debit else 0
-                credit_val = float(credit) if credit else 0
-                if debit_val > credit_val:
-                    operation_type = "Расход"
-                    amount = debit
-                else:
-                    operation_type = "Доход"
-                    amount = credit
-            else:
-                continue
-            
-            comment = full_text
-            for field in [date, doc_number, counterparty, debit, credit]:
-                if field:
-                    comment = comment.replace(field, "").strip()
-            comment = re.sub(r'\s+', ' ', comment).strip()
-            
-            results.append({
-                "ДатаОперации": date,
-                "НомерДокумента": doc_number,
-                "Дебет": debit,
-                "Кредит": credit,
-                "Тип": operation_type,
-                "Контрагент": counterparty,
-                "Сумма": amount,
-                "Комментарий": comment,
-                "Банк": "Unknown"
-            })
-        
-        return results
+    bank_label = "Unknown"
+    
+    def prepare_line(self, line: str) -> str:
+        # Используем базовую очистку из оригинального парсера
+        return self.clean_text(line)
 
 def get_parser(bank_name: str) -> BankParser:
     """Возвращает соответствующий парсер для банка"""
@@ -448,25 +277,398 @@ def get_parser(bank_name: str) -> BankParser:
     
     return parsers.get(bank_name, UniversalParser())
 
-def parse_pdf_improved(file_bytes: bytes, bank_name: str) -> List[Dict[str, str]]:
-    """Улучшенная функция парсинга PDF"""
+# Режимы извлечения: текст страниц и разбор регулярками или ячейки таблицы по колонкам
+LAYOUT_TEXT = "text"
+LAYOUT_TABLE = "table"
+
+# Значение bank_name, при котором банк определяется по первой странице
+AUTO_BANK = "auto"
+# Банк для выписок, где ни один признак не набрал достаточной уверенности
+FALLBACK_BANK = "Other"
+# Минимальная уверенность, с которой принимается догадка detect_bank
+DETECTION_MIN_CONFIDENCE = 0.5
+# Сколько строк первой страницы просматривается (реквизиты банка в шапке)
+DETECTION_MAX_LINES = 40
+
+# Максимальный размер тела запроса к серверу парсинга
+MAX_BODY_BYTES = 50 * 1024 * 1024
+
+# Признаки банков с весами. Код банка — цифры 5–7 ИИК (KZxx722... — Kaspi),
+# БИК и название надежнее, чем упоминание банка в назначении платежа
+BANK_FINGERPRINTS: Dict[str, List[tuple]] = {
+    "Kaspi": [
+        (re.compile(r"\bKZ\d{2}722", re.IGNORECASE), 3.0),
+        (re.compile(r"CASPKZKA", re.IGNORECASE), 3.0),
+        (re.compile(r"kaspi|каспи", re.IGNORECASE), 2.0),
+    ],
+    "Halyk": [
+        (re.compile(r"\bKZ\d{2}601", re.IGNORECASE), 3.0),
+        (re.compile(r"HSBKKZKX", re.IGNORECASE), 3.0),
+        (re.compile(r"halyk|халык|народный банк", re.IGNORECASE), 2.0),
+    ],
+    "Forte": [
+        (re.compile(r"\bKZ\d{2}965", re.IGNORECASE), 3.0),
+        (re.compile(r"IRTYKZKA", re.IGNORECASE), 3.0),
+        (re.compile(r"forte|форте", re.IGNORECASE), 2.0),
+    ],
+    "Jusan": [
+        (re.compile(r"\bKZ\d{2}998", re.IGNORECASE), 3.0),
+        (re.compile(r"TSESKZKA", re.IGNORECASE), 3.0),
+        (re.compile(r"jusan|жусан|цеснабанк", re.IGNORECASE), 2.0),
+    ],
+    "Onlinebank": [
+        (re.compile(r"onlinebank|онлайнбанк", re.IGNORECASE), 2.0),
+    ],
+}
+
+def detect_bank(text: str, max_lines: int = DETECTION_MAX_LINES) -> List[tuple]:
+    """Ранжированные догадки о банке по первым строкам выписки
+
+    Возвращает [(банк, уверенность 0..1), ...] по убыванию уверенности;
+    пустой список, если не найдено ни одного признака. Каждый признак
+    учитывается один раз, уверенность — доля веса банка в общем весе.
+    """
+    head = "\n".join(text.splitlines()[:max_lines])
+    scores = {}
+    for bank, fingerprints in BANK_FINGERPRINTS.items():
+        score = sum(weight for pattern, weight in fingerprints if pattern.search(head))
+        if score:
+            scores[bank] = score
+
+    total = sum(scores.values())
+    ranked = sorted(scores.items(), key=lambda item: -item[1])
+    return [(bank, round(score / total, 3)) for bank, score in ranked]
+
+def resolve_bank(text: str, min_confidence: float = DETECTION_MIN_CONFIDENCE) -> tuple:
+    """Лучшая догадка detect_bank или FALLBACK_BANK при низкой уверенности"""
+    ranked = detect_bank(text)
+    if ranked and ranked[0][1] >= min_confidence:
+        return ranked[0]
+    return FALLBACK_BANK, ranked[0][1] if ranked else 0.0
+
+def resolve_bank_from_pages(pages: Iterable[str]) -> tuple:
+    """Определяет банк по первой странице, не теряя ее для разбора
+
+    Возвращает (банк, уверенность, итератор всех страниц начиная с первой).
+    """
+    pages = iter(pages)
+    first_page = next(pages, None)
+    if first_page is None:
+        return FALLBACK_BANK, 0.0, iter(())
+    bank, confidence = resolve_bank(first_page)
+    return bank, confidence, itertools.chain([first_page], pages)
+
+def detect_bank_from_pdf(file_bytes: bytes, backend: Optional[str] = None) -> List[tuple]:
+    """detect_bank по тексту первой страницы PDF (остальные страницы не извлекаются)"""
+    with get_backend(backend).open(file_bytes) as document:
+        if not document.page_count:
+            return []
+        return detect_bank(document.page_text(0))
+
+# PDF, открытый в процессе пула (см. _init_page_worker)
+_worker_document = None
+
+def _init_page_worker(file_bytes: bytes, backend: str) -> None:
+    """Открывает PDF один раз на процесс пула"""
+    global _worker_document
+    _worker_document = get_backend(backend).open(file_bytes)
+
+def _extract_page_range(page_range: tuple) -> List[str]:
+    """Извлекает текст диапазона страниц в процессе пула"""
+    start, stop = page_range
+    return [_worker_document.page_text(i) for i in range(start, stop)]
+
+def iter_pdf_pages(file_bytes: bytes, workers: int = 1, pages_per_task: int = 4,
+                   backend: Optional[str] = None) -> Iterator[str]:
+    """Выдает текст страниц PDF по порядку по мере извлечения
+
+    backend — имя из pdf_backends.BACKENDS (None — из PDF_BACKEND, иначе первый
+    установленный в порядке DEFAULT_BACKEND_ORDER: pdfplumber, pypdfium2, pdfminer).
+    При workers > 1 страницы извлекаются параллельно в пуле процессов,
+    порядок страниц сохраняется. Ошибки библиотеки PDF пробрасываются.
+    """
+    backend = select_backend(backend)
+    with get_backend(backend).open(file_bytes) as document:
+        page_count = document.page_count
+        if workers <= 1 or page_count <= pages_per_task:
+            for index in range(page_count):
+                yield document.page_text(index)
+            return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    ranges = [(i, min(i + pages_per_task, page_count)) for i in range(0, page_count, pages_per_task)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)),
+                             initializer=_init_page_worker, initargs=(file_bytes, backend)) as executor:
+        for page_texts in executor.map(_extract_page_range, ranges):
+            yield from page_texts
+
+def iter_pdf_lines(file_bytes: bytes, workers: int = 1, backend: Optional[str] = None) -> Iterator[str]:
+    """Выдает строки PDF постранично"""
+    for page_text in iter_pdf_pages(file_bytes, workers=workers, backend=backend):
+        yield from page_text.splitlines()
+
+def extract_pdf_text(file_bytes: bytes, workers: int = 1, backend: Optional[str] = None) -> str:
+    """Извлекает текст всех страниц PDF (ошибки библиотеки PDF пробрасываются)"""
+    return "".join(page_text + "\n" for page_text in iter_pdf_pages(file_bytes, workers=workers, backend=backend))
+
+def iter_pdf_operations(file_bytes: bytes, bank_name: str, workers: int = 1,
+                        backend: Optional[str] = None) -> Iterator[Dict[str, str]]:
+    """Потоково выдает операции по мере извлечения страниц PDF
+
+    Ошибки открытия PDF пробрасываются; пустой PDF дает пустой поток.
+    """
+    pages = iter_pdf_pages(file_bytes, workers=workers, backend=select_backend(backend, bank_name))
+    if bank_name == AUTO_BANK:
+        bank_name, _, pages = resolve_bank_from_pages(pages)
+    parser = get_parser(bank_name)
+    yield from parser.parse_lines(line for page_text in pages for line in page_text.splitlines())
+
+def parse_pdf_improved(file_bytes: bytes, bank_name: str, workers: int = 1,
+                       cache: Optional[PdfCache] = None, layout: str = LAYOUT_TEXT,
+                       backend: Optional[str] = None) -> List[Dict[str, str]]:
+    """Улучшенная функция парсинга PDF (bank_name="auto" — определить банк по первой странице)"""
+    result = parse_pdf_request(file_bytes, bank_name, workers=workers, cache=cache, layout=layout, backend=backend)
+    if "error" in result:
+        print(json.dumps(result, ensure_ascii=False))
+        return []
+    return result["transactions"]
+
+def parse_pdf_table_request(file_bytes: bytes, bank_name: str, cache: Optional[PdfCache] = None) -> Optional[Dict]:
+    """Разбор по колонкам таблицы (pdf_tables.py); None — таблица не найдена или pdfplumber не установлен"""
+    try:
+        from pdf_tables import parse_pdf_table, TABLE_PARSER_VERSION
+    except ImportError as e:
+        # Координаты символов дает только pdfplumber — без него разбираем текст
+        print(f"⚠️ Разбор по колонкам недоступен ({e}), выполняется текстовый разбор")
+        return None
+
+    key = None
+    # Операции кэшируются отдельно от текстового режима
+    cache_bank = f"{bank_name}-{LAYOUT_TABLE}"
+    if cache is not None and bank_name != AUTO_BANK:
+        key = cache.key(file_bytes)
+        cached_operations = cache.get_operations(key, cache_bank, TABLE_PARSER_VERSION)
+        if cached_operations is not None:
+            return {"transactions": cached_operations}
+
     try:
-        text = ""
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text() or ""
-                text += page_text + "\n"
+        result = parse_pdf_table(file_bytes, bank_name, cache=cache)
     except Exception as e:
-        print(json.dumps({"error": f"Ошибка при открытии PDF: {str(e)}"}, ensure_ascii=False))
-        return []
+        return {"error": f"Ошибка при открытии PDF: {str(e)}"}
 
-    if not text.strip():
-        print(json.dumps({"error": "PDF файл не содержит текста или не может быть обработан"}, ensure_ascii=False))
-        return []
+    if result is not None and key is not None:
+        cache.put_operations(key, cache_bank, TABLE_PARSER_VERSION, result["transactions"])
+    return result
+
+def parse_pdf_request(file_bytes: bytes, bank_name: str, workers: int = 1,
+                      cache: Optional[PdfCache] = None, layout: str = LAYOUT_TEXT,
+                      backend: Optional[str] = None) -> Dict:
+    """Разбирает PDF: результат или ошибка в виде словаря
+
+    Текст извлекает backend (см. pdf_backends.select_backend).
+    С кэшем повторная загрузка того же PDF отдается без извлечения, а при
+    смене банка заново выполняется только разбор сохраненного текста.
+    При bank_name="auto" банк определяется по первой странице (без
+    повторного извлечения), а в ответ добавляются bank и bank_confidence.
+    При layout="table" суммы и даты читаются из колонок таблицы; если
+    заголовок таблицы не найден, выполняется обычный текстовый разбор.
+    """
+    if layout == LAYOUT_TABLE:
+        result = parse_pdf_table_request(file_bytes, bank_name, cache=cache)
+        if result is not None:
+            return result
+
+    try:
+        backend = select_backend(backend, bank_name)
+    except RuntimeError as e:
+        return {"error": str(e)}
+
+    key = None
+    cached_pages = None
+    detected = None
+    pages = None
+    if cache is not None:
+        key = cache.key(file_bytes)
+        if bank_name == AUTO_BANK:
+            # Банк определяем по сохраненному тексту, операции ищем уже по нему
+            cached_pages = cache.get_pages(key, backend)
+            if cached_pages is not None:
+                bank_name, confidence, pages = resolve_bank_from_pages(cached_pages)
+                detected = {"bank": bank_name, "bank_confidence": confidence}
+        if bank_name != AUTO_BANK:
+            cached_operations = cache.get_operations(key, bank_name, PARSER_VERSION, backend)
+            if cached_operations is not None:
+                return {"transactions": cached_operations, **(detected or {})}
+            if cached_pages is None:
+                cached_pages = cache.get_pages(key, backend)
+
+    if pages is None:
+        pages = iter(cached_pages) if cached_pages is not None else iter_pdf_pages(file_bytes, workers=workers, backend=backend)
+        if bank_name == AUTO_BANK:
+            try:
+                bank_name, confidence, pages = resolve_bank_from_pages(pages)
+            except Exception as e:
+                return {"error": f"Ошибка при открытии PDF: {str(e)}"}
+            detected = {"bank": bank_name, "bank_confidence": confidence}
+
+    has_text = False
+    read_error = None
+    extracted_pages = []
+
+    def tracked_lines():
+        nonlocal has_text, read_error
+        try:
+            for page_text in pages:
+                if cache is not None and cached_pages is None:
+                    extracted_pages.append(page_text)
+                for line in page_text.splitlines():
+                    if line.strip():
+                        has_text = True
+                    yield line
+        except Exception as e:
+            # Ошибки чтения PDF отделяем от ошибок разбора операций
+            read_error = e
 
     # Используем банк-специфичный парсер
     parser = get_parser(bank_name)
-    return parser.parse(text)
+    transactions = list(parser.parse_lines(tracked_lines()))
+
+    if read_error is not None:
+        return {"error": f"Ошибка при открытии PDF: {str(read_error)}"}
+
+    if cache is not None and cached_pages is None:
+        cache.put_pages(key, extracted_pages, backend)
+
+    if not has_text:
+        return {"error": "PDF файл не содержит текста или не может быть обработан"}
+
+    if cache is not None:
+        cache.put_operations(key, bank_name, PARSER_VERSION, transactions, backend)
+
+    return {"transactions": transactions, **(detected or {})}
+
+# Кэши процесса по каталогу: учтенный в памяти размер переживает запросы (см. PdfCache)
+_worker_caches: Dict[str, PdfCache] = {}
+
+def get_worker_cache(cache_dir: str) -> PdfCache:
+    """Один PdfCache на каталог в процессе"""
+    cache = _worker_caches.get(cache_dir)
+    if cache is None:
+        cache = _worker_caches.setdefault(cache_dir, PdfCache(cache_dir))
+    return cache
+
+def parse_pdf_cached_request(file_bytes: bytes, bank_name: str, cache_dir: Optional[str],
+                             layout: str = LAYOUT_TEXT, backend: Optional[str] = None) -> Dict:
+    """parse_pdf_request для процесса пула: кэш процесса по пути каталога"""
+    cache = get_worker_cache(cache_dir) if cache_dir else None
+    return parse_pdf_request(file_bytes, bank_name, cache=cache, layout=layout, backend=backend)
+
+def _warm_up_worker(backend: Optional[str] = None) -> str:
+    """Заставляет процесс пула загрузить модуль и библиотеку PDF заранее"""
+    import importlib
+
+    backend = select_backend(backend)
+    importlib.import_module(BACKENDS[backend].module)
+    return backend
+
+def create_server(host: str = "127.0.0.1", port: int = 8765, workers: int = 2, timeout: float = 120.0,
+                  cache_dir: Optional[str] = DEFAULT_CACHE_DIR, backend: Optional[str] = None,
+                  max_body_bytes: int = MAX_BODY_BYTES):
+    """HTTP-сервер парсинга PDF с прогретым пулом процессов (см. serve)
+
+    Пул доступен как server.executor и закрывается вызывающим кодом
+    после server.server_close(). port=0 — свободный порт.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+    from concurrent.futures import ProcessPoolExecutor
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    # Прогреваем процессы, чтобы первый запрос не платил за импорт
+    backend_name = list(executor.map(_warm_up_worker, [backend] * workers))[0]
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status: int, payload) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == "/health":
+                self.send_json(200, {"status": "ok", "workers": workers, "backend": backend_name})
+            else:
+                self.send_json(404, {"error": "Не найдено"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/parse":
+                self.send_json(404, {"error": "Не найдено"})
+                return
+
+            query = parse_qs(url.query)
+            bank_name = query.get("bank", [AUTO_BANK])[0]
+            layout = query.get("layout", [LAYOUT_TEXT])[0]
+            request_backend = query.get("backend", [backend])[0]
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.close_connection = True
+                self.send_json(400, {"error": "Некорректный заголовок Content-Length"})
+                return
+            if length == 0:
+                self.send_json(400, {"error": "Пустое тело запроса"})
+                return
+            if length > max_body_bytes:
+                # Тело не читаем: соединение закрывается вместе с непрочитанными данными
+                self.close_connection = True
+                self.send_json(413, {"error": f"Файл больше {max_body_bytes} байт"})
+                return
+
+            file_bytes = self.rfile.read(length)
+            try:
+                result = executor.submit(parse_pdf_cached_request, file_bytes, bank_name, cache_dir, layout,
+                                         request_backend).result(timeout=timeout)
+            except Exception as e:
+                self.send_json(500, {"error": f"Ошибка обработки PDF: {str(e)}"})
+                return
+
+            self.send_json(422 if "error" in result else 200, result)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.executor = executor
+    return server
+
+def serve(host: str = "127.0.0.1", port: int = 8765, workers: int = 2, timeout: float = 120.0,
+          cache_dir: Optional[str] = DEFAULT_CACHE_DIR, backend: Optional[str] = None,
+          max_body_bytes: int = MAX_BODY_BYTES) -> None:
+    """Долгоживущий HTTP-сервер парсинга PDF с пулом процессов
+
+    POST /parse?bank=Kaspi с байтами PDF в теле запроса возвращает
+    {"transactions": [...]} или {"error": "..."}; без bank или с bank=auto
+    банк определяется по первой странице, layout=table включает разбор по
+    колонкам таблицы, backend=pdfplumber задает бэкенд извлечения текста
+    (по умолчанию — backend сервера). GET /health — проверка.
+    Тело больше max_body_bytes отклоняется с кодом 413, без его чтения.
+    Результаты кэшируются в cache_dir (None — без кэша).
+    """
+    server = create_server(host, port, workers, timeout, cache_dir, backend, max_body_bytes)
+    print(json.dumps({"status": "listening", "host": host, "port": server.server_address[1], "workers": workers}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown()
 
 # Обратная совместимость
 def parse_pdf(file_bytes: bytes, bank_name: str):
@@ -486,9 +688,30 @@ if __name__ == "__main__":
     import sys
     import json
 
-    if len(sys.argv) >= 3:
+    if "--serve" in sys.argv:
+        import argparse
+
+        arg_parser = argparse.ArgumentParser(description="HTTP-сервер парсинга PDF выписок")
+        arg_parser.add_argument("--serve", action="store_true")
+        arg_parser.add_argument("--host", default="127.0.0.1")
+        arg_parser.add_argument("--port", type=int, default=8765)
+        arg_parser.add_argument("--workers", type=int, default=2, help="Количество процессов парсинга")
+        arg_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Каталог кэша результатов")
+        arg_parser.add_argument("--no-cache", action="store_true", help="Отключить кэш результатов")
+        arg_parser.add_argument("--max-body-mb", type=int, default=MAX_BODY_BYTES // (1024 * 1024),
+                                help="Максимальный размер PDF в запросе, МБ")
+        arg_parser.add_argument("--backend", choices=sorted(BACKENDS),
+                                help="Бэкенд извлечения текста (по умолчанию PDF_BACKEND или pdfplumber, "
+                                     "если установлен)")
+        args = arg_parser.parse_args()
+
+        serve(args.host, args.port, args.workers, cache_dir=None if args.no_cache else args.cache_dir,
+              backend=args.backend, max_body_bytes=args.max_body_mb * 1024 * 1024)
+
+    elif len(sys.argv) >= 3:
         pdf_path = sys.argv[1]
         bank_name = sys.argv[2]
+        layout = sys.argv[3] if len(sys.argv) >= 4 else LAYOUT_TEXT
         
         if not os.path.exists(pdf_path):
             print(json.dumps({"error": "Файл не найден"}, ensure_ascii=False))
@@ -497,12 +720,12 @@ if __name__ == "__main__":
         with open(pdf_path, "rb") as f:
             pdf_bytes = f.read()
 
-        data = parse_pdf_improved(pdf_bytes, bank_name)
+        data = parse_pdf_improved(pdf_bytes, bank_name, layout=layout)
         print(json.dumps(data, ensure_ascii=False, indent=2))
         
     else:
         pdf_path = input("📄 Укажи путь к PDF-файлу: ").strip()
-        bank_name = input("🏦 Укажи банк (Kaspi/Forte/Halyk/Jusan/Other): ").strip()
+        bank_name = input("🏦 Укажи банк (Kaspi/Forte/Halyk/Jusan/Other, пусто — auto): ").strip() or AUTO_BANK
 
         if not os.path.exists(pdf_path):
             print("❌ Файл не найден.")
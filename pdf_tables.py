@@ -0,0 +1,355 @@
+"""
+Извлечение операций из PDF по геометрии таблицы: границы колонок банка и чтение ячеек по координатам
+"""
+import re
+import io
+import bisect
+import hashlib
+from dataclasses import dataclass, asdict
+from typing import List, Dict, Optional, Iterable, Iterator, Tuple
+
+import pdfplumber
+
+from pdf_cache import PdfCache
+from pdf_parser_improved import (
+    DATE_PATTERN,
+    ISO_DATE_PATTERN,
+    DEBIT_WORDS,
+    AUTO_BANK,
+    get_parser,
+    resolve_bank,
+)
+
+# Версия шаблонов и разбора таблиц: меняйте при изменении логики, чтобы кэш сбросился
+TABLE_PARSER_VERSION = "1"
+
+# Разрыв между символами (в долях кегля), после которого начинается новый фрагмент строки.
+# Обычный пробел около 0.25–0.3 кегля, колонки разделены заметно шире
+SEGMENT_GAP = 0.8
+# Допуск по вертикали (pt), в пределах которого символы считаются одной строкой
+LINE_TOLERANCE = 2.0
+# Заголовок таблицы ищется в верхней части страницы (доля высоты)
+HEADER_SEARCH_AREA = 0.5
+
+# Ключевые слова заголовков колонок. Порядок важен: "Дата операции" — это дата,
+# а не описание, поэтому описание проверяется последним
+TABLE_HEADER_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "date": ("дата",),
+    "document": ("№", "номер", "док"),
+    "debit": ("расход", "дебет", "списание"),
+    "credit": ("приход", "кредит", "поступление", "зачисление"),
+    "amount": ("сумма",),
+    "description": ("контрагент", "описание", "назначение", "детали", "операция", "получатель", "корреспондент"),
+}
+
+# Колонка, которая есть в таблице, но в операцию не попадает
+OTHER_COLUMN = "other"
+
+# Дополнительные заголовки банков (дополняют общие)
+BANK_TABLE_HEADERS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "Kaspi": {"description": ("детали",)},
+    "Halyk": {"description": ("описание операции",)},
+    "Forte": {"document": ("референс",)},
+}
+
+DATE_CELL_RE = re.compile(rf"{DATE_PATTERN}|{ISO_DATE_PATTERN}")
+AMOUNT_CELL_RE = re.compile(r"[-+−]?\d[\d\s\xa0.,]*")
+AMOUNT_JUNK_RE = re.compile(r"[\s\xa0]")
+DIGITS_RE = re.compile(r"\d+")
+# Номер страницы в колонтитуле: "Страница 2 из 5", "стр. 2", "2 / 5", "Page 2 of 5"
+PAGE_FOOTER_RE = re.compile(
+    r"^\s*(?:стр(?:аница)?\.?\s*\d+(?:\s*(?:из|/)\s*\d+)?|page\s+\d+(?:\s+of\s+\d+)?|\d+\s*(?:из|/)\s*\d+)\s*$",
+    re.IGNORECASE,
+)
+
+@dataclass(frozen=True)
+class TableTemplate:
+    """Колонки таблицы выписки: имена слева направо и x-границы между ними"""
+    bank: str
+    fingerprint: str
+    columns: Tuple[str, ...]
+    boundaries: Tuple[float, ...]
+    header: Tuple[str, ...]
+
+    def column_at(self, x: float) -> str:
+        return self.columns[bisect.bisect(self.boundaries, x)]
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "TableTemplate":
+        return cls(
+            bank=data["bank"],
+            fingerprint=data["fingerprint"],
+            columns=tuple(data["columns"]),
+            boundaries=tuple(data["boundaries"]),
+            header=tuple(data["header"]),
+        )
+
+# Шаблоны, уже выученные в этом процессе: (банк, отпечаток) -> шаблон
+_template_cache: Dict[Tuple[str, str], TableTemplate] = {}
+
+def header_keywords(bank_name: str) -> Dict[str, Tuple[str, ...]]:
+    keywords = dict(TABLE_HEADER_KEYWORDS)
+    for column, extra in BANK_TABLE_HEADERS.get(bank_name, {}).items():
+        keywords[column] = extra + keywords[column]
+    return keywords
+
+def group_lines(chars: Iterable[Dict]) -> List[List[Dict]]:
+    """Группирует символы страницы в строки сверху вниз"""
+    lines: List[List[Dict]] = []
+    tops: List[float] = []
+    for char in sorted(chars, key=lambda char: char["top"]):
+        if char["text"].isspace():
+            continue
+        if tops and char["top"] - tops[-1] <= LINE_TOLERANCE:
+            lines[-1].append(char)
+        else:
+            lines.append([char])
+            tops.append(char["top"])
+    return lines
+
+def line_segments(line: List[Dict]) -> List[Tuple[float, float, str]]:
+    """Делит строку на фрагменты (x0, x1, текст) по широким разрывам между символами"""
+    segments = []
+    x0 = x1 = None
+    parts: List[str] = []
+    for char in sorted(line, key=lambda char: char["x0"]):
+        if x1 is not None:
+            gap = char["x0"] - x1
+            if gap > char["size"] * SEGMENT_GAP:
+                segments.append((x0, x1, "".join(parts)))
+                x0, parts = None, []
+            elif gap > char["size"] * 0.15:
+                parts.append(" ")
+        if x0 is None:
+            x0 = char["x0"]
+        parts.append(char["text"])
+        x1 = char["x1"]
+    if parts:
+        segments.append((x0, x1, "".join(parts)))
+    return segments
+
+def classify_header(text: str, keywords: Dict[str, Tuple[str, ...]]) -> Optional[str]:
+    lower_text = text.lower()
+    for column, words in keywords.items():
+        if any(word in lower_text for word in words):
+            return column
+    return None
+
+def find_header(lines: List[List[Dict]], bank_name: str, page_height: float) -> Optional[Tuple[int, List]]:
+    """Ищет строку заголовка таблицы: (номер строки, [(колонка, x0, x1, текст), ...])"""
+    keywords = header_keywords(bank_name)
+    for index, line in enumerate(lines):
+        if line[0]["top"] > page_height * HEADER_SEARCH_AREA:
+            break
+        cells = []
+        for x0, x1, text in line_segments(line):
+            column = classify_header(text, keywords)
+            # Незнакомые и повторные колонки (остаток, валюта) читаются, но не разбираются
+            if column is None or any(cell[0] == column for cell in cells):
+                column = OTHER_COLUMN
+            cells.append((column, x0, x1, text))
+        names = {cell[0] for cell in cells} - {OTHER_COLUMN}
+        if len(names) >= 3 and "date" in names and names & {"amount", "debit", "credit"}:
+            return index, cells
+    return None
+
+def layout_fingerprint(bank_name: str, page_width: float, header: Iterable[str]) -> str:
+    """Отпечаток раскладки: банк, ширина страницы и тексты заголовков (без координат,
+    чтобы поправленные вручную границы переживали мелкие сдвиги)"""
+    signature = "|".join([bank_name, str(round(page_width))] + [text.lower() for text in header])
+    return hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16]
+
+def learn_template(bank_name: str, fingerprint: str, cells: List) -> TableTemplate:
+    """Границы колонок — середины промежутков между соседними заголовками"""
+    cells = sorted(cells, key=lambda cell: cell[1])
+    boundaries = tuple(round((left[2] + right[1]) / 2, 1) for left, right in zip(cells, cells[1:]))
+    return TableTemplate(
+        bank=bank_name,
+        fingerprint=fingerprint,
+        columns=tuple(cell[0] for cell in cells),
+        boundaries=boundaries,
+        header=tuple(cell[3] for cell in cells),
+    )
+
+def get_template(bank_name: str, fingerprint: str, cells: List, cache: Optional[PdfCache] = None) -> TableTemplate:
+    """Шаблон из памяти процесса, с диска (кэш PDF) или выученный по заголовку"""
+    cache_key = (bank_name, fingerprint)
+    template = _template_cache.get(cache_key)
+    if template is not None:
+        return template
+
+    data = cache.get_template(bank_name, fingerprint, TABLE_PARSER_VERSION) if cache is not None else None
+    if data is not None:
+        template = TableTemplate.from_dict(data)
+    else:
+        template = learn_template(bank_name, fingerprint, cells)
+        if cache is not None:
+            cache.put_template(bank_name, fingerprint, TABLE_PARSER_VERSION, template.to_dict())
+
+    _template_cache[cache_key] = template
+    return template
+
+def parse_table_amount(text: str) -> Tuple[str, bool]:
+    """Нормализует сумму ячейки: ("1234.56", отрицательная) или ("", False)
+
+    Понимает "1 234,56", "1,234.56", "1.234,56", "-500 ₸".
+    """
+    match = AMOUNT_CELL_RE.search(text)
+    if not match:
+        return "", False
+    raw = AMOUNT_JUNK_RE.sub("", match.group(0))
+    negative = raw[0] in "-−"
+    raw = raw.lstrip("+-−").rstrip(".,")
+    if "," in raw and "." in raw:
+        decimal = "," if raw.rfind(",") > raw.rfind(".") else "."
+    elif "," in raw:
+        decimal = "," if len(raw) - raw.rfind(",") - 1 in (1, 2) else ""
+    elif "." in raw:
+        decimal = "." if len(raw) - raw.rfind(".") - 1 in (1, 2) else ""
+    else:
+        decimal = ""
+    if decimal:
+        whole, _, fraction = raw.rpartition(decimal)
+    else:
+        whole, fraction = raw, ""
+    whole = DIGITS_RE.findall(whole)
+    if not whole:
+        return "", False
+    value = f"{''.join(whole)}.{(fraction + '00')[:2]}"
+    if float(value) == 0:
+        return "", False
+    return value, negative
+
+def iter_table_rows(lines: Iterable[List[Dict]], template: TableTemplate) -> Iterator[Dict[str, str]]:
+    """Раскладывает строки страницы по колонкам шаблона"""
+    header_text = " ".join(template.header)
+    for line in lines:
+        cells: Dict[str, str] = {}
+        for x0, x1, text in line_segments(line):
+            column = template.column_at((x0 + x1) / 2)
+            cells[column] = f"{cells[column]} {text}" if column in cells else text
+        text = " ".join(cells.values())
+        # Повтор заголовка на следующих страницах и номер страницы в колонтитуле
+        if text == header_text or PAGE_FOOTER_RE.match(text):
+            continue
+        yield cells
+
+class TableOperationBuilder:
+    """Собирает операции из строк таблицы: строка с датой открывает операцию,
+    строки только с описанием продолжают ее, прочие строки закрывают"""
+
+    def __init__(self, bank_name: str):
+        self.parser = get_parser(bank_name)
+        self.current: Optional[Dict[str, str]] = None
+
+    def feed(self, cells: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """Принимает строку таблицы, возвращает завершенную операцию, если она готова"""
+        date_match = DATE_CELL_RE.search(cells.get("date", ""))
+        if date_match:
+            finished = self.flush()
+            # Контрагент ищется в первой строке описания, продолжения — назначение платежа
+            self.current = dict(cells, date=date_match.group(0), counterparty=cells.get("description", ""))
+            return finished
+
+        if self.current is not None and cells and set(cells) <= {"description", "document"}:
+            for column, text in cells.items():
+                previous = self.current.get(column)
+                self.current[column] = f"{previous} {text}" if previous else text
+            return None
+
+        # Шапка страницы, итоги или колонтитул — операция закончилась
+        return self.flush()
+
+    def flush(self) -> Optional[Dict[str, str]]:
+        cells, self.current = self.current, None
+        return self.build(cells) if cells else None
+
+    def build(self, cells: Dict[str, str]) -> Optional[Dict[str, str]]:
+        parser = self.parser
+        description = cells.get("description", "")
+        debit, _ = parse_table_amount(cells.get("debit", ""))
+        credit, _ = parse_table_amount(cells.get("credit", ""))
+
+        if not debit and not credit:
+            amount, negative = parse_table_amount(cells.get("amount", ""))
+            if not amount:
+                return None
+            lower_text = description.lower()
+            if negative or (cells.get("amount", "").lstrip()[:1] != "+" and any(word in lower_text for word in DEBIT_WORDS)):
+                debit = amount
+            else:
+                credit = amount
+
+        operation_type, amount = parser.determine_type(description, debit, credit)
+        if not operation_type:
+            return None
+
+        document_digits = DIGITS_RE.search(cells.get("document", ""))
+        doc_number = document_digits.group(0) if document_digits else parser.extract_document_number(description)
+        counterparty = parser.extract_counterparty(cells["counterparty"])
+
+        return {
+            "ДатаОперации": cells["date"],
+            "НомерДокумента": doc_number,
+            "Дебет": debit,
+            "Кредит": credit,
+            "Тип": operation_type,
+            "Контрагент": counterparty,
+            "Сумма": amount,
+            "Комментарий": parser.build_comment(description, [counterparty]),
+            "Банк": parser.bank_label,
+        }
+
+def lines_text(lines: List[List[Dict]]) -> str:
+    return "\n".join(" ".join(text for _, _, text in line_segments(line)) for line in lines)
+
+def parse_pdf_table(file_bytes: bytes, bank_name: str, cache: Optional[PdfCache] = None) -> Optional[Dict]:
+    """Разбирает PDF по колонкам таблицы
+
+    Возвращает {"transactions": [...], ...} или None, если заголовок таблицы
+    не найден (тогда нужен текстовый разбор). Текст страниц не собирается:
+    ячейки читаются прямо из символов страницы по x-границам шаблона.
+    """
+    detected = None
+    template = None
+    builder = None
+    transactions: List[Dict[str, str]] = []
+
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        for page_number, page in enumerate(pdf.pages):
+            lines = group_lines(page.chars)
+            if page_number == 0 and bank_name == AUTO_BANK:
+                bank_name, confidence = resolve_bank(lines_text(lines))
+                detected = {"bank": bank_name, "bank_confidence": confidence}
+
+            header = find_header(lines, bank_name, page.height)
+            if header is not None:
+                index, cells = header
+                # Таблица начинается под заголовком: шапку страницы не читаем
+                lines = lines[index + 1:]
+                if template is None:
+                    fingerprint = layout_fingerprint(bank_name, page.width, [cell[3] for cell in sorted(cells, key=lambda cell: cell[1])])
+                    template = get_template(bank_name, fingerprint, cells, cache)
+                    builder = TableOperationBuilder(bank_name)
+            elif template is None:
+                # Таблица должна начаться на первой странице
+                return None
+
+            # Незакрытая операция переходит на следующую страницу: описание
+            # может продолжаться под повтором заголовка таблицы
+            for cells in iter_table_rows(lines, template):
+                operation = builder.feed(cells)
+                if operation:
+                    transactions.append(operation)
+            page.flush_cache()
+
+    if builder is None:
+        # В PDF нет страниц: заголовка таблицы нет
+        return None
+    operation = builder.flush()
+    if operation:
+        transactions.append(operation)
+    return {"transactions": transactions, **(detected or {})}
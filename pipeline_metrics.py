@@ -0,0 +1,162 @@
+"""
+Замеры этапов и счетчики конвейера синхронизации с выгрузкой в JSON или формат Prometheus
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+# Префикс метрик в формате Prometheus
+PROMETHEUS_PREFIX = "statement_sync"
+
+class PipelineMetrics:
+    """Накопитель времени по этапам и счетчиков документов
+
+    Этапы: read (чтение, декодирование, разбиение и извлечение полей —
+    один потоковый проход), prepare, classify, validate, dedup, categorize,
+    build_rows (строки БД и transaction_hash), ledger, upsert.
+    Счетчики: documents_seen, written, failed и skipped по причинам.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages: Dict[str, Dict[str, float]] = {}
+            self.counters: Dict[str, int] = {}
+            self.skipped: Dict[str, int] = {}
+            self.started_at = time.time()
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1) -> None:
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += calls
+
+    @contextmanager
+    def stage(self, name: str):
+        """Замеряет время блока: with metrics.stage("upsert"): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def timed_iter(self, name: str, iterable: Iterable) -> Iterator:
+        """Замеряет время, проведенное внутри генератора (без времени потребителя)"""
+        iterator = iter(iterable)
+        perf_counter = time.perf_counter
+        spent, calls = 0.0, 0
+        try:
+            while True:
+                started = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    spent += perf_counter() - started
+                    break
+                spent += perf_counter() - started
+                calls += 1
+                yield item
+        finally:
+            self.add_time(name, spent, calls)
+
+    def count(self, name: str, value: int = 1) -> None:
+        if value:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def skip(self, reason: str, value: int = 1) -> None:
+        if value:
+            with self._lock:
+                self.skipped[reason] = self.skipped.get(reason, 0) + value
+
+    def merge(self, data: Dict) -> None:
+        """Добавляет метрики, собранные в другом процессе (результат to_dict)"""
+        for stage, entry in data.get("stages", {}).items():
+            self.add_time(stage, entry["seconds"], entry["calls"])
+        for name, value in data.get("counters", {}).items():
+            self.count(name, value)
+        for reason, value in data.get("skipped", {}).items():
+            self.skip(reason, value)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "elapsed_seconds": round(time.time() - self.started_at, 6),
+                "stages": {name: {"seconds": round(entry["seconds"], 6), "calls": entry["calls"]}
+                           for name, entry in self.stages.items()},
+                "counters": dict(self.counters),
+                "skipped": dict(self.skipped),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    def to_prometheus(self) -> str:
+        """Текст в формате Prometheus (для node_exporter textfile collector)"""
+        data = self.to_dict()
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {prefix}_stage_seconds Время этапа конвейера в секундах",
+            f"# TYPE {prefix}_stage_seconds gauge",
+        ]
+        lines += [f'{prefix}_stage_seconds{{stage="{name}"}} {entry["seconds"]}'
+                  for name, entry in sorted(data["stages"].items())]
+        lines += [
+            f"# HELP {prefix}_stage_calls Количество вызовов этапа",
+            f"# TYPE {prefix}_stage_calls gauge",
+        ]
+        lines += [f'{prefix}_stage_calls{{stage="{name}"}} {entry["calls"]}'
+                  for name, entry in sorted(data["stages"].items())]
+        lines += [f"# TYPE {prefix}_{name} gauge\n{prefix}_{name} {value}"
+                  for name, value in sorted(data["counters"].items())]
+        lines += [
+            f"# HELP {prefix}_skipped Пропущенные документы и строки по причинам",
+            f"# TYPE {prefix}_skipped gauge",
+        ]
+        lines += [f'{prefix}_skipped{{reason="{reason}"}} {value}'
+                  for reason, value in sorted(data["skipped"].items())]
+        lines.append(f"{prefix}_elapsed_seconds {data['elapsed_seconds']}")
+        lines.append(f"{prefix}_last_run_timestamp_seconds {data['started_at']:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Атомарно пишет метрики: .prom — формат Prometheus, иначе JSON"""
+        content = self.to_prometheus() if path.endswith(".prom") else self.to_json() + "\n"
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def report(self) -> None:
+        """Печатает сводку по этапам и счетчикам"""
+        data = self.to_dict()
+        print("⏱️ Этапы конвейера:")
+        for name, entry in sorted(data["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            print(f"   {name:<12} {entry['seconds']:>9.3f} с  ({entry['calls']} вызовов)")
+        for name, value in sorted(data["counters"].items()):
+            print(f"   📄 {name}: {value}")
+        for reason, value in sorted(data["skipped"].items()):
+            print(f"   ⏭️ пропущено ({reason}): {value}")
+
+# Метрики текущего процесса
+metrics = PipelineMetrics()
+
+def get_metrics() -> PipelineMetrics:
+    return metrics
+
+def write_metrics(path: Optional[str]) -> None:
+    """Пишет метрики текущего процесса, если путь задан"""
+    if not path:
+        return
+    try:
+        metrics.write(path)
+        print(f"📈 Метрики сохранены в {path}")
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить метрики в {path}: {e}")
@@ -0,0 +1,144 @@
+"""
+Пакетная запись в Supabase: разбиение на чанки, ограниченная параллельность и повторы
+"""
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Any
+
+from postgrest.types import ReturnMethod
+
+from supabase_config import get_supabase_client
+
+# Настройки по умолчанию для пакетной записи
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+
+@dataclass
+class ChunkResult:
+    """Результат отправки одного чанка"""
+    index: int
+    rows: int
+    ok: bool = False
+    attempts: int = 0
+    error: Optional[str] = None
+    data: List[Dict[str, Any]] = field(default_factory=list)
+
+@dataclass
+class BulkWriteResult:
+    """Сводный результат пакетной записи"""
+    chunks: List[ChunkResult] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return all(chunk.ok for chunk in self.chunks)
+
+    @property
+    def written(self) -> int:
+        return sum(chunk.rows for chunk in self.chunks if chunk.ok)
+
+    @property
+    def failed(self) -> List[ChunkResult]:
+        return [chunk for chunk in self.chunks if not chunk.ok]
+
+    @property
+    def data(self) -> List[Dict[str, Any]]:
+        rows = []
+        for chunk in self.chunks:
+            rows.extend(chunk.data)
+        return rows
+
+def split_into_chunks(rows: List[Dict[str, Any]], chunk_size: int) -> List[List[Dict[str, Any]]]:
+    """Делит строки на чанки фиксированного размера"""
+    if chunk_size <= 0:
+        raise ValueError("chunk_size должен быть больше нуля")
+    return [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+
+def bulk_upsert(
+    table: str,
+    rows: List[Dict[str, Any]],
+    on_conflict: str = "",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    returning: bool = False,
+    client=None,
+) -> BulkWriteResult:
+    """Делает upsert строк чанками с ограниченным числом одновременных запросов
+
+    Упавшие чанки повторяются до retries раз с экспоненциальной паузой.
+    Без returning=True сервер не возвращает записанные строки обратно.
+    """
+    supabase = client or get_supabase_client()
+    returning_method = ReturnMethod.representation if returning else ReturnMethod.minimal
+    chunks = split_into_chunks(rows, chunk_size)
+
+    def send(index: int, chunk: List[Dict[str, Any]]) -> ChunkResult:
+        result = ChunkResult(index=index, rows=len(chunk))
+        for attempt in range(1, retries + 2):
+            result.attempts = attempt
+            try:
+                response = (
+                    supabase
+                    .table(table)
+                    .upsert(chunk, on_conflict=on_conflict, returning=returning_method)
+                    .execute()
+                )
+                result.ok = True
+                result.error = None
+                result.data = (getattr(response, "data", None) or []) if returning else []
+                return result
+            except Exception as e:
+                result.error = str(e)
+                if attempt <= retries:
+                    time.sleep(backoff * (2 ** (attempt - 1)))
+        return result
+
+    summary = BulkWriteResult()
+    if not chunks:
+        return summary
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(chunks)))) as executor:
+        futures = [executor.submit(send, index, chunk) for index, chunk in enumerate(chunks)]
+        summary.chunks = [future.result() for future in futures]
+
+    return summary
+
+async def async_upsert_chunk(
+    client,
+    table: str,
+    index: int,
+    chunk: List[Dict[str, Any]],
+    on_conflict: str = "",
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+) -> ChunkResult:
+    """Асинхронный upsert одного чанка с повторами (для конвейерной синхронизации)"""
+    result = ChunkResult(index=index, rows=len(chunk))
+    for attempt in range(1, retries + 2):
+        result.attempts = attempt
+        try:
+            await (
+                client
+                .table(table)
+                .upsert(chunk, on_conflict=on_conflict, returning=ReturnMethod.minimal)
+                .execute()
+            )
+            result.ok = True
+            result.error = None
+            return result
+        except Exception as e:
+            result.error = str(e)
+            if attempt <= retries:
+                await asyncio.sleep(backoff * (2 ** (attempt - 1)))
+    return result
+
+def report_bulk_result(result: BulkWriteResult, label: str = "транзакций") -> None:
+    """Печатает итоги пакетной записи по чанкам"""
+    for chunk in result.failed:
+        print(f"❌ Чанк {chunk.index} ({chunk.rows} строк) не записан после {chunk.attempts} попыток: {chunk.error}")
+    print(f"📦 Записано {result.written} {label} в {len(result.chunks) - len(result.failed)}/{len(result.chunks)} чанках")
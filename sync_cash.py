@@ -5,9 +5,16 @@
 
 import os
 import sys
-from parser_improved import sync_cash_transactions, test_connection
+import argparse
+from parser_improved import sync_cash_transactions, test_connection, add_workers_argument, add_metrics_argument
+from pipeline_metrics import metrics, write_metrics
 
 def main():
+    arg_parser = argparse.ArgumentParser(description="Синхронизация кассовых операций с Supabase")
+    add_workers_argument(arg_parser)
+    add_metrics_argument(arg_parser)
+    args = arg_parser.parse_args()
+    
     print("💰 AI Accountant - Синхронизация кассовых операций")
     print("=" * 60)
     
@@ -19,7 +26,7 @@ def main():
     
     # Ищем файлы .txt
     folder = "."
-    files = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".txt")]
+    files = [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(".txt")]
 
     if not files:
         print("❌ Не найдено файлов .txt для обработки")
@@ -29,7 +36,9 @@ def main():
     
     # Синхронизируем только кассовые операции
     print("💰 Синхронизация кассовых операций...")
-    success = sync_cash_transactions(files)
+    success = sync_cash_transactions(files, workers=args.workers)
+    metrics.report()
+    write_metrics(args.metrics)
     
     if success:
         print("✅ Кассовые операции успешно синхронизированы!")
@@ -0,0 +1,210 @@
+"""
+Конвейерная синхронизация выписок 1C: разбор файлов и запись в Supabase идут одновременно
+"""
+import asyncio
+from typing import List, Dict, Optional, Set
+
+from supabase_config import get_supabase_client, get_async_supabase_client, close_async_supabase_client
+from supabase_writer import (
+    async_upsert_chunk,
+    report_bulk_result,
+    BulkWriteResult,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_RETRIES,
+    DEFAULT_BACKOFF,
+)
+from import_ledger import ImportLedger
+from category_rules import get_category_matcher
+from pipeline_metrics import metrics
+from parser_improved import (
+    COMPANY_NAME,
+    get_company_id,
+    iter_1c_transactions_by_file,
+    build_file_db_rows,
+    select_changed_files,
+)
+
+# Сколько готовых чанков может ждать отправки; дальше разбор приостанавливается
+DEFAULT_QUEUE_CHUNKS = 8
+
+def produce_chunks(
+    file_paths: List[str],
+    company_id: str,
+    put,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    supabase=None,
+    ledger: Optional[ImportLedger] = None,
+    file_hashes: Optional[Dict[str, Set[str]]] = None,
+) -> Dict[str, int]:
+    """Разбирает файлы и отдает готовые чанки строк через put (блокируется при полной очереди)
+
+    С журналом (ledger) строки, отправленные с прежней версией файла, пропускаются.
+    Префиксы transaction_hash строк каждого файла копятся в file_hashes.
+    """
+    matcher = get_category_matcher(supabase)
+    seen_hashes: Set[str] = set()
+    file_hashes = {} if file_hashes is None else file_hashes
+    stats = {"transactions": 0, "cash": 0, "categorized": 0}
+    batch, pending = [], []
+
+    def flush_batch(file_path: str):
+        nonlocal pending
+        if not batch:
+            return
+        with metrics.stage("categorize"):
+            stats["categorized"] += matcher.categorize(batch)
+        rows, cash_count = build_file_db_rows(file_path, batch, company_id, file_hashes, seen_hashes, ledger)
+        stats["cash"] += cash_count
+        pending.extend(rows)
+        batch.clear()
+        while len(pending) >= chunk_size:
+            put(pending[:chunk_size])
+            pending = pending[chunk_size:]
+
+    for file_path, transactions in iter_1c_transactions_by_file(file_paths, workers=workers):
+        for transaction in transactions:
+            stats["transactions"] += 1
+            batch.append(transaction)
+            if len(batch) >= chunk_size:
+                flush_batch(file_path)
+        # Пачка не смешивает файлы: строки относятся к своему файлу в журнале
+        flush_batch(file_path)
+    if pending:
+        put(pending)
+
+    return stats
+
+async def run_pipeline(
+    file_paths: List[str],
+    company_id: str,
+    client,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    queue_chunks: int = DEFAULT_QUEUE_CHUNKS,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    supabase=None,
+    ledger: Optional[ImportLedger] = None,
+    file_hashes: Optional[Dict[str, Set[str]]] = None,
+) -> tuple:
+    """Запускает разбор в отдельном потоке и max_in_flight асинхронных писателей
+
+    Очередь ограничена queue_chunks чанками: если запись отстает, разбор
+    ждет. Разобранных, но еще не записанных операций не больше
+    (queue_chunks + max_in_flight + 3) * chunk_size: чанки в очереди и в записи,
+    чанк, ждущий места в очереди, и недобранные batch/pending разборщика.
+    При workers > 1 к этому добавляются до workers + 1 файлов, разобранных
+    целиком (см. iter_parsed_files). ledger и file_hashes — как у produce_chunks.
+    Возвращает (BulkWriteResult, статистика разбора).
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_chunks))
+    summary = BulkWriteResult()
+    next_index = 0
+
+    def put(chunk) -> None:
+        # Вызывается из потока разбора: ждем места в очереди (обратное давление)
+        asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+
+    def produce() -> Dict[str, int]:
+        try:
+            return produce_chunks(file_paths, company_id, put, workers=workers, chunk_size=chunk_size,
+                                  supabase=supabase, ledger=ledger, file_hashes=file_hashes)
+        finally:
+            # Сообщаем писателям, что чанков больше не будет (и при ошибке разбора тоже)
+            for _ in range(max_in_flight):
+                put(None)
+
+    async def consume() -> None:
+        nonlocal next_index
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            index, next_index = next_index, next_index + 1
+            started = loop.time()
+            result = await async_upsert_chunk(client, "transactions", index, chunk,
+                                              on_conflict="company_id,transaction_hash",
+                                              retries=retries, backoff=backoff)
+            metrics.add_time("upsert", loop.time() - started)
+            summary.chunks.append(result)
+
+    consumers = [asyncio.create_task(consume()) for _ in range(max(1, max_in_flight))]
+    try:
+        stats = await asyncio.to_thread(produce)
+    finally:
+        await asyncio.gather(*consumers)
+
+    summary.chunks.sort(key=lambda chunk: chunk.index)
+    metrics.count("written", summary.written)
+    metrics.count("failed", sum(chunk.rows for chunk in summary.failed))
+    return summary, stats
+
+def sync_all_transactions_pipelined(
+    file_paths: List[str],
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    queue_chunks: int = DEFAULT_QUEUE_CHUNKS,
+    ledger: Optional[ImportLedger] = None,
+) -> bool:
+    """Как sync_all_transactions, но запись в базу начинается до окончания разбора
+
+    Общее время стремится к max(разбор, запись) вместо их суммы.
+    """
+    try:
+        supabase = get_supabase_client()
+
+        # Получаем ID нашей компании
+        company_id = get_company_id(COMPANY_NAME, supabase)
+        if not company_id:
+            print(f"❌ Компания {COMPANY_NAME} не найдена в базе данных")
+            return False
+
+        fingerprints = None
+        file_hashes: Dict[str, Set[str]] = {}
+        if ledger is not None:
+            fingerprints = select_changed_files(ledger, company_id, file_paths)
+            if not fingerprints:
+                print("ℹ️ Новых данных для синхронизации нет")
+                ledger.save()
+                return True
+            file_paths = list(fingerprints)
+
+        async def run():
+            client = await get_async_supabase_client()
+            try:
+                return await run_pipeline(file_paths, company_id, client, workers=workers, chunk_size=chunk_size,
+                                          max_in_flight=max_in_flight, queue_chunks=queue_chunks,
+                                          supabase=supabase, ledger=ledger, file_hashes=file_hashes)
+            finally:
+                # Клиент привязан к этому циклу событий
+                await close_async_supabase_client()
+
+        result, stats = asyncio.run(run())
+
+        print(f"✅ Найдено {stats['transactions']} операций")
+        if not stats["transactions"]:
+            print("ℹ️ Нет валидных операций для синхронизации")
+            return False
+        if stats["cash"]:
+            print(f"💰 Найдено {stats['cash']} кассовых операций")
+        if stats["categorized"]:
+            print(f"🏷️ Категоризировано по правилам: {stats['categorized']} из {stats['transactions']}")
+        report_bulk_result(result)
+
+        if not result.ok:
+            print(f"❌ Ошибка при сохранении транзакций: не записано {sum(chunk.rows for chunk in result.failed)} строк")
+        elif ledger is not None:
+            # В журнал попадают только полностью записанные файлы
+            ledger.mark_synced(company_id, fingerprints, file_hashes)
+            ledger.save()
+
+        return result.ok
+
+    except Exception as e:
+        print(f"❌ Ошибка при синхронизации транзакций: {e}")
+        return False
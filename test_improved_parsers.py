@@ -6,13 +6,16 @@
 import os
 import sys
 import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import List, Dict
 
 # Добавляем текущую директорию в путь для импорта
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
-    from parser_improved import parse_1c_files_improved
+    from parser_improved import parse_1c_files_improved, iter_1c_lines
     from pdf_parser_improved import parse_pdf_improved, get_parser
 except ImportError as e:
     print(f"Ошибка импорта: {e}")
@@ -51,6 +54,939 @@ def test_1c_parsing():
         print(f"❌ Ошибка при парсинге 1C файлов: {e}")
         return []
 
+def test_1c_streaming_reader():
+    """Проверяет построчное чтение документов 1C"""
+    print("🧪 Тестирование потокового чтения 1C...")
+    
+    lines = [
+        "1CClientBankExchange",
+        "Документ=Платежное поручение",
+        "СекцияДокумент=выписка",
+        "НомерДокумента=1",
+        "СуммаПриход=",
+        "СуммаРасход=7000.00",
+        "ДатаОперации=10.10.2025",
+        "КонецДокумента",
+        "СекцияДокумент=выписка",
+        "НомерДокумента=2",
+        "ДатаОперации=11.10.2025",
+    ]
+    
+    documents = list(iter_1c_lines(lines))
+    print(f"✅ Найдено документов: {len(documents)}")
+    
+    assert len(documents) == 2
+    assert documents[0] == {
+        "НомерДокумента": "1",
+        "СуммаРасход": "7000.00",
+        "ДатаОперации": "10.10.2025",
+    }
+    assert documents[1]["НомерДокумента"] == "2"
+
+def test_1c_reader_alternative_forms(tmp_path):
+    """Проверяет строки "Поле: значение", "Поле значение" и границы Документ=/Операция="""
+    print("🧪 Тестирование упрощенных выгрузок 1C...")
+
+    lines = [
+        "Операция=1",
+        "ДатаОперации: 10.10.2025",
+        "ПлательщикИИК KZ87722C000022014099",
+        "СуммаРасход : 7000.00",
+        "НазначениеПлатежа Оплата по договору 5",
+        "СуммаРасход=6000.00",
+        "Документ=Платежное поручение",
+        "НомерДокумента 2",
+        "НомерДокумента: 3",
+        "ДатаОперации=11.10.2025",
+        "ДатаОперации: 12.10.2025",
+        "КонецДокумента",
+        "НомерДокумента=вне документа",
+    ]
+    documents = list(iter_1c_lines(lines))
+    print(f"✅ Найдено документов: {len(documents)}")
+    assert documents == [
+        {
+            "ДатаОперации": "10.10.2025",
+            "ПлательщикИИК": "KZ87722C000022014099",
+            # Форма с "=" важнее формы с ":"
+            "СуммаРасход": "6000.00",
+            "НазначениеПлатежа": "Оплата по договору 5",
+        },
+        {"НомерДокумента": "3", "ДатаОперации": "11.10.2025"},
+    ]
+
+    # Выгрузка из одной операции без секций
+    assert list(iter_1c_lines(["ДатаОперации: 10.10.2025", "СуммаПриход 100.00"])) == [
+        {"ДатаОперации": "10.10.2025", "СуммаПриход": "100.00"}
+    ]
+
+    path = tmp_path / "simple.txt"
+    path.write_text(
+        "Документ=Платежное поручение\r\n"
+        "НомерДокумента: 77\r\n"
+        "ДатаОперации: 10.10.2025\r\n"
+        "ПлательщикИИК: KZ87722C000022014099\r\n"
+        "ПолучательНаименование: ТОО Ромашка\r\n"
+        "СуммаРасход: 7000.00\r\n"
+        "Документ=Платежное поручение\r\n"
+        "НомерДокумента 78\r\n"
+        "ДатаОперации 11.10.2025\r\n"
+        "ПолучательИИК KZ87722C000022014099\r\n"
+        "ПлательщикНаименование ИП Иванов\r\n"
+        "СуммаПриход 500.00\r\n",
+        encoding="utf-8",
+    )
+    records = parse_1c_files_improved([str(path)])
+    assert [(r["НомерДокумента"], r["ТипТранзакции"], r["Контрагент"]) for r in records] == [
+        ("77", "expense", "ТОО Ромашка"),
+        ("78", "income", "ИП Иванов"),
+    ]
+
+def test_encoding_detection():
+    """Проверяет определение кодировки по BOM и заголовку Кодировка="""
+    print("🧪 Тестирование определения кодировки...")
+    
+    from parser_improved import detect_encoding_from_prefix
+    
+    header = "1CClientBankExchange\r\nВерсияФормата=1.02\r\nКодировка={}\r\nСекцияДокумент=выписка\r\n"
+    assert detect_encoding_from_prefix(header.format("Windows").encode("cp1251")) == "cp1251"
+    assert detect_encoding_from_prefix(header.format("DOS").encode("cp866")) == "cp866"
+    assert detect_encoding_from_prefix(header.format("Windows").encode("utf-8")) == "utf-8"
+    assert detect_encoding_from_prefix(b"\xef\xbb\xbf" + "СекцияДокумент".encode("utf-8")) == "utf-8-sig"
+    assert detect_encoding_from_prefix("НомерДокумента=1\r\n".encode("cp1251") * 100) == "cp1251"
+    print("✅ Кодировки определены верно")
+
+def test_1c_reader_bounded_memory(tmp_path):
+    """Проверяет, что чтение большого файла 1C не держит файл целиком в памяти"""
+    print("🧪 Тестирование памяти при чтении большого файла 1C...")
+    
+    import tracemalloc
+    from parser_improved import iter_1c_documents
+    
+    document = (
+        "СекцияДокумент=Платежное поручение\r\n"
+        "НомерДокумента={0}\r\n"
+        "ДатаОперации=10.10.2025\r\n"
+        "ПлательщикИИК=KZ87722C000022014099\r\n"
+        "НазначениеПлатежа=Оплата по договору {0} " + "x" * 300 + "\r\n"
+        "СуммаРасход=7000.00\r\n"
+        "КонецДокумента\r\n"
+    )
+    path = tmp_path / "big.txt"
+    with open(path, "w", encoding="cp1251", newline="") as f:
+        f.write("1CClientBankExchange\r\nКодировка=Windows\r\n")
+        for number in range(20000):
+            f.write(document.format(number))
+    
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in iter_1c_documents(str(path)))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    
+    print(f"✅ Документов: {count}, пик памяти: {peak // 1024} КБ при файле {path.stat().st_size // 1024} КБ")
+    assert count == 20000
+    assert peak < path.stat().st_size // 10
+
+def test_batch_classification():
+    """Проверяет пакетную классификацию операций по колонкам"""
+    print("🧪 Тестирование пакетной классификации...")
+    
+    from parser_improved import classify_transactions, determine_transaction_type
+    
+    ours, other = "KZ87722C000022014099", "KZ00000"
+    columns = classify_transactions(
+        [ours, " kz88722s000040014444 ", other, other],
+        ["KZ9496511F0008314291", other, ours, other],
+        ["", "", "", "Приходный кассовый ордер"],
+        ["", "", "", "Поступление НАЛИЧНЫХ"],
+        [True, True, False, False],
+        [False, False, True, True],
+        ["Мы", "Мы", "Клиент", "Клиент"],
+        ["Мы", "Поставщик", "Мы", ""],
+    )
+    
+    assert columns["ТипТранзакции"] == ["transfer", "expense", "income", "income"]
+    assert columns["Счет"] == ["", "KZ88722S000040014444", ours, "CASH"]
+    assert columns["Контрагент"][1:] == ["Поставщик", "Клиент", "Клиент"]
+    assert determine_transaction_type({"ПлательщикИИК": other, "ПолучательИИК": other})["ТипТранзакции"] == ""
+    print("✅ Классификация корректна")
+
+def test_category_rules_matcher():
+    """Проверяет скомпилированный матчер правил категоризации"""
+    print("🧪 Тестирование правил категоризации...")
+    
+    from category_rules import CategoryMatcher, CategoryRule
+    from transaction_record import Transaction
+    
+    matcher = CategoryMatcher([
+        CategoryRule("Зарплата", "purpose", "заработная плата", priority=10, rule_id=1),
+        CategoryRule("Транспорт", "purpose", "топливо", priority=5, rule_id=2),
+        CategoryRule("Офисные расходы", "purpose", "офис", priority=5, rule_id=3),
+        CategoryRule("Поставщики", "counterparty", "ТОО Ромашка", priority=8, rule_id=4),
+        CategoryRule("Крупные", "amount", ">=1 000 000", priority=1, rule_id=5),
+    ])
+    
+    assert matcher.match("", "Оплата за офис и топливо", 0) == "Транспорт"
+    assert matcher.match("", "ЗАРАБОТНАЯ ПЛАТА за офис", 0) == "Зарплата"
+    assert matcher.match("тоо ромашка", "топливо", 0) == "Поставщики"
+    assert matcher.match("", "прочее", 100000000) == "Крупные"
+    assert matcher.match("", "прочее", 99999999) is None
+    
+    transactions = [Transaction(payment_purpose="бензин", category="Расход"), Transaction(payment_purpose="топливо")]
+    assert matcher.categorize(transactions) == 1
+    assert [t.category for t in transactions] == ["Расход", "Транспорт"]
+    
+    # Правило категории расходов не трогает доходы и переводы
+    typed = CategoryMatcher([
+        CategoryRule("Аренда", "purpose", "аренд", priority=5, rule_id=1, category_type="expense"),
+        CategoryRule("Продажи", "purpose", "оплата", priority=1, rule_id=2, category_type="income"),
+        CategoryRule("Крупные", "amount", ">=1 000 000", priority=0, rule_id=3, category_type="expense"),
+    ])
+    assert typed.match("", "Оплата аренды", 0, "expense") == "Аренда"
+    assert typed.match("", "Оплата аренды", 0, "income") == "Продажи"
+    assert typed.match("", "Возврат аренды", 0, "transfer") is None
+    assert typed.match("", "прочее", 100000000, "income") is None
+    transactions = [Transaction(payment_purpose="аренда", transaction_type="income"),
+                    Transaction(payment_purpose="аренда", transaction_type="expense")]
+    assert typed.categorize(transactions) == 1
+    assert [t.category for t in transactions] == ["", "Аренда"]
+
+    # Автомат находит шаблоны внутри других шаблонов и после частичных совпадений
+    from category_rules import TextAutomaton
+    automaton = TextAutomaton(["авиабилет", "билет", "ави", "виа", "он"])
+    assert automaton.search("покупка авиабилета") == 0
+    assert automaton.search("авиавиабилет") == 0
+    assert automaton.search("билеты на поезд") == 1
+    assert automaton.search("авиатор") == 2
+    assert automaton.search("кавиар") == 2
+    assert automaton.search("вианор") == 3
+    assert automaton.search("телефон") == 4
+    assert automaton.search("") is None and automaton.search("прочее") is None
+    print("✅ Категоризация корректна")
+
+def test_pipeline_metrics():
+    """Проверяет счетчики и замеры этапов разбора 1C"""
+    print("🧪 Тестирование метрик конвейера...")
+    
+    from parser_improved import parse_1c_transactions
+    from pipeline_metrics import metrics
+    
+    metrics.reset()
+    transactions = parse_1c_transactions(["test_statement.txt", "test_statement.txt"])
+    data = metrics.to_dict()
+    
+    assert data["counters"]["documents_seen"] == 4
+    assert data["skipped"]["duplicate"] == 4 - len(transactions)
+    assert {"read", "prepare", "classify", "validate", "dedup"} <= set(data["stages"])
+    assert 'statement_sync_skipped{reason="duplicate"}' in metrics.to_prometheus()
+    print("✅ Метрики собраны")
+
+def test_transaction_record_roundtrip():
+    """Проверяет перевод записи парсера в Transaction и обратно"""
+    print("🧪 Тестирование типизированной записи Transaction...")
+    
+    from transaction_record import Transaction
+    
+    record = {
+        "ПлательщикИИК": "KZ88722S000040014444",
+        "НомерДокумента": "42",
+        "ДатаОперации": "10.10.2025",
+        "СуммаРасход": "7 000,5",
+        "ТипТранзакции": "expense",
+    }
+    transaction = Transaction.from_record(record)
+    
+    assert transaction.operation_date.isoformat() == "2025-10-10"
+    assert transaction.expense_tiyn == 700050
+    assert transaction.income_tiyn == 0
+    
+    converted = transaction.to_record()
+    assert converted["СуммаРасход"] == "7000.50"
+    assert converted["СуммаПриход"] == ""
+    assert converted["ДатаОперации"] == "10.10.2025"
+    assert converted["НомерДокумента"] == "42"
+    print("✅ Преобразование корректно")
+
+class FakePostgrestHandler(BaseHTTPRequestHandler):
+    """Локальная заглушка REST-эндпоинта Supabase для проверки пакетной записи"""
+    
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        rows = json.loads(body)
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.requests in server.fail_on
+            if not fail:
+                server.rows.extend(rows)
+                server.prefer.append(self.headers.get("Prefer", ""))
+        
+        if fail:
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"message": "temporary failure"}')
+            return
+        
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b"[]")
+    
+    def log_message(self, format, *args):
+        pass
+
+@contextmanager
+def fake_postgrest_server(handler=None, fail_on=()):
+    """Поднимает заглушку PostgREST на свободном порту, отдает (сервер, url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler or FakePostgrestHandler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.fail_on = set(fail_on)
+    server.rows = []
+    server.prefer = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_supabase_client_reuse():
+    """Проверяет общий клиент Supabase: get → close → get дает новый клиент"""
+    print("🧪 Тестирование общего клиента Supabase...")
+
+    import asyncio
+    import supabase_config
+
+    supabase_config.close_supabase_client()
+    client = supabase_config.get_supabase_client()
+    assert supabase_config.get_supabase_client() is client
+
+    # Закрытие не создает ленивый postgrest, которым клиент еще не пользовался
+    supabase_config.close_supabase_client()
+    assert client._postgrest is None and client._storage is None
+    assert client.auth._http_client.is_closed
+
+    fresh = supabase_config.get_supabase_client()
+    assert fresh is not client
+    session = fresh.postgrest.session
+    storage_session = fresh.storage.session
+    supabase_config.close_supabase_client()
+    assert session.is_closed and storage_session.is_closed
+    assert supabase_config.get_supabase_client() is not fresh
+    supabase_config.close_supabase_client()
+
+    async def async_cycle():
+        first = await supabase_config.get_async_supabase_client()
+        session = first.postgrest.session
+        await supabase_config.close_async_supabase_client()
+        second = await supabase_config.get_async_supabase_client()
+        await supabase_config.close_async_supabase_client()
+        return first, session, second
+
+    if supabase_config.acreate_client is not None:
+        first, session, second = asyncio.run(async_cycle())
+        assert session.is_closed and second is not first
+
+    print("✅ После close_supabase_client создается новый клиент, старые сессии закрыты")
+
+def test_bulk_upsert_local_stub():
+    """Проверяет пакетную запись с повторами на локальной заглушке"""
+    print("🧪 Тестирование пакетной записи в Supabase...")
+    
+    from supabase import create_client
+    from supabase_writer import bulk_upsert
+    
+    with fake_postgrest_server(fail_on={1}) as (server, url):
+        client = create_client(url, "test-key")
+        rows = [{"transaction_hash": str(i)} for i in range(25)]
+        result = bulk_upsert("transactions", rows, on_conflict="transaction_hash",
+                             chunk_size=10, max_in_flight=2, backoff=0, client=client)
+    
+    print(f"✅ Записано {result.written} строк в {len(result.chunks)} чанках")
+    
+    assert result.ok
+    assert result.written == 25
+    assert [chunk.rows for chunk in result.chunks] == [10, 10, 5]
+    assert sum(chunk.attempts for chunk in result.chunks) == 4
+    assert sorted(int(r["transaction_hash"]) for r in server.rows) == list(range(25))
+    assert all("return=minimal" in prefer for prefer in server.prefer)
+
+def test_pipelined_sync_local_stub():
+    """Проверяет конвейерную запись (разбор параллельно с upsert) на локальной заглушке"""
+    print("🧪 Тестирование конвейерной синхронизации...")
+    
+    import asyncio
+    from supabase import acreate_client, create_client
+    from parser_improved import build_all_db_transactions, parse_1c_transactions
+    from sync_pipeline import run_pipeline
+    
+    async def run(url):
+        client = await acreate_client(url, "test-key")
+        try:
+            return await run_pipeline(["test_statement.txt"], "company", client, chunk_size=1,
+                                      max_in_flight=2, queue_chunks=1, backoff=0,
+                                      supabase=create_client(url, "test-key"))
+        finally:
+            await client.postgrest.aclose()
+    
+    with fake_postgrest_server(fail_on={1}) as (server, url):
+        result, stats = asyncio.run(run(url))
+    
+    expected = build_all_db_transactions(parse_1c_transactions(["test_statement.txt"]), "company")
+    print(f"✅ Записано {result.written} строк, операций: {stats['transactions']}")
+    
+    assert result.ok
+    assert result.written == len(expected)
+    assert sorted(row["transaction_hash"] for row in server.rows) == sorted(row["transaction_hash"] for row in expected)
+    assert [chunk.index for chunk in result.chunks] == list(range(len(expected)))
+
+def test_import_ledger_sync(tmp_path, monkeypatch):
+    """Проверяет журнал импорта: пропуск неизменных файлов, отправку только новых строк,
+    файл, переписанный во время синхронизации, и исчезнувший файл"""
+    print("🧪 Тестирование журнала импорта...")
+    
+    import parser_improved
+    import supabase_config
+    import sync_pipeline
+    from benchmark_parsers import generate_1c_statement
+    from import_ledger import ImportLedger, HASH_PREFIX_LENGTH
+    
+    monkeypatch.setattr(parser_improved, "get_company_id", lambda *args, **kwargs: "company")
+    monkeypatch.setattr(sync_pipeline, "get_company_id", lambda *args, **kwargs: "company")
+    real_iter = parser_improved.iter_1c_transactions_by_file
+    syncs = {
+        "sync_all_transactions": parser_improved.sync_all_transactions,
+        "sync_all_transactions_pipelined": sync_pipeline.sync_all_transactions_pipelined,
+    }
+    
+    for name, sync_files in syncs.items():
+        folder = tmp_path / name
+        folder.mkdir()
+        statement = generate_1c_statement(str(folder / "statement.txt"), 5)
+        other = generate_1c_statement(str(folder / "other.txt"), 3, seed=7)
+        missing = str(folder / "missing.txt")
+        ledger_path = str(folder / "ledger.json")
+        
+        supabase_config.close_supabase_client()
+        with fake_postgrest_server() as (server, url):
+            monkeypatch.setattr(supabase_config, "SUPABASE_URL", url)
+            
+            def sync(files):
+                before = len(server.rows)
+                assert sync_files(files, ledger=ImportLedger(ledger_path))
+                return server.rows[before:]
+            
+            first = sync([statement, other])
+            # Файл исчез между получением списка и синхронизацией — пропускается, остальные пишутся
+            assert sync([statement, other, missing]) == []
+            
+            generate_1c_statement(statement, 6)  # в выписку дописан один документ
+            appended = sync([statement, other])
+            
+            # Выписку переписывают уже после разбора: в журнал попадает разобранная версия,
+            # поэтому следующий запуск отправляет дописанный за это время документ
+            def rewriting_iter(file_paths, workers=1):
+                for file_path, transactions in real_iter(file_paths, workers):
+                    yield file_path, list(transactions)
+                generate_1c_statement(statement, 8)
+            
+            generate_1c_statement(statement, 7)
+            monkeypatch.setattr(parser_improved, "iter_1c_transactions_by_file", rewriting_iter)
+            monkeypatch.setattr(sync_pipeline, "iter_1c_transactions_by_file", rewriting_iter)
+            during_rewrite = sync([statement, other])
+            monkeypatch.setattr(parser_improved, "iter_1c_transactions_by_file", real_iter)
+            monkeypatch.setattr(sync_pipeline, "iter_1c_transactions_by_file", real_iter)
+            after_rewrite = sync([statement, other])
+            
+            # Уже импортированный файл удален: журнал не падает на os.stat
+            other_copy = open(other, "rb").read()
+            os.remove(other)
+            assert sync([statement, other]) == []
+            with open(other, "wb") as f:
+                f.write(other_copy)
+        supabase_config.close_supabase_client()
+        
+        sent = [row["transaction_hash"] for row in first + appended + during_rewrite + after_rewrite]
+        print(f"  ✅ {name}: первый запуск {len(first)} строк, затем по одной новой строке")
+        # Из измененного файла отправляются только новые строки, каждая один раз
+        assert first and len(appended) == len(during_rewrite) == len(after_rewrite) == 1
+        assert len(sent) == len(set(sent))
+        expected = parser_improved.build_all_db_transactions(
+            parser_improved.parse_1c_transactions([statement, other]), "company")
+        assert set(sent) == {row["transaction_hash"] for row in expected}
+        
+        ledger = ImportLedger(ledger_path)
+        assert ledger.changed_files("company", [statement, other, missing]) == [missing]
+        entries = ledger.data["companies"]["company"]["files"]
+        assert "hashes" not in ledger.data["companies"]["company"]
+        assert all(len(prefix) == HASH_PREFIX_LENGTH for prefix in entries[os.path.abspath(statement)]["hashes"])
+        assert len(entries[os.path.abspath(statement)]["hashes"]) + len(entries[os.path.abspath(other)]["hashes"]) == len(expected)
+        ledger.mark_synced("company", {missing: None})
+        assert os.path.abspath(missing) not in entries
+
+def test_single_parse_bank_and_cash_sync(tmp_path, monkeypatch):
+    """Проверяет, что один разбор дает те же банковские и кассовые строки, что две раздельные синхронизации"""
+    print("🧪 Тестирование общей синхронизации банка и кассы...")
+
+    from supabase import create_client
+    import parser_improved
+    from benchmark_parsers import generate_1c_statement
+
+    statement = generate_1c_statement(str(tmp_path / "statement.txt"), 20)
+    parses = []
+    real_parse = parser_improved.parse_1c_transactions
+
+    def counting_parse(file_paths, workers=1):
+        parses.append(list(file_paths))
+        return real_parse(file_paths, workers=workers)
+
+    monkeypatch.setattr(parser_improved, "parse_1c_transactions", counting_parse)
+    monkeypatch.setattr(parser_improved, "get_company_id", lambda *args, **kwargs: "company")
+
+    def run(*syncs):
+        parses.clear()
+        with fake_postgrest_server() as (server, url):
+            monkeypatch.setattr(parser_improved, "get_supabase_client", lambda: create_client(url, "test-key"))
+            assert all(sync([statement]) for sync in syncs)
+        return {row["transaction_hash"]: row for row in server.rows}, len(parses), server.requests
+
+    separate, separate_parses, separate_requests = run(parser_improved.sync_transactions,
+                                                       parser_improved.sync_cash_transactions)
+    combined, combined_parses, combined_requests = run(parser_improved.sync_all_transactions)
+
+    cash_rows = [row for row in combined.values() if row["category"] == "Касса"]
+    print(f"✅ {len(combined)} строк ({len(cash_rows)} кассовых): "
+          f"{combined_parses} разбор вместо {separate_parses}, {combined_requests} запрос вместо {separate_requests}")
+    assert combined_parses == 1 and separate_parses == 2
+    assert combined_requests < separate_requests
+    assert cash_rows and len(combined) > len(cash_rows)
+    assert combined == separate
+
+def test_columnar_export_schema(tmp_path):
+    """Проверяет, что Parquet хранит суммы как decimal128(15,2), а даты как date32"""
+    print("🧪 Тестирование выгрузки в Parquet...")
+
+    import pytest
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    from datetime import date
+    from decimal import Decimal
+    import parser_improved
+    from benchmark_parsers import generate_1c_statement
+    from columnar_export import write_transactions, write_pdf_operations
+
+    statement = generate_1c_statement(str(tmp_path / "statement.txt"), 30)
+    transactions = parser_improved.parse_1c_transactions([statement])
+    path = str(tmp_path / "transactions.parquet")
+    assert write_transactions(iter(transactions), path, batch_size=7) == len(transactions)
+
+    table = pq.read_table(path)
+    for name in ("amount_expense", "amount_income", "amount"):
+        assert table.schema.field(name).type == pa.decimal128(15, 2)
+    assert table.schema.field("operation_date").type == pa.date32()
+    assert table.schema.field("document_date").type == pa.date32()
+    assert table.column("amount_expense").to_pylist() == [Decimal(t.expense_tiyn).scaleb(-2) for t in transactions]
+    assert table.column("operation_date").to_pylist() == [t.operation_date for t in transactions]
+
+    operations = [
+        {"ДатаОперации": "05.03.25", "Дебет": "1 234,56", "Кредит": "", "Сумма": "1 234,56", "Банк": "Kaspi"},
+        {"ДатаОперации": "2025-03-06", "Дебет": "", "Кредит": "0.10", "Сумма": "0.10", "Банк": "Kaspi"},
+    ]
+    pdf_path = str(tmp_path / "pdf.parquet")
+    assert write_pdf_operations(operations, pdf_path) == 2
+    table = pq.read_table(pdf_path)
+    assert table.schema.field("debit").type == pa.decimal128(15, 2)
+    assert table.schema.field("operation_date").type == pa.date32()
+    assert table.column("debit").to_pylist() == [Decimal("1234.56"), None]
+    assert table.column("credit").to_pylist() == [None, Decimal("0.10")]
+    assert table.column("operation_date").to_pylist() == [date(2025, 3, 5), date(2025, 3, 6)]
+
+    print(f"✅ {len(transactions)} операций 1C и 2 операции PDF: суммы decimal128(15,2), даты date32")
+
+def test_company_cache_ttl(monkeypatch):
+    """Проверяет, что id компании кэшируется на COMPANY_CACHE_TTL и сбрасывается явно"""
+    print("🧪 Тестирование кэша company_id...")
+
+    from types import SimpleNamespace
+    import parser_improved
+
+    queries = []
+    companies = {"ТОО Тест": "company-1", "ТОО Второе": "company-2"}
+
+    class FakeCompaniesQuery:
+        def __init__(self):
+            self.filters = {}
+
+        def select(self, columns):
+            return self
+
+        def eq(self, column, value):
+            self.filters[column] = [value]
+            return self
+
+        def in_(self, column, values):
+            self.filters[column] = list(values)
+            return self
+
+        def execute(self):
+            queries.append(self.filters["name"])
+            return SimpleNamespace(data=[{"id": companies[name], "name": name}
+                                         for name in self.filters["name"] if name in companies])
+
+    client = SimpleNamespace(table=lambda name: FakeCompaniesQuery())
+    now = [1000.0]
+    monkeypatch.setattr(parser_improved.time, "monotonic", lambda: now[0])
+    parser_improved.clear_company_cache()
+
+    try:
+        assert parser_improved.get_company_id("ТОО Тест", client) == "company-1"
+        assert parser_improved.get_company_id("ТОО Тест", client) == "company-1"
+        assert len(queries) == 1
+
+        # Неизвестная компания не кэшируется
+        assert parser_improved.get_company_id("ТОО Нет", client) is None
+        assert parser_improved.get_company_id("ТОО Нет", client) is None
+        assert len(queries) == 3
+
+        # До истечения TTL — из кэша, после — новый запрос
+        now[0] += parser_improved.COMPANY_CACHE_TTL - 1
+        assert parser_improved.get_company_id("ТОО Тест", client) == "company-1"
+        assert len(queries) == 3
+        now[0] += 2
+        companies["ТОО Тест"] = "company-1b"
+        assert parser_improved.get_company_id("ТОО Тест", client) == "company-1b"
+        assert len(queries) == 4
+
+        # Явный сброс
+        companies["ТОО Тест"] = "company-1c"
+        parser_improved.clear_company_cache()
+        assert parser_improved.get_company_id("ТОО Тест", client) == "company-1c"
+        assert len(queries) == 5
+
+        # Предзагрузка одним запросом заполняет кэш для get_company_id
+        parser_improved.clear_company_cache()
+        found = parser_improved.preload_companies(["ТОО Тест", "ТОО Второе", "ТОО Нет"], client)
+        assert found == {"ТОО Тест": "company-1c", "ТОО Второе": "company-2"}
+        assert parser_improved.get_company_id("ТОО Второе", client) == "company-2"
+        assert len(queries) == 6
+    finally:
+        parser_improved.clear_company_cache()
+
+    print(f"✅ {len(queries)} запросов к companies на 9 вызовов")
+
+def test_parse_window_backpressure(monkeypatch):
+    """Проверяет, что при workers > 1 в работе не больше workers файлов сверх читаемого"""
+    print("🧪 Тестирование окна разбора файлов...")
+    
+    from concurrent.futures import ThreadPoolExecutor
+    import parser_improved
+    
+    submitted = []
+    
+    def fake_parse(file_path):
+        submitted.append(file_path)
+        return [file_path], {}
+    
+    monkeypatch.setattr(parser_improved, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(parser_improved, "parse_1c_file_with_metrics", fake_parse)
+    
+    file_paths = [f"file_{i}.txt" for i in range(10)]
+    consumed = []
+    for transactions in parser_improved.iter_parsed_files(file_paths, workers=3):
+        consumed.extend(transactions)
+        # Файлы, отправленные в пул, но еще не отданные потребителю
+        assert len(submitted) - len(consumed) <= 3
+    
+    print(f"✅ {len(consumed)} файлов, в работе не больше 3 сверх читаемого")
+    assert consumed == file_paths
+
+def test_parallel_parse_matches_sequential(tmp_path):
+    """Проверяет, что разбор в пуле процессов совпадает с последовательным по содержимому и порядку"""
+    print("🧪 Тестирование параллельного разбора 1C...")
+
+    from benchmark_parsers import generate_1c_statement
+    from parser_improved import iter_parsed_files, parse_1c_transactions
+
+    # Крупные файлы в начале: в пуле они дочитываются позже мелких
+    file_paths = [
+        generate_1c_statement(str(tmp_path / f"statement_{i}.txt"), documents, seed=i)
+        for i, documents in enumerate([400, 200, 5, 50, 20])
+    ]
+
+    sequential = [list(transactions) for transactions in iter_parsed_files(file_paths, workers=1)]
+    pooled = [list(transactions) for transactions in iter_parsed_files(file_paths, workers=3)]
+
+    print(f"✅ Операций по файлам: {[len(transactions) for transactions in pooled]}")
+    assert all(sequential)
+    assert pooled == sequential
+    assert parse_1c_transactions(file_paths, workers=3) == parse_1c_transactions(file_paths)
+
+def test_pipeline_memory_bound(tmp_path, monkeypatch):
+    """Проверяет, что медленная запись ограничивает число разобранных, но не записанных операций"""
+    print("🧪 Тестирование обратного давления конвейера...")
+    
+    import asyncio
+    import sync_pipeline
+    from benchmark_parsers import generate_1c_statement
+    from category_rules import CategoryMatcher
+    from parser_improved import build_db_rows, parse_1c_transactions
+    
+    path = generate_1c_statement(str(tmp_path / "statement.txt"), 200)
+    counters = {"parsed": 0, "written": 0, "max_live": 0}
+    sent_hashes = []
+    real_iter = sync_pipeline.iter_1c_transactions_by_file
+    
+    def counting_transactions(transactions):
+        for transaction in transactions:
+            counters["parsed"] += 1
+            counters["max_live"] = max(counters["max_live"], counters["parsed"] - counters["written"])
+            yield transaction
+    
+    def counting_iter(*args, **kwargs):
+        for file_path, transactions in real_iter(*args, **kwargs):
+            yield file_path, counting_transactions(transactions)
+    
+    class SlowUpsert:
+        def __init__(self, rows):
+            self.rows = rows
+        
+        async def execute(self):
+            await asyncio.sleep(0.002)
+            counters["written"] += len(self.rows)
+    
+    class SlowAsyncClient:
+        def table(self, name):
+            return self
+        
+        def upsert(self, rows, **kwargs):
+            sent_hashes.extend(row["transaction_hash"] for row in rows)
+            return SlowUpsert(rows)
+    
+    monkeypatch.setattr(sync_pipeline, "iter_1c_transactions_by_file", counting_iter)
+    monkeypatch.setattr(sync_pipeline, "get_category_matcher", lambda supabase=None: CategoryMatcher([]))
+    
+    chunk_size, queue_chunks, max_in_flight = 5, 2, 2
+    result, stats = asyncio.run(sync_pipeline.run_pipeline(
+        [path], "company", SlowAsyncClient(), chunk_size=chunk_size,
+        max_in_flight=max_in_flight, queue_chunks=queue_chunks, backoff=0))
+    
+    bound = (queue_chunks + max_in_flight + 3) * chunk_size
+    print(f"✅ Операций в памяти не больше {counters['max_live']} (граница {bound})")
+    assert result.ok and stats["transactions"] == counters["parsed"] > bound
+    assert counters["max_live"] <= bound
+    # Чанки уходят в запись в порядке разбора
+    expected, _ = build_db_rows(parse_1c_transactions([path]), "company")
+    assert sent_hashes == [row["transaction_hash"] for row in expected]
+
+def test_rollup_daily_paging():
+    """Проверяет постраничное чтение сводок по дням и проверку измерения разбивки"""
+    print("🧪 Тестирование чтения сводок transaction_rollups...")
+    
+    from datetime import date, timedelta
+    from types import SimpleNamespace
+    import pytest
+    import transaction_rollups
+    
+    calls = []
+    
+    class FakeRpcClient:
+        def rpc(self, name, params):
+            calls.append((name, params))
+            start = date.fromisoformat(params["start_date"])
+            end = date.fromisoformat(params["end_date"])
+            days = [{"day": (start + timedelta(days=i)).isoformat()}
+                    for i in range(min((end - start).days + 1, 3))]
+            return SimpleNamespace(execute=lambda: SimpleNamespace(data=days))
+    
+    original_page = transaction_rollups.DAILY_PAGE_DAYS
+    transaction_rollups.DAILY_PAGE_DAYS = 3
+    try:
+        days = transaction_rollups.get_daily_totals("company", date(2025, 1, 1), "2025-01-07",
+                                                    supabase=FakeRpcClient())
+    finally:
+        transaction_rollups.DAILY_PAGE_DAYS = original_page
+    
+    print(f"✅ Получено {len(days)} дней за {len(calls)} запросов")
+    assert [d["day"] for d in days] == [f"2025-01-0{i}" for i in range(1, 8)]
+    assert [params["start_date"] for _, params in calls] == ["2025-01-01", "2025-01-04", "2025-01-07"]
+    
+    with pytest.raises(ValueError):
+        transaction_rollups.get_period_breakdown("company", "total", supabase=FakeRpcClient())
+
+ACCOUNT_COLUMNS = ("payer_account", "receiver_account", "from_account", "to_account")
+
+class FakeTransactionsHandler(BaseHTTPRequestHandler):
+    """Локальная заглушка чтения transactions: фильтр по счету, ключу страницы и limit"""
+    
+    def do_GET(self):
+        from urllib.parse import urlparse, parse_qs
+        import re
+        
+        query = parse_qs(urlparse(self.path).query)
+        condition = query.get("or", [""])[0]
+        rows = self.server.rows
+        account = re.search(r"payer_account\.eq\.([^,)]+)", condition)
+        if account:
+            rows = [row for row in rows if account.group(1) in (row[column] for column in ACCOUNT_COLUMNS)]
+        keyset = re.search(r"operation_date\.gt\.([^,]+),and\(operation_date\.eq\.[^,]+,id\.gt\.([^)]+)\)",
+                           condition)
+        if keyset:
+            # uuid в Postgres сравнивается побайтно — как строки в нижнем регистре
+            after = (keyset.group(1), keyset.group(2))
+            rows = [row for row in rows if (row["operation_date"], row["id"]) > after]
+        rows = rows[:int(query["limit"][0])]
+        with self.server.lock:
+            self.server.selects.append(query["select"][0])
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(rows).encode())
+    
+    def log_message(self, format, *args):
+        pass
+
+def test_keyset_transaction_reader():
+    """Проверяет постраничное чтение истории по ключу (operation_date, id) с подкачкой"""
+    print("🧪 Тестирование постраничного чтения транзакций...")
+    
+    import uuid
+    from supabase import create_client
+    from transaction_reader import iter_transaction_pages, iter_transactions
+    
+    # Счета заполняются как в classify_transaction: доход и расход — payer/receiver, перевод — from/to
+    account, other = "KZ87722C000022014099", "KZ000000000000000001"
+    accounts_by_type = {
+        "income": {"payer_account": other, "receiver_account": account, "from_account": "", "to_account": ""},
+        "expense": {"payer_account": account, "receiver_account": other, "from_account": "", "to_account": ""},
+        "transfer": {"payer_account": "", "receiver_account": "", "from_account": account, "to_account": other},
+    }
+    rows = []
+    for i in range(12):
+        transaction_type = ("income", "expense", "transfer")[i % 3]
+        row = {"id": str(uuid.UUID(int=i * 7919 % 97 << 64)), "operation_date": f"2025-01-{1 + i // 4:02d}",
+               "transaction_type": transaction_type, "amount_total": i, **accounts_by_type[transaction_type]}
+        if i % 4 == 3:
+            row.update(payer_account=other, receiver_account=other, from_account="", to_account="")
+        rows.append(row)
+    # Несколько операций в один день: ключ должен различать их по id
+    rows.sort(key=lambda row: (row["operation_date"], row["id"]))
+    
+    with fake_postgrest_server(FakeTransactionsHandler) as (server, url):
+        server.rows = rows
+        server.selects = []
+        client = create_client(url, "test-key")
+        pages = list(iter_transaction_pages("company", columns=["amount_total"], page_size=4, supabase=client))
+        streamed = list(iter_transactions("company", page_size=3, prefetch=False, supabase=client))
+        by_account = list(iter_transactions("company", account=account, page_size=2, supabase=client))
+    
+    print(f"✅ Прочитано {sum(map(len, pages))} строк за {len(pages)} страницы")
+    expected_ids = [row["id"] for row in rows]
+    assert [len(page) for page in pages] == [4, 4, 4]
+    assert [row["id"] for page in pages for row in page] == expected_ids
+    assert [row["id"] for row in streamed] == expected_ids
+    assert server.selects[0] == "amount_total,operation_date,id"
+    # Фильтр по счету находит доходы и расходы, а не только переводы
+    assert [row["id"] for row in by_account] == [
+        row["id"] for row in rows if account in (row[column] for column in ACCOUNT_COLUMNS)]
+    assert {row["transaction_type"] for row in by_account} == {"income", "expense", "transfer"}
+
+def test_rollups_concurrent_upserts_postgres(tmp_path):
+    """Проверяет сводки transaction_rollups на настоящем Postgres при параллельной записи чанков"""
+    print("🧪 Тестирование сводок при параллельных upsert...")
+    
+    import random
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    import pytest
+    pgserver = pytest.importorskip("pgserver")
+    psycopg2 = pytest.importorskip("psycopg2")
+    
+    server = pgserver.get_server(str(tmp_path / "pgdata"), cleanup_mode="stop")
+    uri = server.get_uri()
+    with psycopg2.connect(uri) as conn:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(open("database_schema.sql", encoding="utf-8").read())
+            cursor.execute("INSERT INTO companies (name) VALUES ('ROLLUP TEST') RETURNING id")
+            company_id = cursor.fetchone()[0]
+    
+    # Чанки разного размера задевают пересекающиеся строки сводок (дни, категории, контрагенты):
+    # без упорядоченного захвата блокировок такие чанки взаимно блокируются
+    rng = random.Random(7)
+    rows = []
+    for i in range(20000):
+        transaction_type = rng.choice(["income", "expense"])
+        amount = rng.randint(1, 100000) / 100
+        rows.append({
+            "company_id": company_id,
+            "transaction_hash": uuid.uuid4().hex,
+            "transaction_type": transaction_type,
+            "operation_date": f"2025-{rng.randint(1, 3):02d}-{rng.randint(1, 28):02d}",
+            "amount_income": amount if transaction_type == "income" else 0,
+            "amount_expense": amount if transaction_type == "expense" else 0,
+            "category": rng.choice(["Аренда", "Зарплата", "Продажи", "Налоги", None]),
+            "counterparty": f"Контрагент {rng.randint(1, 300)}",
+        })
+    
+    upsert_sql = """
+        INSERT INTO transactions (company_id, transaction_hash, transaction_type, operation_date,
+                                  amount_income, amount_expense, category, counterparty)
+        SELECT company_id, transaction_hash, transaction_type, operation_date,
+               amount_income, amount_expense, category, counterparty
+        FROM json_populate_recordset(NULL::transactions, %s::json)
+        ON CONFLICT (company_id, transaction_hash) DO UPDATE SET
+            transaction_type = EXCLUDED.transaction_type, operation_date = EXCLUDED.operation_date,
+            amount_income = EXCLUDED.amount_income, amount_expense = EXCLUDED.amount_expense,
+            category = EXCLUDED.category, counterparty = EXCLUDED.counterparty
+    """
+    
+    def upsert(chunk):
+        # Как запрос PostgREST: один чанк — одна транзакция
+        with psycopg2.connect(uri) as conn, conn.cursor() as cursor:
+            cursor.execute(upsert_sql, (json.dumps(chunk, ensure_ascii=False),))
+    
+    def sync(chunk_rows):
+        chunks, start = [], 0
+        while start < len(chunk_rows):
+            size = rng.randint(20, 500)
+            chunks.append(chunk_rows[start:start + size])
+            start += size
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(upsert, chunks))  # взаимная блокировка поднимет DeadlockDetected
+    
+    def snapshot(cursor):
+        cursor.execute("""
+            SELECT dimension, dimension_value, day, transaction_type, amount_income, amount_expense, transaction_count
+            FROM transaction_rollups WHERE transaction_count <> 0 ORDER BY 1, 2, 3, 4
+        """)
+        return cursor.fetchall()
+    
+    sync(rows)
+    sync(rows)  # повторная синхронизация тех же строк не меняет сводки
+    
+    with psycopg2.connect(uri) as conn, conn.cursor() as cursor:
+        incremental = snapshot(cursor)
+        cursor.execute("SELECT * FROM get_transaction_stats(%s, NULL, NULL)", (company_id,))
+        total_income, total_expense, _, count = cursor.fetchone()
+        cursor.execute("SELECT rebuild_transaction_rollups(%s)", (company_id,))
+        rebuilt = snapshot(cursor)
+        cursor.execute("DELETE FROM transactions WHERE operation_date < '2025-02-01'")
+        cursor.execute("SELECT count(*) FROM transaction_rollups WHERE day < '2025-02-01' AND transaction_count <> 0")
+        left_after_delete = cursor.fetchone()[0]
+    
+    print(f"✅ {len(incremental)} строк сводок совпадают с пересчетом")
+    assert incremental == rebuilt
+    assert count == len(rows)
+    assert float(total_income) == pytest.approx(sum(row["amount_income"] for row in rows))
+    assert float(total_expense) == pytest.approx(sum(row["amount_expense"] for row in rows))
+    assert left_after_delete == 0
+
 def test_pdf_parsing():
     """Тестирует парсинг PDF файлов"""
     print("\n🧪 Тестирование парсинга PDF файлов...")
@@ -112,6 +1048,469 @@ def test_parser_selection():
         parser_name = parser.__class__.__name__
         print(f"  🏦 {bank} → {parser_name}")
 
+def test_pdf_pattern_registry_matches_inline():
+    """Проверяет, что реестр скомпилированных паттернов дает тот же результат, что и прежние встроенные регулярки"""
+    import re
+    import random
+    from benchmark_parsers import pdf_operation_lines
+
+    print("\n🧪 Тестирование реестра паттернов PDF-парсеров...")
+
+    date_re = r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}"
+    legacy_starts = {
+        "Kaspi": lambda line: re.match(date_re, line),
+        "Forte": lambda line: re.match(date_re, line) or "операция" in line.lower(),
+        "Halyk": lambda line: re.match(date_re, line) or re.match(r"\d{6,}", line),
+        "Other": lambda line: re.match(date_re, line),
+    }
+
+    def legacy_clean(text):
+        return re.sub(r"[ \t]{2,}", " ", text.replace("\xa0", " ")).strip()
+
+    def legacy_groups(bank, text):
+        if bank == "Other":
+            text = legacy_clean(text)
+        operations, current = [], []
+        for line in [l.strip() for l in text.splitlines() if l.strip()]:
+            if legacy_starts[bank](line):
+                if current:
+                    operations.append(current)
+                current = [line]
+            else:
+                current.append(line)
+        if current:
+            operations.append(current)
+        return operations
+
+    def legacy_search(patterns, text, flags=0, group=0):
+        for pattern in patterns:
+            match = re.search(pattern, text, flags)
+            if match:
+                return match.group(group)
+        return ""
+
+    def legacy_amounts(text):
+        for pattern in (r"\d{12}", r"\d{4,6}", date_re):
+            text = re.sub(pattern, "", text)
+        return re.findall(r"\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})?", text)
+
+    def legacy_counterparty(text):
+        for pattern in (
+            r"(?:ИП|ТОО|ООО|АО|АООТ|ТДО|КХ|ПК|КП|СПК|ЧП|ФЛ)\s+[A-Za-zА-Яа-я0-9 .\"'«»-]{3,50}",
+            r"[А-Яа-я]{2,}\s+[А-Яа-я]{2,}(?:\s+[А-Яа-я]{2,})?",
+            r"[A-Za-zА-Яа-я]{3,}\s+[A-Za-zА-Яа-я]{3,}(?:\s+[A-Za-zА-Яа-я]{3,})*",
+        ):
+            for match in re.findall(pattern, text):
+                counterparty = re.sub(r'[^\w\sА-Яа-я«»""\'-]', '', match.strip())
+                if 3 < len(counterparty) < 100:
+                    return counterparty
+        return ""
+
+    rng = random.Random(8)
+    edge_lines = [
+        "2025-10-10 Оплата ТОО Ромашка № 15 1 200,50",
+        "ОПЕРАЦИЯ по счету 05.10.2025 # 7 Зачисление 300.00",
+        "123456789 Списание ИП  Иванов\xa0Сергей   док17 45,00",
+        "Комиссия банка 10/10/25 560000000001 2.500,00",
+    ]
+    for bank in legacy_starts:
+        lines = edge_lines + [
+            line
+            for number in range(1, 40)
+            for line in pdf_operation_lines(bank, number, rng)
+        ]
+        text = "\n".join(lines)
+        parser = get_parser(bank)
+
+        operations = list(parser.group_operations(text.splitlines()))
+        assert operations == legacy_groups(bank, text), bank
+
+        for operation in operations:
+            full_text = " ".join(operation)
+            assert parser.extract_date(full_text) == legacy_search([date_re, r"\d{4}[./-]\d{1,2}[./-]\d{1,2}"], full_text)
+            assert parser.extract_document_number(full_text) == legacy_search(
+                [r"(?:док|документ|№|#)\s*(\d+)", r"№\s*(\d+)", r"док\s*(\d+)"], full_text, re.IGNORECASE, 1
+            )
+            assert parser.extract_counterparty(full_text) == legacy_counterparty(full_text)
+            stripped = full_text
+            for key in ("amount_exclude_iin", "amount_exclude_doc", "amount_exclude_date"):
+                stripped = parser.patterns[key].sub("", stripped)
+            assert parser.patterns["amount"].findall(stripped) == legacy_amounts(full_text)
+        print(f"  ✅ {bank}: {len(operations)} операций совпадают")
+
+def test_bank_detection():
+    """Тестирует определение банка по шапке выписки"""
+    print("\n🧪 Тестирование определения банка...")
+    from pdf_parser_improved import detect_bank, resolve_bank, resolve_bank_from_pages, FALLBACK_BANK
+
+    headers = {
+        "Kaspi": "Выписка по счету KZ87722C000022014099\nАО «Kaspi Bank», БИК CASPKZKA",
+        "Halyk": "АО «Народный Банк Казахстана»\nИИК KZ12601A871234567890 БИК HSBKKZKX",
+        "Forte": "ForteBank\nСчет: KZ9496511F0008314291",
+        "Jusan": "АО «Jusan Bank» TSESKZKA",
+    }
+    for bank, header in headers.items():
+        ranked = detect_bank(header)
+        print(f"  🏦 {bank} → {ranked}")
+        assert ranked[0][0] == bank
+        assert resolve_bank(header)[0] == bank
+
+    # Перевод в другой банк в назначении платежа не перевешивает реквизиты выписки
+    ranked = detect_bank("Kaspi Bank CASPKZKA KZ87722C000022014099\n01.01.2024 Перевод в Halyk 1 000,00")
+    assert ranked[0][0] == "Kaspi" and ranked[0][1] > 0.5
+
+    assert detect_bank("Выписка по счету") == []
+    assert resolve_bank("Выписка по счету") == (FALLBACK_BANK, 0.0)
+    # Признаки за пределами первых строк не учитываются
+    assert detect_bank("\n" * 100 + "Kaspi Bank") == []
+
+    # Первая страница остается в потоке страниц для разбора
+    bank, _, pages = resolve_bank_from_pages(iter(["Kaspi Bank\n01.01.2024 1 000,00", "вторая"]))
+    assert bank == "Kaspi" and list(pages) == ["Kaspi Bank\n01.01.2024 1 000,00", "вторая"]
+
+def test_pdf_parser_auto_bank(tmp_path):
+    """Проверяет, что скрипт для route.ts понимает bank=auto и не пишет "auto" в операции"""
+    print("\n🧪 Тестирование bank=auto в pdf_parser.py...")
+    import pytest
+    pytest.importorskip("reportlab")
+    from benchmark_parsers import generate_pdf_statement
+    from pdf_parser import parse_pdf
+    
+    path = generate_pdf_statement(str(tmp_path / "forte.pdf"), "Forte", 1)
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    operations = parse_pdf(pdf_bytes, "auto")
+    print(f"  ✅ {len(operations)} операций, банк {operations[0]['Банк']}")
+    assert operations and {operation["Банк"] for operation in operations} == {"Forte"}
+    assert operations == parse_pdf(pdf_bytes, "Forte")
+
+def test_pdf_table_layout(tmp_path, monkeypatch):
+    """Тестирует разбор PDF по колонкам таблицы"""
+    print("\n🧪 Тестирование разбора по колонкам таблицы...")
+    import pytest
+    pytest.importorskip("reportlab")
+    from benchmark_parsers import generate_pdf_table_statement, generate_pdf_statement
+    from pdf_parser_improved import parse_pdf_request
+    from pdf_tables import parse_table_amount, _template_cache
+    from pdf_cache import PdfCache
+
+    assert parse_table_amount("1 234,56 ₸") == ("1234.56", False)
+    assert parse_table_amount("1,234.56") == ("1234.56", False)
+    assert parse_table_amount("-1.234,5") == ("1234.50", True)
+    assert parse_table_amount("") == ("", False)
+
+    path = generate_pdf_table_statement(str(tmp_path / "table.pdf"), "Kaspi", 2)
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+
+    _template_cache.clear()
+    cache = PdfCache(str(tmp_path / "cache"))
+    result = parse_pdf_request(pdf_bytes, "auto", cache=cache, layout="table")
+    operations = result["transactions"]
+    print(f"  ✅ Найдено {len(operations)} операций, банк {result['bank']}")
+    assert result["bank"] == "Kaspi"
+    assert len(operations) == 56
+    for operation in operations:
+        # Номер документа и номер счета в назначении не попадают в суммы
+        assert operation["НомерДокумента"].isdigit()
+        assert operation["Сумма"] == (operation["Дебет"] or operation["Кредит"])
+        assert float(operation["Сумма"]) >= 1000
+        assert operation["Тип"] == ("Расход" if operation["Дебет"] else "Доход")
+    assert operations[0]["НомерДокумента"] == "1000"
+    assert operations[0]["Комментарий"].startswith("Оплата по счету")
+    # Шаблон колонок сохранен в кэше и переиспользуется
+    assert os.listdir(tmp_path / "cache" / "templates")
+    _template_cache.clear()
+    assert parse_pdf_request(pdf_bytes, "Kaspi", cache=cache, layout="table")["transactions"] == operations
+
+    # Без заголовка таблицы — обычный текстовый разбор
+    path = generate_pdf_statement(str(tmp_path / "plain.pdf"), "Forte", 1)
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    assert parse_pdf_request(pdf_bytes, "Forte", layout="table") == parse_pdf_request(pdf_bytes, "Forte")
+    # Без pdfplumber (pdf_tables не импортируется) — тоже текстовый разбор, а не ошибка
+    monkeypatch.setitem(sys.modules, "pdf_tables", None)
+    assert parse_pdf_request(pdf_bytes, "Forte", layout="table") == parse_pdf_request(pdf_bytes, "Forte")
+
+def test_pdf_table_page_break(tmp_path):
+    """Проверяет, что описание операции продолжается через разрыв страницы"""
+    print("\n🧪 Тестирование переноса операции через страницу...")
+    import pytest
+    pytest.importorskip("reportlab")
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from benchmark_parsers import PDF_TABLE_COLUMNS, PDF_ACCOUNTS, find_pdf_font
+    from pdf_tables import parse_pdf_table, _template_cache
+
+    font_path = find_pdf_font()
+    if not font_path:
+        pytest.skip("нет шрифта с кириллицей")
+    pdfmetrics.registerFont(TTFont("BenchFont", font_path))
+    path = str(tmp_path / "break.pdf")
+    pdf = canvas.Canvas(path)
+    pages = [
+        [("05.03.2025", "501", "ТОО Ромашка", "12 500,00"), ("", "", "Оплата по договору 7", "")],
+        [("", "", "за март 2025", ""), ("06.03.2025", "502", "ИП Иванов", "3 000,00")],
+    ]
+    for page_number, rows in enumerate(pages, 1):
+        pdf.setFont("BenchFont", 9)
+        pdf.drawString(40, 800, f"Kaspi Bank Выписка по счету {PDF_ACCOUNTS['Kaspi']}")
+        for title, x in PDF_TABLE_COLUMNS:
+            pdf.drawString(x, 776, title)
+        y = 760
+        for date, number, description, amount in rows:
+            pdf.drawString(40, y, date)
+            pdf.drawString(100, y, number)
+            pdf.drawString(150, y, description)
+            pdf.drawRightString(460, y, amount)
+            y -= 12
+        pdf.drawString(280, 30, f"Страница {page_number} из 2")
+        pdf.showPage()
+    pdf.save()
+
+    _template_cache.clear()
+    with open(path, "rb") as f:
+        operations = parse_pdf_table(f.read(), "Kaspi")["transactions"]
+    print(f"  ✅ {len(operations)} операции, первая: {operations[0]['Комментарий']}")
+    assert [operation["НомерДокумента"] for operation in operations] == ["501", "502"]
+    assert operations[0]["Комментарий"].startswith("Оплата по договору 7 за март 2025")
+    assert "Страница" not in operations[0]["Комментарий"]
+
+def test_pdf_table_zero_pages():
+    """Проверяет разбор по колонкам PDF без страниц"""
+    print("\n🧪 Тестирование PDF без страниц...")
+    import pytest
+    pytest.importorskip("pdfplumber")
+    from pdf_tables import parse_pdf_table
+    from pdf_parser_improved import parse_pdf_request, LAYOUT_TABLE
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [] /Count 0 >>"]
+    pdf_bytes, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf_bytes))
+        pdf_bytes += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf_bytes)
+    pdf_bytes += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf_bytes += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf_bytes += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+    assert parse_pdf_table(pdf_bytes, "Kaspi") is None
+    for bank_name in ("Kaspi", "auto"):
+        result = parse_pdf_request(pdf_bytes, bank_name, layout=LAYOUT_TABLE, backend="pdfplumber")
+        assert "Ошибка при открытии PDF" not in result.get("error", "")
+        assert not result.get("transactions")
+    print("  ✅ Таблица не найдена, ошибки открытия нет")
+
+def test_pdf_backends(tmp_path, monkeypatch):
+    """Проверяет, что бэкенды извлечения текста дают те же операции"""
+    print("\n🧪 Тестирование бэкендов извлечения текста PDF...")
+    import pytest
+    pytest.importorskip("reportlab")
+    from benchmark_parsers import generate_pdf_statement
+    from pdf_backends import available_backends, select_backend, iter_page_texts
+    from pdf_parser_improved import parse_pdf_request
+    from pdf_cache import PdfCache
+
+    backends = available_backends()
+    print(f"  📚 Установлены: {backends}")
+    assert select_backend() == backends[0]
+    assert select_backend("нет-такого") == backends[0]
+    # pypdfium2 включается только явно: по умолчанию — pdfplumber
+    if "pdfplumber" in backends:
+        assert backends[0] == "pdfplumber"
+    if "pypdfium2" in backends:
+        monkeypatch.setenv("PDF_BACKEND", "pypdfium2")
+        assert select_backend() == "pypdfium2"
+        monkeypatch.delenv("PDF_BACKEND")
+
+    path = generate_pdf_statement(str(tmp_path / "halyk.pdf"), "Halyk", 2)
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+
+    reference = None
+    for backend in backends:
+        pages = list(iter_page_texts(pdf_bytes, backend))
+        assert len(pages) == 2 and "\r" not in pages[0]
+        result = parse_pdf_request(pdf_bytes, "Halyk", backend=backend)
+        print(f"  ✅ {backend}: {len(result['transactions'])} операций")
+        reference = reference or result
+        assert result == reference
+
+    # Кэш хранит текст каждого бэкенда отдельно
+    cache = PdfCache(str(tmp_path / "cache"))
+    for backend in backends:
+        assert parse_pdf_request(pdf_bytes, "Halyk", cache=cache, backend=backend) == reference
+        assert cache.get_pages(cache.key(pdf_bytes), backend) is not None
+
+def test_pdf_streaming_matches_sequential(tmp_path):
+    """Проверяет, что потоковый и постраничный параллельный разбор PDF совпадают с последовательным"""
+    print("\n🧪 Тестирование потокового разбора PDF...")
+    import pytest
+    pytest.importorskip("reportlab")
+    from benchmark_parsers import generate_pdf_statement
+    from pdf_parser_improved import iter_pdf_pages, iter_pdf_operations, parse_pdf_request, parse_text_content
+
+    for bank_name in ("Kaspi", "Halyk", "Forte"):
+        path = generate_pdf_statement(str(tmp_path / f"{bank_name}.pdf"), bank_name, 6)
+        with open(path, "rb") as f:
+            pdf_bytes = f.read()
+
+        # Последовательно: весь текст целиком, затем разбор
+        pages = list(iter_pdf_pages(pdf_bytes))
+        reference = parse_text_content("".join(page + "\n" for page in pages), bank_name)
+        assert len(pages) == 6 and reference
+
+        # Страницы по 2 на задачу в трех процессах — порядок страниц сохраняется
+        assert list(iter_pdf_pages(pdf_bytes, workers=3, pages_per_task=2)) == pages
+        assert list(iter_pdf_operations(pdf_bytes, bank_name)) == reference
+        assert list(iter_pdf_operations(pdf_bytes, bank_name, workers=3)) == reference
+        assert parse_pdf_request(pdf_bytes, bank_name, workers=3)["transactions"] == reference
+        print(f"  ✅ {bank_name}: {len(reference)} операций на 6 страницах совпадают")
+
+def test_pdf_parse_server(tmp_path):
+    """Проверяет ответы сервера парсинга PDF на свободном порту"""
+    print("\n🧪 Тестирование сервера парсинга PDF...")
+    import socket
+    import http.client
+    import pytest
+    pytest.importorskip("reportlab")
+    from benchmark_parsers import generate_pdf_statement
+    from pdf_parser_improved import create_server, parse_pdf_request
+
+    path = generate_pdf_statement(str(tmp_path / "kaspi.pdf"), "Kaspi", 2)
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+
+    server = create_server(port=0, workers=1, cache_dir=str(tmp_path / "cache"), max_body_bytes=len(pdf_bytes))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+
+    def post(body: bytes, headers: Dict[str, str], query: str = "bank=Kaspi"):
+        connection = http.client.HTTPConnection(host, port, timeout=30)
+        try:
+            connection.putrequest("POST", f"/parse?{query}", skip_accept_encoding=True)
+            for name, value in headers.items():
+                connection.putheader(name, value)
+            connection.endheaders(body)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    try:
+        status, payload = post(pdf_bytes, {"Content-Length": str(len(pdf_bytes))})
+        assert status == 200
+        assert payload == parse_pdf_request(pdf_bytes, "Kaspi")
+        print(f"  ✅ 200: {len(payload['transactions'])} операций")
+
+        status, payload = post(b"", {"Content-Length": "abc"})
+        assert status == 400 and "Content-Length" in payload["error"]
+        status, payload = post(b"", {"Content-Length": "-5"})
+        assert status == 400
+        status, payload = post(b"", {"Content-Length": "0"})
+        assert status == 400
+        print("  ✅ 400 на некорректный и пустой Content-Length")
+
+        # Заявленный размер больше лимита: ответ приходит до отправки тела
+        with socket.create_connection((host, port), timeout=30) as sock:
+            sock.sendall(f"POST /parse HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(pdf_bytes) + 1}\r\n\r\n".encode())
+            response = sock.makefile("rb").readline()
+        assert b" 413 " in response
+        print("  ✅ 413 на тело больше лимита")
+
+        connection = http.client.HTTPConnection(host, port, timeout=30)
+        connection.request("GET", "/health")
+        assert json.loads(connection.getresponse().read())["status"] == "ok"
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.executor.shutdown()
+
+def test_pdf_cache(tmp_path, monkeypatch):
+    """Проверяет попадания и промахи кэша PDF, смену версии парсера и вытеснение LRU"""
+    print("\n🧪 Тестирование кэша PDF...")
+    import pdf_cache
+    from pdf_cache import PdfCache
+
+    operations = [{"НомерДокумента": "1", "Сумма": "100.00"}]
+    cache = PdfCache(str(tmp_path / "cache"), max_bytes=10 * 1024)
+    key = cache.key(b"%PDF-1.4 statement")
+    assert key == cache.key(b"%PDF-1.4 statement") != cache.key(b"%PDF-1.4 other")
+
+    # Промах, затем попадание
+    assert cache.get_pages(key, "pdfplumber") is None
+    assert cache.get_operations(key, "Halyk", "1") is None
+    cache.put_pages(key, ["страница 1", "страница 2"], "pdfplumber")
+    cache.put_operations(key, "Halyk", "1", operations, "pdfplumber")
+    assert cache.get_pages(key, "pdfplumber") == ["страница 1", "страница 2"]
+    assert cache.get_operations(key, "Halyk", "1", "pdfplumber") == operations
+
+    # Другой бэкенд, банк или версия парсера — промах
+    assert cache.get_pages(key, "pypdfium2") is None
+    assert cache.get_operations(key, "Kaspi", "1", "pdfplumber") is None
+    assert cache.get_operations(key, "Halyk", "2", "pdfplumber") is None
+    print("  ✅ Попадания и промахи")
+
+    # Пока кэш не переполнен, каталог обходится один раз, а не на каждой записи
+    walks = []
+    real_walk = os.walk
+    monkeypatch.setattr(pdf_cache.os, "walk", lambda *args, **kwargs: walks.append(1) or real_walk(*args, **kwargs))
+    fresh = PdfCache(str(tmp_path / "cache"), max_bytes=10 * 1024)
+    for i in range(20):
+        fresh.put_pages(key, [f"страница {i}"], "pdfplumber")
+    assert len(walks) == 1
+    print(f"  ✅ 20 записей — {len(walks)} обход каталога")
+
+    # Вытеснение: удаляются давно не читанные записи
+    cache = PdfCache(str(tmp_path / "lru"), max_bytes=3000)
+    keys = [cache.key(f"pdf {i}".encode()) for i in range(3)]
+    for i, item_key in enumerate(keys):
+        cache.put_pages(item_key, ["x" * 900], "pdfplumber")
+        path = cache._path(item_key, cache._pages_name("pdfplumber"))
+        os.utime(path, (1000 + i, 1000 + i))
+    # Чтение освежает самую старую запись
+    assert cache.get_pages(keys[0], "pdfplumber") is not None
+    cache.put_pages(cache.key(b"pdf 3"), ["x" * 900], "pdfplumber")
+
+    assert cache.get_pages(keys[0], "pdfplumber") is not None
+    assert cache.get_pages(keys[1], "pdfplumber") is None
+    assert cache.get_pages(keys[2], "pdfplumber") is not None
+    assert cache._total_bytes <= cache.max_bytes
+    print("  ✅ Вытеснена давно не читанная запись")
+
+def test_pdf_worker_cache_reuse(tmp_path, monkeypatch):
+    """Проверяет, что запросы сервера в одном процессе используют один PdfCache"""
+    print("\n🧪 Тестирование кэша процесса сервера...")
+    import pytest
+    pytest.importorskip("reportlab")
+    import pdf_cache
+    import pdf_parser_improved
+    from benchmark_parsers import generate_pdf_statement
+
+    path = generate_pdf_statement(str(tmp_path / "kaspi.pdf"), "Kaspi", 1)
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    cache_dir = str(tmp_path / "cache")
+
+    walks = []
+    real_walk = os.walk
+    monkeypatch.setattr(pdf_cache.os, "walk", lambda *args, **kwargs: walks.append(1) or real_walk(*args, **kwargs))
+    monkeypatch.setattr(pdf_parser_improved, "_worker_caches", {})
+
+    # Два запроса с разными банками: оба пишут в кэш
+    first = pdf_parser_improved.parse_pdf_cached_request(pdf_bytes, "Kaspi", cache_dir)
+    cache = pdf_parser_improved.get_worker_cache(cache_dir)
+    second = pdf_parser_improved.parse_pdf_cached_request(pdf_bytes, "Other", cache_dir)
+    assert "error" not in first and "error" not in second
+    assert pdf_parser_improved.get_worker_cache(cache_dir) is cache
+    assert len(walks) == 1
+    assert cache.get_operations(cache.key(pdf_bytes), "Other", pdf_parser_improved.PARSER_VERSION,
+                                pdf_parser_improved.select_backend()) is not None
+    print(f"  ✅ Один PdfCache на процесс, обходов каталога: {len(walks)}")
+
 def compare_parsers():
     """Сравнивает старый и новый парсеры"""
     print("\n🧪 Сравнение парсеров...")
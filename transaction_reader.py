@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Потоковое чтение истории транзакций страницами по ключу (operation_date, id) с подкачкой следующей страницы
+"""
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+from supabase_config import get_supabase_client
+from supabase_writer import DEFAULT_RETRIES, DEFAULT_BACKOFF
+
+# Размер страницы не должен превышать max-rows PostgREST (в Supabase по умолчанию 1000):
+# урезанная сервером страница будет принята за последнюю
+DEFAULT_PAGE_SIZE = 1000
+
+# Колонки счетов: фильтр account ищет счет в любой из них
+ACCOUNT_COLUMNS = ("payer_account", "receiver_account", "from_account", "to_account")
+
+# Колонки ключа страницы: всегда добавляются к выбранным
+KEY_COLUMNS = ("operation_date", "id")
+
+DEFAULT_COLUMNS = (
+    "id", "operation_date", "transaction_type", "document_number",
+    "amount_income", "amount_expense", "amount_total",
+    "payer_account", "receiver_account", "from_account", "to_account",
+    "counterparty", "category", "payment_purpose",
+)
+RECENT_COLUMNS = ("id", "operation_date", "transaction_type", "amount_total", "counterparty", "category")
+
+DateLike = Optional[Union[str, date]]
+
+def select_columns(columns: Optional[Sequence[str]]) -> List[str]:
+    """Выбранные колонки плюс колонки ключа страницы; None или "*" — все колонки"""
+    if not columns or "*" in columns:
+        return ["*"]
+    return list(dict.fromkeys([*columns, *KEY_COLUMNS]))
+
+def keyset_condition(last_row: Dict, descending: bool = False) -> str:
+    """Условие PostgREST «строго после last_row» в порядке (operation_date, id)"""
+    op = "lt" if descending else "gt"
+    day, row_id = last_row["operation_date"], last_row["id"]
+    return f"operation_date.{op}.{day},and(operation_date.eq.{day},id.{op}.{row_id})"
+
+def build_page_query(
+    supabase,
+    company_id: str,
+    columns: List[str],
+    page_size: int,
+    after: Optional[Dict] = None,
+    transaction_types: Optional[Iterable[str]] = None,
+    account: Optional[str] = None,
+    start_date: DateLike = None,
+    end_date: DateLike = None,
+    descending: bool = False,
+):
+    """Запрос одной страницы: фильтры, сортировка по ключу и условие после последней строки"""
+    query = supabase.table("transactions").select(",".join(columns)).eq("company_id", company_id)
+    if transaction_types:
+        query = query.in_("transaction_type", list(transaction_types))
+    if start_date:
+        query = query.gte("operation_date", str(start_date))
+    if end_date:
+        query = query.lte("operation_date", str(end_date))
+
+    # Счет и ключ страницы — оба OR-условия, поэтому собираем их в один параметр or
+    conditions = []
+    if account:
+        # Доход и расход хранят свой счет в payer/receiver_account, перевод — в from/to_account
+        conditions.append("or(" + ",".join(f"{column}.eq.{account}" for column in ACCOUNT_COLUMNS) + ")")
+    if after:
+        conditions.append(f"or({keyset_condition(after, descending)})")
+    if conditions:
+        query = query.or_(f"and({','.join(conditions)})")
+
+    return (
+        query
+        .order("operation_date", desc=descending)
+        .order("id", desc=descending)
+        .limit(page_size)
+    )
+
+def iter_transaction_pages(
+    company_id: str,
+    columns: Optional[Sequence[str]] = DEFAULT_COLUMNS,
+    transaction_types: Optional[Iterable[str]] = None,
+    account: Optional[str] = None,
+    start_date: DateLike = None,
+    end_date: DateLike = None,
+    descending: bool = False,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    prefetch: bool = True,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    supabase=None,
+) -> Iterator[List[Dict]]:
+    """Страницы транзакций компании по порядку (operation_date, id)
+
+    Каждая следующая страница начинается строго после последней строки предыдущей,
+    поэтому время запроса не растет с глубиной, в отличие от offset.
+    С prefetch=True следующая страница запрашивается, пока вызывающий код
+    обрабатывает текущую. Упавший запрос страницы повторяется до retries раз.
+    """
+    if page_size <= 0:
+        raise ValueError("page_size должен быть больше нуля")
+    supabase = supabase or get_supabase_client()
+    selected = select_columns(columns)
+    types = list(transaction_types) if transaction_types else None
+
+    def fetch(after: Optional[Dict]) -> List[Dict]:
+        for attempt in range(1, retries + 2):
+            try:
+                result = build_page_query(
+                    supabase, company_id, selected, page_size, after, types,
+                    account, start_date, end_date, descending,
+                ).execute()
+                return result.data or []
+            except Exception:
+                if attempt > retries:
+                    raise
+                time.sleep(backoff * (2 ** (attempt - 1)))
+        return []
+
+    if not prefetch:
+        page = fetch(None)
+        while page:
+            yield page
+            if len(page) < page_size:
+                return
+            page = fetch(page[-1])
+        return
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        pending = executor.submit(fetch, None)
+        while True:
+            page = pending.result()
+            if not page:
+                return
+            # Следующая страница грузится, пока текущая обрабатывается
+            if len(page) == page_size:
+                pending = executor.submit(fetch, page[-1])
+            yield page
+            if len(page) < page_size:
+                return
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def iter_transactions(company_id: str, **kwargs) -> Iterator[Dict]:
+    """Транзакции компании по одной (параметры как у iter_transaction_pages)"""
+    for page in iter_transaction_pages(company_id, **kwargs):
+        yield from page
+
+def export_transactions(rows: Iterable[Dict], output_path: str) -> int:
+    """Пишет строки в CSV или JSON Lines (по расширению файла), возвращает их число"""
+    count = 0
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        if output_path.endswith(".csv"):
+            writer = None
+            for row in rows:
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+                count += 1
+    return count
+
+if __name__ == "__main__":
+    import argparse
+    from parser_improved import COMPANY_NAME, get_company_id
+
+    arg_parser = argparse.ArgumentParser(description="Выгрузка истории транзакций страницами")
+    arg_parser.add_argument("output", help="Файл выгрузки: .csv или .jsonl")
+    arg_parser.add_argument("--from", dest="start_date", help="Начало периода (YYYY-MM-DD)")
+    arg_parser.add_argument("--to", dest="end_date", help="Конец периода (YYYY-MM-DD)")
+    arg_parser.add_argument("--type", dest="types", action="append",
+                            choices=["income", "expense", "transfer"], help="Тип операции (можно несколько)")
+    arg_parser.add_argument("--account", help="Счет (плательщик, получатель или счет перевода)")
+    arg_parser.add_argument("--columns", help="Колонки через запятую (* — все)")
+    arg_parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="Строк на страницу")
+    args = arg_parser.parse_args()
+
+    supabase = get_supabase_client()
+    company_id = get_company_id(COMPANY_NAME, supabase)
+    if not company_id:
+        print(f"❌ Компания {COMPANY_NAME} не найдена в базе данных")
+        raise SystemExit(1)
+
+    columns = args.columns.split(",") if args.columns else DEFAULT_COLUMNS
+    started = time.perf_counter()
+    rows = iter_transactions(
+        company_id, columns=columns, transaction_types=args.types, account=args.account,
+        start_date=args.start_date, end_date=args.end_date, page_size=args.page_size, supabase=supabase,
+    )
+    count = export_transactions(rows, args.output)
+    print(f"💾 Выгружено {count} транзакций в {args.output} за {time.perf_counter() - started:.1f} с")
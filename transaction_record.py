@@ -0,0 +1,143 @@
+"""
+Компактная типизированная запись транзакции вместо словаря с русскими ключами
+"""
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Optional
+
+# Ключи записи парсера -> атрибуты Transaction (в порядке полей словаря)
+RECORD_FIELDS = {
+    "ПолучательНаименование": "receiver_name",
+    "ПлательщикНаименование": "payer_name",
+    "ПлательщикБИН_ИИН": "payer_bin_iin",
+    "ПолучательБИН_ИИН": "receiver_bin_iin",
+    "ПлательщикИИК": "payer_account",
+    "ПолучательИИК": "receiver_account",
+    "НомерДокумента": "document_number",
+    "ДатаОперации": "operation_date",
+    "ДатаДокумента": "document_date",
+    "СуммаРасход": "expense_tiyn",
+    "СуммаПриход": "income_tiyn",
+    "Сумма": "total_tiyn",
+    "НазначениеПлатежа": "payment_purpose",
+    "ВидДокумента": "document_type",
+    "КодНазначенияПлатежа": "payment_code",
+    "ТипТранзакции": "transaction_type",
+    "СчетОткуда": "from_account",
+    "СчетКуда": "to_account",
+    "Счет": "account",
+    "Контрагент": "counterparty",
+    "Категория": "category",
+}
+
+DATE_FIELDS = {"ДатаОперации", "ДатаДокумента"}
+AMOUNT_FIELDS = {"СуммаРасход", "СуммаПриход", "Сумма"}
+
+def parse_record_date(value: str) -> Optional[date]:
+    """Парсит дату записи в формате ДД.ММ.ГГГГ или ГГГГ-ММ-ДД"""
+    for date_format in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def parse_amount_tiyn(value) -> int:
+    """Переводит сумму из строки в тиыны, при ошибке возвращает 0"""
+    if not value:
+        return 0
+    try:
+        amount = Decimal(str(value).replace(" ", "").replace(",", "."))
+    except InvalidOperation:
+        return 0
+    if not amount.is_finite():
+        return 0
+    return int((amount * 100).to_integral_value())
+
+def format_tiyn(tiyn: int) -> str:
+    """Форматирует тиыны как строку суммы ("7000.00"), ноль — пустая строка"""
+    if not tiyn:
+        return ""
+    sign = "-" if tiyn < 0 else ""
+    whole, cents = divmod(abs(tiyn), 100)
+    return f"{sign}{whole}.{cents:02d}"
+
+def format_record_date(value: Optional[date]) -> str:
+    return value.strftime("%d.%m.%Y") if value else ""
+
+@dataclass(slots=True)
+class Transaction:
+    """Операция выписки: даты разобраны, суммы хранятся целыми тиынами"""
+    operation_date: Optional[date] = None
+    document_date: Optional[date] = None
+    expense_tiyn: int = 0
+    income_tiyn: int = 0
+    total_tiyn: int = 0
+    receiver_name: str = ""
+    payer_name: str = ""
+    payer_bin_iin: str = ""
+    receiver_bin_iin: str = ""
+    payer_account: str = ""
+    receiver_account: str = ""
+    document_number: str = ""
+    payment_purpose: str = ""
+    document_type: str = ""
+    payment_code: str = ""
+    transaction_type: str = ""
+    from_account: str = ""
+    to_account: str = ""
+    account: str = ""
+    counterparty: str = ""
+    category: str = ""
+
+    @property
+    def amount_expense(self) -> Decimal:
+        return Decimal(self.expense_tiyn) / 100
+
+    @property
+    def amount_income(self) -> Decimal:
+        return Decimal(self.income_tiyn) / 100
+
+    @classmethod
+    def from_record(cls, record: Dict[str, str]) -> "Transaction":
+        """Создает Transaction из словаря в формате парсера"""
+        transaction = cls()
+        for key, attr in RECORD_FIELDS.items():
+            value = record.get(key)
+            if key in AMOUNT_FIELDS:
+                setattr(transaction, attr, parse_amount_tiyn(value))
+            elif not value:
+                continue
+            elif key in DATE_FIELDS:
+                setattr(transaction, attr, parse_record_date(value))
+            else:
+                setattr(transaction, attr, value)
+        return transaction
+
+    def to_record(self) -> Dict[str, str]:
+        """Возвращает словарь в формате parse_1c_files_improved"""
+        record = {}
+        for key, attr in RECORD_FIELDS.items():
+            value = getattr(self, attr)
+            if key in AMOUNT_FIELDS:
+                record[key] = format_tiyn(value)
+            elif key in DATE_FIELDS:
+                record[key] = format_record_date(value)
+            else:
+                record[key] = value
+        return record
+
+    def dedup_key(self) -> tuple:
+        """Ключ для удаления дублей между файлами"""
+        return (
+            self.operation_date,
+            self.expense_tiyn or self.income_tiyn,
+            self.transaction_type,
+            self.counterparty,
+            self.document_number,
+        )
+
+def as_transaction(record) -> Transaction:
+    """Принимает Transaction или словарь в формате парсера"""
+    return record if isinstance(record, Transaction) else Transaction.from_record(record)
@@ -0,0 +1,105 @@
+"""
+Статистика за период из сводок по дням transaction_rollups, которые ведут триггеры таблицы transactions
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Union
+
+from supabase_config import get_supabase_client
+
+ROLLUP_DIMENSIONS = ("total", "category", "counterparty")
+# Сколько дней забирается за один запрос get_daily_totals (лимит строк PostgREST — 1000)
+DAILY_PAGE_DAYS = 1000
+
+EMPTY_STATS = {"total_income": 0, "total_expense": 0, "net_amount": 0, "transaction_count": 0}
+
+DateLike = Optional[Union[str, date]]
+
+def date_param(value: DateLike) -> Optional[str]:
+    """Дата для RPC: date или строка YYYY-MM-DD"""
+    if isinstance(value, date):
+        return value.isoformat()
+    return value or None
+
+def get_period_stats(company_id: Optional[str], start_date: DateLike = None, end_date: DateLike = None,
+                     supabase=None) -> Dict:
+    """Доходы, расходы, сальдо и число операций за период (None — без границы)"""
+    supabase = supabase or get_supabase_client()
+    result = supabase.rpc("get_transaction_stats", {
+        "company_uuid": company_id,
+        "start_date": date_param(start_date),
+        "end_date": date_param(end_date),
+    }).execute()
+    return result.data[0] if result.data else dict(EMPTY_STATS)
+
+def get_period_breakdown(company_id: str, dimension: str = "category", start_date: DateLike = None,
+                         end_date: DateLike = None, limit: int = 20, supabase=None) -> List[Dict]:
+    """Обороты за период по категориям или контрагентам, крупные первыми"""
+    if dimension not in ROLLUP_DIMENSIONS[1:]:
+        raise ValueError(f"Неизвестное измерение сводки: {dimension}")
+    supabase = supabase or get_supabase_client()
+    result = supabase.rpc("get_transaction_breakdown", {
+        "company_uuid": company_id,
+        "breakdown_dimension": dimension,
+        "start_date": date_param(start_date),
+        "end_date": date_param(end_date),
+        "max_rows": limit,
+    }).execute()
+    return result.data or []
+
+def get_daily_totals(company_id: str, start_date: DateLike = None, end_date: DateLike = None,
+                     supabase=None) -> List[Dict]:
+    """Обороты по дням за период; длинные периоды запрашиваются страницами по дням"""
+    supabase = supabase or get_supabase_client()
+    days: List[Dict] = []
+    page_start = date_param(start_date)
+    while True:
+        result = supabase.rpc("get_transaction_daily_totals", {
+            "company_uuid": company_id,
+            "start_date": page_start,
+            "end_date": date_param(end_date),
+        }).execute()
+        page = result.data or []
+        days.extend(page)
+        if len(page) < DAILY_PAGE_DAYS:
+            return days
+        # Следующая страница начинается со дня после последнего полученного
+        page_start = (date.fromisoformat(page[-1]["day"]) + timedelta(days=1)).isoformat()
+
+def rebuild_rollups(company_id: Optional[str] = None, supabase=None) -> int:
+    """Пересчитывает сводки из transactions (первичное заполнение, сверка); None — все компании"""
+    supabase = supabase or get_supabase_client()
+    result = supabase.rpc("rebuild_transaction_rollups", {"company_uuid": company_id}).execute()
+    return int(result.data or 0)
+
+if __name__ == "__main__":
+    import argparse
+    from parser_improved import COMPANY_NAME, get_company_id
+
+    arg_parser = argparse.ArgumentParser(description="Статистика операций из сводок по дням")
+    arg_parser.add_argument("--from", dest="start_date", help="Начало периода (YYYY-MM-DD)")
+    arg_parser.add_argument("--to", dest="end_date", help="Конец периода (YYYY-MM-DD)")
+    arg_parser.add_argument("--by", choices=ROLLUP_DIMENSIONS[1:], help="Разбивка по категориям или контрагентам")
+    arg_parser.add_argument("--rebuild", action="store_true", help="Пересчитать сводки из transactions")
+    args = arg_parser.parse_args()
+
+    supabase = get_supabase_client()
+    company_id = get_company_id(COMPANY_NAME, supabase)
+    if not company_id:
+        print(f"❌ Компания {COMPANY_NAME} не найдена в базе данных")
+        raise SystemExit(1)
+
+    if args.rebuild:
+        print(f"🔄 Пересчитано строк сводок: {rebuild_rollups(company_id, supabase)}")
+
+    stats = get_period_stats(company_id, args.start_date, args.end_date, supabase)
+    print("📊 Статистика за период:")
+    print(f"   💰 Доходы: {stats['total_income']}")
+    print(f"   💸 Расходы: {stats['total_expense']}")
+    print(f"   📈 Сальдо: {stats['net_amount']}")
+    print(f"   📄 Операций: {stats['transaction_count']}")
+
+    if args.by:
+        print(f"\n🏷️ Разбивка ({args.by}):")
+        for row in get_period_breakdown(company_id, args.by, args.start_date, args.end_date, supabase=supabase):
+            print(f"   {row['dimension_value'] or '—':<40} +{row['total_income']} -{row['total_expense']} "
+                  f"({row['transaction_count']})")